@@ -9,15 +9,31 @@ from celery.result import AsyncResult
 from flask_cors import CORS
 import shutil
 import threading
+import queue
 import tempfile
 import re
 import subprocess
-from datetime import datetime
 import glob
+import hashlib
+from urllib.parse import quote
 
 # 直接导入（用于Docker环境）
 from celery_config import celery  # 直接使用celery_config中的celery实例
-from tasks import transcribe_audio, get_audio_duration
+from tasks import (
+    transcribe_audio, lookup_transcript_cache, add_file_refs, release_file_ref,
+    get_task_metrics, get_cache_stats, RECOGNITION_BACKEND, RECOGNITION_ENGINES, LOCAL_ASR_QUEUE
+)
+from timings import TranscriptTimings, EXPORT_FORMATS
+from audio_utils import read_wav_header
+from logstore import (
+    task_log_key, make_log_entry, append_log, read_logs, clear_logs, migrate_legacy_logs,
+    GENERAL_LOG_KEY, LEGACY_GENERAL_LOG_KEY
+)
+from progress_events import EventHub, task_event_channel
+from task_index import (
+    register_task, unregister_task, ensure_task_index, page_task_ids, fetch_tasks, task_cursor,
+    TASK_INDEX_KEY, TASK_STATUSES, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+)
 
 app = Flask(__name__, static_folder='static')
 CORS(app)  # 添加CORS支持，允许跨域请求
@@ -27,6 +43,18 @@ REDIS_HOST = os.environ.get('REDIS_HOST', 'localhost')
 REDIS_PORT = int(os.environ.get('REDIS_PORT', 6379))
 redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0)
 
+# 进度事件推送：本进程所有SSE连接共用一个Redis订阅
+event_hub = EventHub(redis_client)
+
+# SSE连接上没有事件时发送心跳的间隔（秒），以及单个连接的最长保持时间（秒）；
+# 每个连接占用一个请求线程，保持时间较短，到期后浏览器按 retry 间隔自动重连并带回 Last-Event-ID
+STREAM_KEEPALIVE_SECONDS = 15
+STREAM_MAX_SECONDS = 30
+STREAM_RETRY_MILLISECONDS = 1000
+
+# 搜索任务时每批读取的任务数
+SEARCH_BATCH_SIZE = 200
+
 # 转换任务ID存储
 task_storage = {}  # 简单起见，使用内存存储，生产环境应使用Redis或数据库
 
@@ -67,6 +95,75 @@ def get_file_type(file):
     
     return None
 
+def save_upload_with_hash(uploaded_file, file_path, chunk_size=1024 * 1024):
+    """边写入磁盘边计算上传文件的SHA-256，返回十六进制内容哈希"""
+    digest = hashlib.sha256()
+    with open(file_path, 'wb') as f:
+        while True:
+            chunk = uploaded_file.stream.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+            f.write(chunk)
+    return digest.hexdigest()
+
+def resolve_recognition_engine(requested):
+    """解析请求指定的识别后端，未指定时使用默认后端；不支持的值返回None"""
+    engine = (requested or '').strip().lower() or RECOGNITION_BACKEND
+    return engine if engine in RECOGNITION_ENGINES else None
+
+def transcribe_queue_options(engine):
+    """本地识别引擎的任务发送到本地识别Worker的专用队列"""
+    return {'queue': LOCAL_ASR_QUEUE} if engine == 'local' else {}
+
+def create_cached_task(cache_entry, task_info):
+    """
+    转写结果缓存命中时，直接创建一个已完成的任务，关联到已有的TXT和处理后的音频
+    
+    Args:
+        cache_entry: lookup_transcript_cache 返回的缓存条目
+        task_info: 新任务的基本信息
+        
+    Returns:
+        str: 新任务ID
+    """
+    task_id = str(uuid.uuid4())
+    task_info = dict(task_info)
+    task_info['txt_file'] = cache_entry.get('txt_file')
+    task_info['cached_from'] = cache_entry.get('task_id')
+    if cache_entry.get('processed_audio_file'):
+        task_info['processed_audio_file'] = cache_entry['processed_audio_file']
+    if cache_entry.get('timings_file'):
+        task_info['timings_file'] = cache_entry['timings_file']
+    if not task_info.get('original_duration'):
+        task_info['original_duration'] = cache_entry.get('original_duration', 0)
+    
+    now = time.time()
+    pipe = redis_client.pipeline()
+    pipe.hset(f'task:{task_id}', mapping={
+        'info': json.dumps(task_info),
+        'progress_data': json.dumps({
+            'status': 'completed',
+            'progress': 100,
+            'updated_at': now,
+            'current_text': cache_entry.get('text', '')
+        }),
+        'result': json.dumps({
+            'status': 'success',
+            'text': cache_entry.get('text', '')
+        })
+    })
+    pipe.expire(f'task:{task_id}', 60 * 60 * 24 * 7)
+    register_task(redis_client, task_id, task_info.get('created_at', now), status='completed', pipe=pipe)
+    append_log(redis_client, task_log_key(task_id), make_log_entry(
+        f"相同内容的文件已转写过，直接复用任务 {cache_entry.get('task_id')} 的结果", 'success', timestamp=now
+    ), pipe=pipe)
+    pipe.execute()
+    
+    add_file_refs(task_id, [task_info.get('txt_file'), task_info.get('processed_audio_file'), task_info.get('timings_file')])
+    app.logger.info(f"[Transcript Cache] 命中缓存，任务 {task_id} 复用任务 {cache_entry.get('task_id')} 的结果")
+    return task_id
+
 @app.route('/api/transcribe', methods=['POST'])
 def transcribe():
     if 'audio' not in request.files:
@@ -86,14 +183,19 @@ def transcribe():
     shared_dir = os.path.join(os.getcwd(), 'shared_data')
     os.makedirs(shared_dir, exist_ok=True)
     persistent_temp_filename = os.path.join(shared_dir, f"transcribe_orig_{audio_uuid}{original_extension}")
-    uploaded_file.save(persistent_temp_filename)
+    content_hash = save_upload_with_hash(uploaded_file, persistent_temp_filename)
 
-    # 获取原始文件时长
-    original_duration = get_audio_duration(persistent_temp_filename)
+    # 原始文件时长由Worker探测（结果写入共享的探测缓存），不在请求线程中调用ffprobe
+    original_duration = 0.0
     
     # 获取语言设置
     language = request.form.get('language', 'ja-JP')
     
+    # 获取识别后端（azure / local），未指定时使用默认后端
+    engine = resolve_recognition_engine(request.form.get('engine'))
+    if engine is None:
+        return jsonify({'error': '不支持的识别后端', 'code': 'INVALID_ENGINE'}), 400
+    
     # 获取用户提供的API设置
     user_api_key = request.form.get('api_key', '')
     user_api_region = request.form.get('api_region', '')
@@ -116,25 +218,13 @@ def transcribe():
     api_key = user_api_key
     api_region = user_api_region
     
-    # 检查是否提供了API信息
-    if not api_key or not api_region:
+    # 检查是否提供了API信息（本地识别引擎不需要）
+    if engine != 'local' and (not api_key or not api_region):
         return jsonify({
             'error': '未设置API密钥和区域', 
             'code': 'NO_API_SETTINGS'
         }), 400
     
-    # 启动异步任务，传递API设置和并行处理参数
-    task = transcribe_audio.delay(
-        persistent_temp_filename, # 使用持久化的文件路径
-        language, 
-        file_type, 
-        api_key, 
-        api_region,
-        parallel_threads,
-        segment_length,
-        original_duration # 传递原始时长
-    )
-    
     # 在Redis中存储任务的基本信息
     task_info = {
         'file': persistent_temp_filename, # 存储的是Celery任务将处理的文件路径
@@ -145,12 +235,44 @@ def transcribe():
         'api_region': api_region,
         'parallel_threads': parallel_threads,
         'segment_length': segment_length,
-        'original_duration': original_duration
+        'original_duration': original_duration,
+        'content_hash': content_hash,
+        'engine': engine
     }
     if formatted_browser_time:
         task_info['filename_timestamp_override'] = formatted_browser_time
     
-    redis_client.hset(f'task:{task.id}', 'info', json.dumps(task_info))
+    # 相同内容、语言和识别选项已有转写结果时，直接返回已完成的任务
+    cache_entry = lookup_transcript_cache(content_hash, language, engine)
+    if cache_entry:
+        task_info.pop('file')
+        task_id = create_cached_task(cache_entry, task_info)
+        os.remove(persistent_temp_filename)
+        return jsonify({
+            'task_id': task_id,
+            'status': 'completed',
+            'cached': True,
+            'file_type': file_type,
+            'parallel_threads': parallel_threads
+        })
+    
+    # 预先生成任务ID，保证Worker启动时任务信息已经写入Redis
+    task_id = str(uuid.uuid4())
+    
+    redis_client.hset(f'task:{task_id}', 'info', json.dumps(task_info))
+    register_task(redis_client, task_id, task_info['created_at'])
+    
+    # 启动异步任务，传递API设置和并行处理参数
+    task = transcribe_audio.apply_async(args=(
+        persistent_temp_filename, # 使用持久化的文件路径
+        language, 
+        file_type, 
+        api_key, 
+        api_region,
+        parallel_threads,
+        segment_length,
+        original_duration # 传递原始时长（0表示由Worker探测）
+    ), kwargs={'engine': engine, 'content_hash': content_hash}, task_id=task_id, **transcribe_queue_options(engine))
     
     return jsonify({
         'task_id': task.id,
@@ -162,6 +284,10 @@ def transcribe():
 @app.route('/api/status/<task_id>', methods=['GET'])
 def get_task_status(task_id):
     """获取转换任务的状态"""
+    return jsonify(_task_status_payload(task_id))
+
+def _task_status_payload(task_id):
+    """任务状态（/api/status 的返回内容，SSE连接建立时也作为第一条事件）"""
     # 首先尝试从Redis获取进度信息
     progress_data = redis_client.hget(f'task:{task_id}', 'progress_data')
     task_info_data = redis_client.hget(f'task:{task_id}', 'info')
@@ -180,36 +306,40 @@ def get_task_status(task_id):
             result_data = redis_client.hget(f'task:{task_id}', 'result')
             if result_data:
                 result = json.loads(result_data)
-                return jsonify({
+                return {
                     'status': 'completed',
                     'result': result,
                     'progress': 100,
+                    'metrics': get_task_metrics(task_id),
                     'file_info': {
                         'name': task_info.get('original_name', '未知文件'),
                         'type': task_info.get('file_type', 'unknown')
                     }
-                })
+                }
             
         elif progress_info.get('status') == 'failed':
-            return jsonify({
+            return {
                 'status': 'failed',
                 'error': progress_info.get('error', '任务处理失败'),
                 'file_info': {
                     'name': task_info.get('original_name', '未知文件'),
                     'type': task_info.get('file_type', 'unknown')
                 }
-            })
+            }
         
-        # 处理中，返回进度和当前文本
-        return jsonify({
+        # 处理中，返回进度、当前文本和从开头起已识别的部分文本
+        partial_text = redis_client.hget(f'task:{task_id}', 'partial_text')
+        return {
             'status': 'processing',
             'progress': progress_info.get('progress', 0),
             'current_text': progress_info.get('current_text', ''),
+            'partial_text': partial_text.decode('utf-8') if partial_text else '',
+            'metrics': get_task_metrics(task_id),
             'file_info': {
                 'name': task_info.get('original_name', '未知文件'),
                 'type': task_info.get('file_type', 'unknown')
             }
-        })
+        }
     
     # Redis中没有信息，使用Celery检查
     task_result = AsyncResult(task_id, app=celery)
@@ -217,101 +347,146 @@ def get_task_status(task_id):
     if task_result.ready():
         if task_result.successful():
             result = task_result.get()
-            return jsonify({
+            return {
                 'status': 'completed',
                 'result': result,
                 'progress': 100
-            })
+            }
         else:
             error = str(task_result.result)
-            return jsonify({
+            return {
                 'status': 'failed',
                 'error': error,
                 'progress': 0
-            })
+            }
     else:
-        return jsonify({
+        return {
             'status': 'processing',
             'progress': 0
-        })
+        }
+
+def sse_event(payload):
+    """格式化一条SSE数据事件，事件ID为内容摘要，浏览器重连时以 Last-Event-ID 带回"""
+    event_id = hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()[:16]
+    return event_id, f"id: {event_id}\ndata: {json.dumps(payload)}\n\n"
 
 @app.route('/api/stream/<task_id>', methods=['GET'])
 def stream_progress(task_id):
     """
     提供Server-Sent Events流，实时推送任务进度
-    注意：前端已不再使用该接口，但保留以备将来需要
+    
+    连接建立时先推送一次当前状态（与 /api/status 相同），之后推送Worker发布的进度事件，
+    任务完成或失败时推送完整的最终状态后结束。等待事件期间不访问Redis，只定期发送心跳。
+    连接最多保持 STREAM_MAX_SECONDS 秒，浏览器重连时若当前状态与最后收到的事件相同则不再重复推送。
     """
+    last_event_id = request.headers.get('Last-Event-ID')
+    
     def generate():
-        last_update = None
-        retry_count = 0
-        max_retries = 3600  # 最多推送1小时
-        
-        while retry_count < max_retries:
-            # 获取最新进度
-            progress_data = redis_client.hget(f'task:{task_id}', 'progress_data')
+        # 先订阅再读取当前状态，读取期间发布的事件不会丢失
+        subscriber = event_hub.subscribe(task_id)
+        try:
+            yield f"retry: {STREAM_RETRY_MILLISECONDS}\n\n"
+            state = _task_status_payload(task_id)
+            event_id, event = sse_event(state)
+            finished = state['status'] in ('completed', 'failed')
+            if event_id != last_event_id or finished:
+                yield event
+            if finished:
+                return
             
-            if progress_data:
-                progress_info = json.loads(progress_data)
+            deadline = time.time() + STREAM_MAX_SECONDS
+            while time.time() < deadline:
+                try:
+                    event = subscriber.get(timeout=STREAM_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
                 
-                # 如果有新的更新或第一次推送
-                if last_update != progress_data:
-                    last_update = progress_data
-                    
-                    # 格式化为SSE事件
-                    yield f"data: {json.dumps(progress_info)}\n\n"
-                    
-                    # 如果任务已完成或失败，结束流
-                    if progress_info.get('status') in ['completed', 'failed']:
-                        break
-            
-            # 休眠1秒
-            time.sleep(1)
-            retry_count += 1
-        
-        # 确保客户端知道流已结束
-        yield "data: {\"status\": \"stream_ended\"}\n\n"
-    
-    return Response(generate(), mimetype='text/event-stream')
+                status = event.get('status')
+                if status in ('completed', 'failed'):
+                    yield sse_event(_task_status_payload(task_id))[1]
+                    return
+                if status == 'deleted':
+                    yield sse_event({'status': 'deleted'})[1]
+                    return
+                
+                # 进度事件为 progress_data，部分文本事件只有 partial_text，合并到上一次推送的状态中
+                if 'progress' in event:
+                    state['progress'] = event['progress']
+                    state['current_text'] = event.get('current_text', '')
+                if 'partial_text' in event:
+                    state['partial_text'] = event['partial_text']
+                yield sse_event(state)[1]
+        finally:
+            event_hub.unsubscribe(task_id, subscriber)
+    
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/api/tasks', methods=['GET'])
 def get_all_tasks():
-    """获取所有任务列表"""
-    tasks = []
-    task_keys = redis_client.keys('task:*')
+    """
+    按创建时间倒序分页列出任务
     
-    for key in task_keys:
-        task_id = key.decode('utf-8').split(':')[1]
-        task_info_data = redis_client.hget(f'task:{task_id}', 'info')
-        progress_data = redis_client.hget(f'task:{task_id}', 'progress_data')
-        
-        if task_info_data and progress_data:
-            task_info = json.loads(task_info_data)
-            progress_info = json.loads(progress_data)
-            
-            result_text = None
-            if progress_info.get('status') == 'completed':
-                result_data = redis_client.hget(f'task:{task_id}', 'result')
-                if result_data:
-                    result = json.loads(result_data)
-                    result_text = result.get('text', '')
-            
-            tasks.append({
-                'id': task_id,
-                'file_name': task_info.get('original_name', '未知文件'),
-                'file_type': task_info.get('file_type', 'unknown'),
-                'status': progress_info.get('status', 'processing'),
-                'progress': progress_info.get('progress', 0),
-                'created_at': task_info.get('created_at'),
-                'result': result_text,
-                'language': task_info.get('language', 'zh-CN'),
-                'original_duration': task_info.get('original_duration', 0),
-                'processed_audio_file': task_info.get('processed_audio_file')
-            })
-    
-    tasks.sort(key=lambda x: x.get('created_at', 0), reverse=True)
-    return jsonify(tasks)
+    查询参数: limit 每页条数，cursor 上一页返回的 next_cursor，status 只列出该状态（processing/completed/failed）的任务
+    返回: {'tasks': [...], 'next_cursor': 下一页游标，没有更多任务时为null}
+    """
+    status = request.args.get('status') or None
+    if status and status not in TASK_STATUSES:
+        return jsonify({'error': '不支持的任务状态'}), 400
+    
+    ensure_task_index(redis_client)
+    task_ids, next_cursor = page_task_ids(redis_client, request.args.get('cursor'), _page_size(), status)
+    tasks = []
+    for task_id, fields in zip(task_ids, fetch_tasks(redis_client, task_ids)):
+        item = _task_list_item(task_id, fields)
+        if item:
+            tasks.append(item)
+    return jsonify({'tasks': tasks, 'next_cursor': next_cursor})
+
+def _page_size():
+    """请求中的每页条数（limit），限制在 1 到 MAX_PAGE_SIZE 之间"""
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        limit = DEFAULT_PAGE_SIZE
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+def _task_list_item(task_id, fields):
+    """由任务哈希的 info/progress_data/result 字段生成任务列表中的一项；任务尚未开始处理时返回None"""
+    if not fields or not fields.get('info') or not fields.get('progress_data'):
+        return None
+    task_info = json.loads(fields['info'])
+    progress_info = json.loads(fields['progress_data'])
+    
+    result_text = None
+    if progress_info.get('status') == 'completed' and fields.get('result'):
+        result = json.loads(fields['result'])
+        result_text = result.get('text', '')
+    
+    return {
+        'id': task_id,
+        'file_name': task_info.get('original_name', '未知文件'),
+        'file_type': task_info.get('file_type', 'unknown'),
+        'status': progress_info.get('status', 'processing'),
+        'progress': progress_info.get('progress', 0),
+        'created_at': task_info.get('created_at'),
+        'result': result_text,
+        'language': task_info.get('language', 'zh-CN'),
+        'original_duration': task_info.get('original_duration', 0),
+        'processed_audio_file': task_info.get('processed_audio_file'),
+        'timings_file': task_info.get('timings_file')
+    }
 
 # 添加API测试端点
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """返回各缓存（媒体探测、整文件转写、分段识别）的命中率与条目数"""
+    try:
+        return jsonify({'status': 'success', 'stats': get_cache_stats()})
+    except Exception as e:
+        return jsonify({'status': 'error', 'error': f'获取缓存统计失败: {str(e)}'}), 500
+
 @app.route('/api/test-connection', methods=['POST'])
 def test_connection():
     """测试Azure API连接"""
@@ -365,21 +540,17 @@ def test_connection():
 def cleanup_old_tasks():
     current_time = time.time()
     
-    # 1. 清理过期的Redis任务记录
-    task_keys = redis_client.keys('task:*')
-    for key in task_keys:
-        task_id = key.decode('utf-8').split(':')[1]
-        task_info_data = redis_client.hget(f'task:{task_id}', 'info')
-        if task_info_data:
-            task_info = json.loads(task_info_data)
-            created_at = task_info.get('created_at', 0)
-            if current_time - created_at > 86400 * 7:  # 7天后清理
-                try:
-                    # 使用delete_task_route函数来清理所有相关文件
-                    delete_task_route(task_id)
-                    app.logger.info(f"自动清理：已删除过期任务 {task_id}")
-                except Exception as e:
-                    app.logger.error(f"自动清理：删除过期任务 {task_id} 失败: {str(e)}")
+    # 1. 清理过期的Redis任务记录（按创建时间索引直接取出7天前创建的任务）
+    ensure_task_index(redis_client)
+    expired_ids = redis_client.zrangebyscore(TASK_INDEX_KEY, '-inf', current_time - 86400 * 7)
+    for member in expired_ids:
+        task_id = member.decode('utf-8')
+        try:
+            # 使用delete_task_route函数来清理所有相关文件
+            delete_task_route(task_id)
+            app.logger.info(f"自动清理：已删除过期任务 {task_id}")
+        except Exception as e:
+            app.logger.error(f"自动清理：删除过期任务 {task_id} 失败: {str(e)}")
     
     # 2. 清理临时目录
     try:
@@ -493,6 +664,34 @@ def generate_txt(task_id):
         app.logger.error(f"[/api/generate-txt {task_id}] Error generating TXT download info: {str(e)}", exc_info=True)
         return jsonify({'status': 'error', 'error': f'提供TXT下载链接时出错: {str(e)}'}), 500
 
+@app.route('/api/export/<task_id>/<fmt>', methods=['GET'])
+def export_transcript(task_id, fmt):
+    """按句子/词级时间轴导出 srt、vtt 或 json，逐句流式输出"""
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': '不支持的导出格式'}), 400
+    
+    task_info_data = redis_client.hget(f'task:{task_id}', 'info')
+    if not task_info_data:
+        return jsonify({'error': '任务未找到'}), 404
+    task_info = json.loads(task_info_data)
+    
+    timings_file = task_info.get('timings_file')
+    timings_path = os.path.join(os.getcwd(), 'downloads', timings_file) if timings_file else None
+    if not timings_path or not os.path.exists(timings_path):
+        return jsonify({'error': '该任务没有时间轴数据'}), 404
+    
+    try:
+        timings = TranscriptTimings.load(timings_path)
+    except ValueError as e:
+        app.logger.error(f"[/api/export {task_id}] Invalid timings file {timings_path}: {e}")
+        return jsonify({'error': '时间轴数据已损坏'}), 500
+    
+    generate, mimetype = EXPORT_FORMATS[fmt]
+    download_name = f"{os.path.splitext(task_info.get('original_name') or task_id)[0]}.{fmt}"
+    return Response(generate(timings), mimetype=f'{mimetype}; charset=utf-8', headers={
+        'Content-Disposition': f"attachment; filename*=UTF-8''{quote(download_name)}"
+    })
+
 @app.route('/api/download/<path:filename>', methods=['GET']) # Use <path:filename> to allow slashes
 def download_file(filename):
     # filename is now expected to be like "text/some.txt" or "audio/some.wav"
@@ -518,6 +717,16 @@ def download_file(filename):
     
     return send_file(file_path, as_attachment=True)
 
+def remove_empty_task_download_dir(relative_path):
+    """删除结果文件后移除已经为空的任务目录（downloads/<类型>/<任务ID>）；旧版本直接放在类型目录下的文件不处理"""
+    parts = os.path.normpath(relative_path).split(os.sep)
+    if len(parts) != 3:
+        return
+    try:
+        os.rmdir(os.path.join('downloads', parts[0], parts[1]))
+    except OSError:
+        pass
+
 @app.route('/api/delete-task/<task_id>', methods=['DELETE'])
 def delete_task_route(task_id):
     try:
@@ -527,6 +736,7 @@ def delete_task_route(task_id):
 
         if not task_info_json and not task_result_json : # 如果两个都不存在，说明任务ID无效
             app.logger.warning(f"[Delete Task {task_id}] Task not found in Redis (no info and no result).")
+            unregister_task(redis_client, task_id) # 任务记录已过期时索引中可能还有残留
             return jsonify({'status': 'error', 'message': '任务未找到'}), 404
 
         task_info = {}
@@ -536,11 +746,15 @@ def delete_task_route(task_id):
 
         # 1. 删除处理后的音频文件 (downloads/audio/)
         processed_audio_relative_path = task_info.get('processed_audio_file')
-        if processed_audio_relative_path:
+        if processed_audio_relative_path and not release_file_ref(task_id, processed_audio_relative_path):
+            # 其他任务（转写结果缓存命中）仍在使用该文件
+            app.logger.info(f"[Delete Task {task_id}] Processed audio file is still referenced by other tasks, keeping: {processed_audio_relative_path}")
+        elif processed_audio_relative_path:
             full_audio_path = os.path.join('downloads', processed_audio_relative_path)
             if os.path.exists(full_audio_path):
                 try:
                     os.remove(full_audio_path)
+                    remove_empty_task_download_dir(processed_audio_relative_path)
                     app.logger.info(f"[Delete Task {task_id}] Successfully deleted processed audio file: {full_audio_path}")
                 except Exception as e:
                     app.logger.error(f"[Delete Task {task_id}] Failed to delete processed audio file {full_audio_path}: {e}")
@@ -553,7 +767,10 @@ def delete_task_route(task_id):
         txt_file_relative_path = task_info.get('txt_file') 
         app.logger.info(f"[Delete Task {task_id}] Attempting to delete TXT. Relative path from Redis ('txt_file'): {txt_file_relative_path}")
 
-        if txt_file_relative_path:
+        if txt_file_relative_path and not release_file_ref(task_id, txt_file_relative_path):
+            # 其他任务（转写结果缓存命中）仍在使用该文件
+            app.logger.info(f"[Delete Task {task_id}] TXT file is still referenced by other tasks, keeping: {txt_file_relative_path}")
+        elif txt_file_relative_path:
             full_txt_path = os.path.join('downloads', txt_file_relative_path) 
             app.logger.info(f"[Delete Task {task_id}] Calculated full_txt_path for TXT: {full_txt_path}")
             
@@ -563,6 +780,7 @@ def delete_task_route(task_id):
             if path_exists:
                 try:
                     os.remove(full_txt_path)
+                    remove_empty_task_download_dir(txt_file_relative_path)
                     app.logger.info(f"[Delete Task {task_id}] Successfully deleted TXT file: {full_txt_path}")
                 except Exception as e:
                     app.logger.error(f"[Delete Task {task_id}] Failed to delete TXT file {full_txt_path}: {e}")
@@ -571,6 +789,18 @@ def delete_task_route(task_id):
         else:
             app.logger.info(f"[Delete Task {task_id}] 'txt_file' field not found in task_info. Cannot determine TXT file to delete.")
         
+        # 删除时间轴文件 (downloads/timings/)，其他任务仍在引用时保留
+        timings_relative_path = task_info.get('timings_file')
+        if timings_relative_path and release_file_ref(task_id, timings_relative_path):
+            full_timings_path = os.path.join('downloads', timings_relative_path)
+            if os.path.exists(full_timings_path):
+                try:
+                    os.remove(full_timings_path)
+                    remove_empty_task_download_dir(timings_relative_path)
+                    app.logger.info(f"[Delete Task {task_id}] Successfully deleted timings file: {full_timings_path}")
+                except Exception as e:
+                    app.logger.error(f"[Delete Task {task_id}] Failed to delete timings file {full_timings_path}: {e}")
+        
         # 3. 删除Celery任务处理长音频时产生的临时分段目录
         segment_temp_dir_name = task_info.get('segment_temp_dir')
         if segment_temp_dir_name:
@@ -616,8 +846,13 @@ def delete_task_route(task_id):
                                 except Exception as e:
                                     app.logger.error(f"[Delete Task {task_id}] Failed to delete uploads directory {full_subdir_path}: {e}")
         
-        # 6. 从Redis删除任务记录
+        # 6. 从Redis删除任务记录（以及任务级统计指标、分段汇合计数）
+        redis_client.delete(f'metrics:{task_id}', f'segments:{task_id}', f'segment_backlog:{task_id}', f'partial_segments:{task_id}',
+                            task_log_key(task_id))
         deleted_keys = redis_client.delete(f'task:{task_id}')
+        unregister_task(redis_client, task_id)
+        # 通知正在订阅该任务进度的页面结束订阅
+        redis_client.publish(task_event_channel(task_id), json.dumps({'status': 'deleted'}))
         if deleted_keys > 0:
             app.logger.info(f"[Delete Task {task_id}] Successfully deleted task record from Redis: task:{task_id}")
         else:
@@ -641,14 +876,16 @@ def check_file_format():
     os.makedirs(temp_dir, exist_ok=True)
     original_filename = uploaded_file.filename
     file_path = os.path.join(temp_dir, original_filename)
-    uploaded_file.save(file_path)
+    content_hash = save_upload_with_hash(uploaded_file, file_path)
     
     # 获取MIME类型
     mime_type = mimetypes.guess_type(original_filename)[0]
     extension = os.path.splitext(original_filename)[1].lower()
     
-    # 获取原始文件时长
-    original_file_duration = get_audio_duration(file_path)
+    # 获取原始文件时长：只解析WAV文件头，不在请求线程中调用ffprobe；
+    # 其他格式返回0，由Worker识别前探测（转换后的WAV同样只需解析文件头）
+    wav_header = read_wav_header(file_path)
+    original_file_duration = wav_header['duration'] if wav_header else 0.0
     
     # 检查是否为视频
     is_video = False
@@ -673,7 +910,8 @@ def check_file_format():
         'original_file': file_path,
         'output_file': None,
         'original_filename': original_filename,
-        'original_duration': original_file_duration
+        'original_duration': original_file_duration,
+        'content_hash': content_hash
     }
     
     # 返回检查结果
@@ -713,6 +951,7 @@ def convert_file(conversion_id):
     status_data['progress'] = 0
     status_data['message'] = '开始转换'
     status_data['output_file'] = output_file
+    _notify_conversion(conversion_id)
     
     # 在后台线程中执行转换
     thread = threading.Thread(
@@ -757,6 +996,7 @@ def run_conversion(conversion_id, input_file, output_file):
         
         # 读取进度信息
         conversion_status[conversion_id]['message'] = '转换中...' + ('从视频提取音频' if is_video else '转换音频格式')
+        _notify_conversion(conversion_id)
         
         # 跟踪进度
         duration_seconds = None
@@ -780,8 +1020,7 @@ def run_conversion(conversion_id, input_file, output_file):
                         hours, minutes, seconds = map(float, match.groups())
                         current_seconds = hours * 3600 + minutes * 60 + seconds
                         progress = min(99, int((current_seconds / duration_seconds) * 100))
-                        conversion_status[conversion_id]['progress'] = progress
-                        conversion_status[conversion_id]['message'] = f'转换中...{progress}%'
+                        _update_conversion_progress(conversion_id, progress)
             
             # 检查进度的另一种方法
             if line.startswith('frame=') and duration_seconds:
@@ -791,8 +1030,7 @@ def run_conversion(conversion_id, input_file, output_file):
                     hours, minutes, seconds = map(float, time_match.groups())
                     current_seconds = hours * 3600 + minutes * 60 + seconds
                     progress = min(99, int((current_seconds / duration_seconds) * 100))
-                    conversion_status[conversion_id]['progress'] = progress
-                    conversion_status[conversion_id]['message'] = f'转换中...{progress}%'
+                    _update_conversion_progress(conversion_id, progress)
         
         # 等待进程完成
         process.wait()
@@ -806,10 +1044,33 @@ def run_conversion(conversion_id, input_file, output_file):
             stderr_output = process.stderr.read()
             conversion_status[conversion_id]['status'] = 'failed'
             conversion_status[conversion_id]['message'] = f'转换失败: {stderr_output}'
+        _notify_conversion(conversion_id)
             
     except Exception as e:
         conversion_status[conversion_id]['status'] = 'failed'
         conversion_status[conversion_id]['message'] = f'转换过程中出错: {str(e)}'
+        _notify_conversion(conversion_id)
+
+def _update_conversion_progress(conversion_id, progress):
+    """更新转换进度，进度有变化时推送给订阅方"""
+    if conversion_status[conversion_id].get('progress') == progress:
+        return
+    conversion_status[conversion_id]['progress'] = progress
+    conversion_status[conversion_id]['message'] = f'转换中...{progress}%'
+    _notify_conversion(conversion_id)
+
+def _conversion_public_status(conversion_id):
+    """返回给页面的转换状态（去掉服务器上的文件路径）"""
+    status_data = conversion_status[conversion_id].copy()
+    
+    # 清理可能不需要的字段
+    if 'original_file' in status_data:
+        del status_data['original_file']
+    return status_data
+
+def _notify_conversion(conversion_id):
+    """把转换状态推送给订阅了该转换的SSE连接（转换在Web进程内进行，不经过Redis）"""
+    event_hub.notify(f'conversion:{conversion_id}', _conversion_public_status(conversion_id))
 
 @app.route('/api/conversion-status/<conversion_id>', methods=['GET'])
 def get_conversion_status(conversion_id):
@@ -817,13 +1078,46 @@ def get_conversion_status(conversion_id):
     if conversion_id not in conversion_status:
         return jsonify({'error': '无效的转换ID'}), 400
     
-    status_data = conversion_status[conversion_id].copy()
-    
-    # 清理可能不需要的字段
-    if 'original_file' in status_data:
-        del status_data['original_file']
+    return jsonify(_conversion_public_status(conversion_id))
+
+@app.route('/api/conversion-stream/<conversion_id>', methods=['GET'])
+def stream_conversion_status(conversion_id):
+    """以Server-Sent Events推送文件转换状态（每条数据与 /api/conversion-status 的返回值相同，连接保持时间同 stream_progress）"""
+    if conversion_id not in conversion_status:
+        return jsonify({'error': '无效的转换ID'}), 400
+    last_event_id = request.headers.get('Last-Event-ID')
     
-    return jsonify(status_data)
+    def generate():
+        event_key = f'conversion:{conversion_id}'
+        subscriber = event_hub.subscribe(event_key)
+        try:
+            yield f"retry: {STREAM_RETRY_MILLISECONDS}\n\n"
+            status_data = _conversion_public_status(conversion_id)
+            event_id, event = sse_event(status_data)
+            finished = status_data.get('status') in ('completed', 'failed')
+            if event_id != last_event_id or finished:
+                yield event
+            if finished:
+                return
+            
+            deadline = time.time() + STREAM_MAX_SECONDS
+            while time.time() < deadline:
+                try:
+                    status_data = subscriber.get(timeout=STREAM_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield sse_event(status_data)[1]
+                if status_data.get('status') in ('completed', 'failed'):
+                    return
+        except KeyError:
+            # 转换记录已被自动清理
+            yield sse_event({'error': '无效的转换ID'})[1]
+        finally:
+            event_hub.unsubscribe(event_key, subscriber)
+    
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/api/complete-conversion/<conversion_id>', methods=['POST'])
 def complete_conversion(conversion_id):
@@ -843,10 +1137,10 @@ def complete_conversion(conversion_id):
     if not os.path.exists(output_file):
         return jsonify({'error': '转换后的文件不存在'}), 400
     
-    # 将转换后的文件移动到主工作目录
+    # 将转换后的文件移动到主工作目录（转换输出已是16kHz单声道PCM，worker会直接使用而不再转码）
     final_filename = f"temp_{str(uuid.uuid4())}.wav"
     final_path = os.path.join(os.getcwd(), 'shared_data', final_filename)
-    shutil.copy(output_file, final_path)
+    shutil.move(output_file, final_path)
     
     # 从请求中获取其他参数
     data = request.get_json()
@@ -856,26 +1150,17 @@ def complete_conversion(conversion_id):
     parallel_threads = data.get('parallel_threads', 10)
     segment_length = data.get('segment_length', 60)
     formatted_browser_time = data.get('formatted_browser_time') # Get formatted time string
+    engine = resolve_recognition_engine(data.get('engine'))
+    if engine is None:
+        return jsonify({'error': '不支持的识别后端', 'code': 'INVALID_ENGINE'}), 400
     
-    # 检查是否提供了API信息
-    if not api_key or not api_region:
+    # 检查是否提供了API信息（本地识别引擎不需要）
+    if engine != 'local' and (not api_key or not api_region):
         return jsonify({
             'error': '未设置API密钥和区域', 
             'code': 'NO_API_SETTINGS'
         }), 400
     
-    # 启动异步任务，传递API设置和并行处理参数
-    task = transcribe_audio.delay(
-        final_path, 
-        language, 
-        'audio',  # 转换后都是音频文件
-        api_key, 
-        api_region,
-        parallel_threads,
-        segment_length,
-        original_duration
-    )
-    
     # 在Redis中存储任务的基本信息
     task_info = {
         'file': final_path,
@@ -886,12 +1171,38 @@ def complete_conversion(conversion_id):
         'api_region': api_region,
         'parallel_threads': parallel_threads,
         'segment_length': segment_length,
-        'original_duration': original_duration
+        'original_duration': original_duration,
+        'content_hash': status_data.get('content_hash'),
+        'engine': engine
     }
     if formatted_browser_time:
         task_info['filename_timestamp_override'] = formatted_browser_time
     
-    redis_client.hset(f'task:{task.id}', 'info', json.dumps(task_info))
+    # 相同内容（按原始上传文件的哈希）、语言和识别选项已有转写结果时，直接返回已完成的任务
+    cache_entry = lookup_transcript_cache(status_data.get('content_hash'), language, engine)
+    if cache_entry:
+        task_info.pop('file')
+        task_id = create_cached_task(cache_entry, task_info)
+        os.remove(final_path)
+        task_status = 'completed'
+    else:
+        # 预先生成任务ID，保证Worker启动时任务信息已经写入Redis
+        task_id = str(uuid.uuid4())
+        redis_client.hset(f'task:{task_id}', 'info', json.dumps(task_info))
+        register_task(redis_client, task_id, task_info['created_at'])
+        
+        # 启动异步任务，传递API设置和并行处理参数
+        transcribe_audio.apply_async(args=(
+            final_path, 
+            language, 
+            'audio',  # 转换后都是音频文件
+            api_key, 
+            api_region,
+            parallel_threads,
+            segment_length,
+            original_duration
+        ), kwargs={'engine': engine}, task_id=task_id, **transcribe_queue_options(engine))
+        task_status = 'processing'
     
     # 清理转换临时文件
     try:
@@ -905,56 +1216,51 @@ def complete_conversion(conversion_id):
     conversion_status.pop(conversion_id, None)
     
     return jsonify({
-        'task_id': task.id,
-        'status': 'processing',
+        'task_id': task_id,
+        'status': task_status,
+        'cached': cache_entry is not None,
         'file_type': 'audio',
         'original_filename': original_filename,
-        'original_duration': original_duration
+        'original_duration': task_info.get('original_duration', original_duration)
     })
 
 @app.route('/api/tasks/search', methods=['GET'])
 def search_tasks():
-    """根据文件名搜索任务"""
+    """
+    根据文件名搜索任务（按创建时间倒序分页，参数和返回格式同 /api/tasks）
+    
+    沿索引分批只读取任务信息进行匹配，凑满一页后再一次读取匹配任务的进度和结果。
+    """
     query = request.args.get('q', '').lower()
     if not query:
-        return jsonify([])
-
+        return jsonify({'tasks': [], 'next_cursor': None})
+    
+    ensure_task_index(redis_client)
+    limit = _page_size()
+    cursor = request.args.get('cursor')
+    matched = []
+    next_cursor = None
+    while next_cursor is None:
+        task_ids, batch_cursor = page_task_ids(redis_client, cursor, SEARCH_BATCH_SIZE)
+        for task_id, fields in zip(task_ids, fetch_tasks(redis_client, task_ids, fields=('info',))):
+            if not fields or not fields['info']:
+                continue
+            task_info = json.loads(fields['info'])
+            if query in task_info.get('original_name', '').lower():
+                matched.append(task_id)
+                if len(matched) == limit:
+                    next_cursor = task_cursor(task_id, task_info.get('created_at') or 0)
+                    break
+        if batch_cursor is None:
+            break
+        cursor = batch_cursor
+    
     tasks = []
-    task_keys = redis_client.keys('task:*')
-
-    for key in task_keys:
-        task_id = key.decode('utf-8').split(':')[1]
-        task_info_data = redis_client.hget(f'task:{task_id}', 'info')
-        progress_data = redis_client.hget(f'task:{task_id}', 'progress_data')
-
-        if task_info_data and progress_data:
-            task_info = json.loads(task_info_data)
-            progress_info = json.loads(progress_data)
-            
-            original_name = task_info.get('original_name', '').lower()
-            if query in original_name:
-                result_text = None
-                if progress_info.get('status') == 'completed':
-                    result_data = redis_client.hget(f'task:{task_id}', 'result')
-                    if result_data:
-                        result = json.loads(result_data)
-                        result_text = result.get('text', '')
-                
-                tasks.append({
-                    'id': task_id,
-                    'file_name': task_info.get('original_name', '未知文件'),
-                    'file_type': task_info.get('file_type', 'unknown'),
-                    'status': progress_info.get('status', 'processing'),
-                    'progress': progress_info.get('progress', 0),
-                    'created_at': task_info.get('created_at'),
-                    'result': result_text,
-                    'language': task_info.get('language', 'zh-CN'),
-                    'original_duration': task_info.get('original_duration', 0),
-                    'processed_audio_file': task_info.get('processed_audio_file')
-                })
-    
-    tasks.sort(key=lambda x: x.get('created_at', 0), reverse=True)
-    return jsonify(tasks)
+    for task_id, fields in zip(matched, fetch_tasks(redis_client, matched)):
+        item = _task_list_item(task_id, fields)
+        if item:
+            tasks.append(item)
+    return jsonify({'tasks': tasks, 'next_cursor': next_cursor})
 
 def clean_all_files():
     """
@@ -1099,50 +1405,53 @@ def clean_files_route():
 # 日志相关API端点
 @app.route('/api/logs/<task_id>', methods=['GET'])
 def get_task_logs(task_id):
-    """获取特定任务的日志"""
+    """
+    获取特定任务的日志
+    
+    查询参数 after 为上次拿到的最后一条日志的 id，传入时只返回其后新增的日志
+    """
     try:
-        logs_data = redis_client.hget(f'task:{task_id}', 'logs')
+        log_key = task_log_key(task_id)
+        after = request.args.get('after')
+        logs = read_logs(redis_client, log_key, after=after)
+        if logs or after:
+            return jsonify(logs), 200
+        
+        # 旧版本保存在任务哈希 logs 字段中的日志迁移到日志流
+        legacy_logs = redis_client.hget(f'task:{task_id}', 'logs')
+        if legacy_logs is not None:
+            migrate_legacy_logs(redis_client, log_key, legacy_logs)
+            redis_client.hdel(f'task:{task_id}', 'logs')
+            return jsonify(read_logs(redis_client, log_key)), 200
+        
         # 如果尚未存储日志，则尝试根据 progress_data/result 自动生成一份简要日志
-        if not logs_data:
-            progress_data_raw = redis_client.hget(f'task:{task_id}', 'progress_data')
-            result_data_raw = redis_client.hget(f'task:{task_id}', 'result')
-            auto_logs = []
+        progress_data_raw = redis_client.hget(f'task:{task_id}', 'progress_data')
+        result_data_raw = redis_client.hget(f'task:{task_id}', 'result')
+        auto_logs = []
 
-            # 1. 基于 progress_data 构造
-            if progress_data_raw:
-                try:
-                    pd = json.loads(progress_data_raw)
-                    auto_logs.append({
-                        'time': datetime.now().strftime('%H:%M:%S'),
-                        'timestamp': time.time(),
-                        'message': f"自动生成日志：进度 {pd.get('progress',0)}%，状态 {pd.get('status')}",
-                        'type': 'info'
-                    })
-                except Exception:
-                    pass
-
-            # 2. 若有最终结果
-            if result_data_raw:
-                try:
-                    rd = json.loads(result_data_raw)
-                    auto_logs.append({
-                        'time': datetime.now().strftime('%H:%M:%S'),
-                        'timestamp': time.time(),
-                        'message': '任务已完成',
-                        'type': 'success' if rd.get('status')=='success' else 'error'
-                    })
-                except Exception:
-                    pass
-
-            # 存回 Redis，避免下次再生成
-            if auto_logs:
-                redis_client.hset(f'task:{task_id}', 'logs', json.dumps(auto_logs))
-                return jsonify(auto_logs), 200
-            else:
-                return jsonify([]), 200
-        
-        logs = json.loads(logs_data)
-        return jsonify(logs), 200
+        # 1. 基于 progress_data 构造
+        if progress_data_raw:
+            try:
+                pd = json.loads(progress_data_raw)
+                auto_logs.append(make_log_entry(f"自动生成日志：进度 {pd.get('progress',0)}%，状态 {pd.get('status')}", 'info'))
+            except Exception:
+                pass
+
+        # 2. 若有最终结果
+        if result_data_raw:
+            try:
+                rd = json.loads(result_data_raw)
+                auto_logs.append(make_log_entry('任务已完成', 'success' if rd.get('status')=='success' else 'error'))
+            except Exception:
+                pass
+
+        # 存回 Redis，避免下次再生成
+        if auto_logs:
+            pipe = redis_client.pipeline(transaction=False)
+            for entry in auto_logs:
+                append_log(redis_client, log_key, entry, pipe=pipe)
+            pipe.execute()
+        return jsonify(read_logs(redis_client, log_key)), 200
     except Exception as e:
         app.logger.error(f"获取任务日志失败: {str(e)}")
         return jsonify({
@@ -1168,24 +1477,8 @@ def add_task_log(task_id):
         if log_type not in LOG_LEVELS:
             log_type = 'info'
         
-        # 获取现有日志
-        logs_data = redis_client.hget(f'task:{task_id}', 'logs')
-        logs = []
-        if logs_data:
-            logs = json.loads(logs_data)
-            
-        # 添加新日志条目
-        now = time.time()
-        log_entry = {
-            'time': datetime.now().strftime('%H:%M:%S'),
-            'timestamp': now,
-            'message': message,
-            'type': log_type
-        }
-        logs.append(log_entry)
-        
-        # 更新Redis
-        redis_client.hset(f'task:{task_id}', 'logs', json.dumps(logs))
+        # 追加到任务日志流
+        log_entry = append_log(redis_client, task_log_key(task_id), make_log_entry(message, log_type, source='client'))
         
         return jsonify({
             'status': 'success',
@@ -1203,7 +1496,8 @@ def clear_task_logs(task_id):
     """清除指定任务的日志"""
     try:
         # 清空日志
-        redis_client.hset(f'task:{task_id}', 'logs', json.dumps([]))
+        clear_logs(redis_client, task_log_key(task_id))
+        redis_client.hdel(f'task:{task_id}', 'logs')
         
         return jsonify({
             'status': 'success',
@@ -1218,13 +1512,17 @@ def clear_task_logs(task_id):
 
 @app.route('/api/logs/general', methods=['GET'])
 def get_general_logs():
-    """获取通用日志（不特定于任何任务）"""
+    """获取通用日志（不特定于任何任务），查询参数 after 的含义与任务日志相同"""
     try:
-        logs_data = redis_client.get('general_logs')
-        if not logs_data:
-            return jsonify([]), 200
-            
-        logs = json.loads(logs_data)
+        after = request.args.get('after')
+        logs = read_logs(redis_client, GENERAL_LOG_KEY, after=after)
+        if not logs and not after:
+            # 旧版本的通用日志保存在 general_logs 字符串键中
+            legacy_logs = redis_client.get(LEGACY_GENERAL_LOG_KEY)
+            if legacy_logs is not None:
+                migrate_legacy_logs(redis_client, GENERAL_LOG_KEY, legacy_logs)
+                redis_client.delete(LEGACY_GENERAL_LOG_KEY)
+                logs = read_logs(redis_client, GENERAL_LOG_KEY)
         return jsonify(logs), 200
     except Exception as e:
         app.logger.error(f"获取通用日志失败: {str(e)}")
@@ -1251,29 +1549,8 @@ def add_general_log():
         if log_type not in LOG_LEVELS:
             log_type = 'info'
         
-        # 获取现有日志
-        logs_data = redis_client.get('general_logs')
-        logs = []
-        if logs_data:
-            logs = json.loads(logs_data)
-            
-        # 添加新日志条目
-        now = time.time()
-        log_entry = {
-            'time': datetime.now().strftime('%H:%M:%S'),
-            'timestamp': now,
-            'message': message,
-            'type': log_type
-        }
-        logs.append(log_entry)
-        
-        # 限制日志数量，保留最新的500条
-        if len(logs) > 500:
-            logs = logs[-500:]
-        
-        # 更新Redis
-        redis_client.set('general_logs', json.dumps(logs))
-        redis_client.expire('general_logs', 60 * 60 * 24 * 7)  # 7天过期
+        # 追加到通用日志流（保留最新的约500条，7天过期）
+        log_entry = append_log(redis_client, GENERAL_LOG_KEY, make_log_entry(message, log_type, source='client'))
         
         return jsonify({
             'status': 'success',
@@ -1291,7 +1568,7 @@ def clear_general_logs():
     """清除通用日志"""
     try:
         # 清空日志
-        redis_client.set('general_logs', json.dumps([]))
+        redis_client.delete(GENERAL_LOG_KEY, LEGACY_GENERAL_LOG_KEY)
         
         return jsonify({
             'status': 'success',
@@ -0,0 +1,550 @@
+import os
+import mmap
+import struct
+import numpy as np
+
+# Azure Speech 所需的PCM格式：16kHz、单声道、16bit
+TARGET_SAMPLE_RATE = 16000
+TARGET_CHANNELS = 1
+TARGET_BITS_PER_SAMPLE = 16
+
+# WAV格式码
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# 向识别流推送数据时每次读取的字节数（约1秒的16kHz单声道音频）
+PCM_CHUNK_SIZE = 32000
+
+# 语音活动检测（VAD）参数
+VAD_FRAME_MS = 30                # 能量计算的帧长（毫秒）
+VAD_MIN_THRESHOLD_DB = -60.0     # 静音判定阈值下限（dBFS）
+VAD_MAX_THRESHOLD_DB = -40.0     # 静音判定阈值上限（dBFS）
+VAD_NOISE_MARGIN_DB = 10.0       # 阈值 = 噪声底 + 该余量
+VAD_HANGOVER_MS = 300            # 语音帧前后保留的缓冲时长，避免切掉词首词尾
+VAD_SKIP_SILENCE_SECONDS = 2.0   # 超过该时长的静音段直接跳过，不送去识别
+VAD_CUT_TOLERANCE_RATIO = 0.2    # 强制切分时可在标称位置前后 segment_length*该比例 范围内寻找停顿
+VAD_ANCHOR_WINDOW_RATIO = 0.5    # 停顿是前后 segment_length*该比例 范围内最长的停顿时作为锚定切分点
+VAD_MAX_SEGMENT_RATIO = 2.0      # 超过 segment_length*该比例 仍没有锚定切分点时强制切分
+VAD_BLOCK_SECONDS = 60           # 分块计算能量，避免长音频一次性转换为浮点数组
+
+def read_wav_header(wav_path):
+    """
+    解析WAV文件的RIFF头，获取格式信息与PCM数据所在的字节范围
+
+    Args:
+        wav_path: WAV文件路径
+
+    Returns:
+        dict: 包含 audio_format, channels, sample_rate, bits_per_sample, block_align,
+              data_offset, data_size, duration；不是有效WAV时返回None
+    """
+    try:
+        file_size = os.path.getsize(wav_path)
+        with open(wav_path, 'rb') as f:
+            riff = f.read(12)
+            if len(riff) < 12 or riff[0:4] != b'RIFF' or riff[8:12] != b'WAVE':
+                return None
+
+            fmt_info = None
+            while True:
+                chunk_header = f.read(8)
+                if len(chunk_header) < 8:
+                    break
+                chunk_id, chunk_size = struct.unpack('<4sI', chunk_header)
+
+                if chunk_id == b'fmt ':
+                    fmt_data = f.read(chunk_size)
+                    if len(fmt_data) < 16:
+                        return None
+                    audio_format, channels, sample_rate, _, block_align, bits_per_sample = struct.unpack('<HHIIHH', fmt_data[:16])
+                    # WAVE_FORMAT_EXTENSIBLE 的真实格式码保存在子格式GUID的前两个字节
+                    if audio_format == WAVE_FORMAT_EXTENSIBLE and len(fmt_data) >= 26:
+                        audio_format = struct.unpack('<H', fmt_data[24:26])[0]
+                    fmt_info = {
+                        'audio_format': audio_format,
+                        'channels': channels,
+                        'sample_rate': sample_rate,
+                        'bits_per_sample': bits_per_sample,
+                        'block_align': block_align
+                    }
+                    if chunk_size % 2:
+                        f.seek(1, os.SEEK_CUR)
+                elif chunk_id == b'data':
+                    if fmt_info is None:
+                        return None
+                    data_offset = f.tell()
+                    # 流式写出的WAV可能没有回填data长度，以实际文件大小为准
+                    data_size = min(chunk_size, file_size - data_offset)
+                    block_align = fmt_info['block_align'] or 1
+                    data_size -= data_size % block_align
+                    bytes_per_second = fmt_info['sample_rate'] * block_align
+                    fmt_info['data_offset'] = data_offset
+                    fmt_info['data_size'] = data_size
+                    fmt_info['duration'] = data_size / bytes_per_second if bytes_per_second else 0.0
+                    return fmt_info
+                else:
+                    f.seek(chunk_size + (chunk_size % 2), os.SEEK_CUR)
+        return None
+    except Exception as e:
+        print(f"解析WAV文件头失败 for {wav_path}: {str(e)}")
+        return None
+
+def is_speech_compatible_wav(header):
+    """判断WAV头描述的格式是否已经是Azure识别所需的16kHz单声道16bit PCM"""
+    return bool(header) and (
+        header['audio_format'] == WAVE_FORMAT_PCM and
+        header['sample_rate'] == TARGET_SAMPLE_RATE and
+        header['channels'] == TARGET_CHANNELS and
+        header['bits_per_sample'] == TARGET_BITS_PER_SAMPLE
+    )
+
+def can_resample_in_process(header):
+    """判断WAV是否为16bit PCM，只需降混/重采样即可满足识别格式（无需调用ffmpeg）"""
+    return bool(header) and (
+        header['audio_format'] == WAVE_FORMAT_PCM and
+        header['bits_per_sample'] == TARGET_BITS_PER_SAMPLE and
+        header['channels'] >= 1 and
+        header['sample_rate'] > 0
+    )
+
+def _lowpass_taps(cutoff, num_taps=63):
+    """生成Hamming窗的sinc低通滤波器，cutoff为相对输入采样率的归一化截止频率（0~0.5）"""
+    n = np.arange(num_taps) - (num_taps - 1) / 2.0
+    taps = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(num_taps)
+    return (taps / taps.sum()).astype(np.float32)
+
+def resample_pcm_wav(input_path, output_path, header, block_seconds=30):
+    """
+    在进程内把16bit PCM WAV降混为单声道并重采样到16kHz，替代一次完整的ffmpeg转码
+
+    降采样前先做低通滤波防止混叠，再用线性插值计算输出采样点；按块处理以控制内存占用。
+
+    Args:
+        input_path: 输入WAV文件路径
+        output_path: 输出WAV文件路径
+        header: 输入文件的 read_wav_header 返回值
+        block_seconds: 每块输出音频的时长（秒）
+
+    Returns:
+        bool: 是否成功
+    """
+    try:
+        import wave
+
+        channels = header['channels']
+        input_rate = header['sample_rate']
+        ratio = input_rate / TARGET_SAMPLE_RATE
+        taps = _lowpass_taps(0.5 / ratio * 0.9) if input_rate > TARGET_SAMPLE_RATE else None
+        pad = len(taps) if taps is not None else 0
+
+        with open(input_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            total_frames = header['data_size'] // header['block_align']
+            samples = np.frombuffer(mm, dtype='<i2', count=total_frames * channels, offset=header['data_offset'])
+            samples = samples.reshape(-1, channels)
+            total_output = int(total_frames / ratio)
+            block_output = int(block_seconds * TARGET_SAMPLE_RATE)
+
+            with wave.open(output_path, 'wb') as wav_out:
+                wav_out.setnchannels(TARGET_CHANNELS)
+                wav_out.setsampwidth(TARGET_BITS_PER_SAMPLE // 8)
+                wav_out.setframerate(TARGET_SAMPLE_RATE)
+
+                for first_output in range(0, total_output, block_output):
+                    last_output = min(first_output + block_output, total_output)
+                    positions = np.arange(first_output, last_output) * ratio
+                    # 读取该块对应的输入范围，两侧多取滤波器长度的采样避免边界失真
+                    first_input = max(0, int(positions[0]) - pad)
+                    last_input = min(total_frames, int(positions[-1]) + 2 + pad)
+                    mono = samples[first_input:last_input].astype(np.float32).mean(axis=1)
+                    if taps is not None:
+                        mono = np.convolve(mono, taps, mode='same')
+                    output = np.interp(positions - first_input, np.arange(mono.size), mono)
+                    wav_out.writeframes(np.clip(np.round(output), -32768, 32767).astype('<i2').tobytes())
+            del samples
+        return True
+    except Exception as e:
+        print(f"进程内重采样失败 for {input_path}: {str(e)}")
+        return False
+
+def progressive_lengths(segment_length, first_lengths=()):
+    """
+    渐进分段中开头几个片段的长度：只保留小于标称长度的正值
+
+    开头的片段较短，第一段文本几秒内就能识别出来，之后的片段恢复为标称长度，总吞吐不变。
+    """
+    return [float(length) for length in first_lengths or () if 0 < float(length) < segment_length]
+
+def segment_cut_points(duration, segment_length, first_lengths=()):
+    """
+    按渐进分段规则计算各切分点（秒），不含0和音频终点
+
+    Returns:
+        list: 递增的切分时间，片段数为 len(返回值) + 1
+    """
+    cuts = []
+    position = 0.0
+    lengths = progressive_lengths(segment_length, first_lengths)
+    while True:
+        position += lengths[len(cuts)] if len(cuts) < len(lengths) else segment_length
+        if position >= duration:
+            return cuts
+        cuts.append(position)
+
+def plan_pcm_segments(wav_path, header, segment_length, max_segments=None, first_lengths=()):
+    """
+    按固定时长把PCM WAV划分为若干字节范围，不生成任何分段文件
+
+    Args:
+        wav_path: 源WAV文件路径
+        header: read_wav_header 的返回值
+        segment_length: 每个片段的长度（秒）
+        max_segments: 最大分段数量（用于控制并行度）
+        first_lengths: 渐进分段时开头几个片段的长度（秒），见 progressive_lengths
+
+    Returns:
+        list: 分段描述字典列表，每项包含 source, offset, length, start, duration
+    """
+    bytes_per_second = header['sample_rate'] * header['block_align']
+    duration = header['duration']
+    if duration <= 0:
+        return []
+
+    # 动态调整分段大小，确保分段数不超过max_segments
+    if max_segments and duration > segment_length * max_segments:
+        segment_length = int(duration / max_segments) + 1
+        print(f"调整段长度为 {segment_length} 秒以限制分段数不超过 {max_segments}")
+
+    lengths = progressive_lengths(segment_length, first_lengths)
+    segments = []
+    position = 0
+    while position < header['data_size']:
+        nominal = lengths[len(segments)] if len(segments) < len(lengths) else segment_length
+        segment_bytes = max(header['block_align'], int(nominal * bytes_per_second))
+        segment_bytes -= segment_bytes % header['block_align']
+        length = min(segment_bytes, header['data_size'] - position)
+        segments.append({
+            'source': wav_path,
+            'offset': header['data_offset'] + position,
+            'length': length,
+            'start': position / bytes_per_second,
+            'duration': length / bytes_per_second
+        })
+        position += length
+    return segments
+
+def apply_segment_overlap(segments, header, overlap):
+    """
+    让相邻分段共享一小段音频：每个分段（第一个除外）的起点向前延伸 overlap 秒
+
+    硬切分点附近的词在其中一个分段里总是完整的，合并时再按词的时间戳去掉重复部分。
+    VAD分段之间跳过的静音不会被重复送识别，延伸量不超过与前一分段起点的距离。
+
+    Args:
+        segments: plan_pcm_segments / plan_vad_segments 的返回值（原地修改）
+        header: read_wav_header 的返回值
+        overlap: 重叠时长（秒），不大于0时不做处理
+
+    Returns:
+        list: 同一列表；发生重叠的分段增加 overlap 字段，表示与前一分段实际共享的秒数
+    """
+    if overlap <= 0:
+        return segments
+    bytes_per_second = header['sample_rate'] * header['block_align']
+    overlap_bytes = int(overlap * bytes_per_second)
+    overlap_bytes -= overlap_bytes % header['block_align']
+    for previous, segment in zip(segments, segments[1:]):
+        extend = min(overlap_bytes, segment['offset'] - previous['offset'])
+        segment['offset'] -= extend
+        segment['length'] += extend
+        segment['start'] -= extend / bytes_per_second
+        segment['duration'] += extend / bytes_per_second
+        shared = previous['offset'] + previous['length'] - segment['offset']
+        segment['overlap'] = max(0, shared) / bytes_per_second
+    return segments
+
+def iter_pcm_range(wav_path, offset, length, chunk_size=PCM_CHUNK_SIZE):
+    """
+    通过内存映射按块读取WAV文件中指定字节范围的PCM数据
+
+    Args:
+        wav_path: 源WAV文件路径
+        offset: 起始字节偏移（包含文件头）
+        length: 需要读取的字节数
+        chunk_size: 每次返回的块大小
+
+    Yields:
+        bytes: PCM数据块
+    """
+    with open(wav_path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            end = min(offset + length, len(mm))
+            position = offset
+            while position < end:
+                next_position = min(position + chunk_size, end)
+                yield mm[position:next_position]
+                position = next_position
+
+def compute_frame_energy_db(wav_path, header, frame_ms=VAD_FRAME_MS):
+    """
+    以帧为单位计算PCM音频的RMS能量（dBFS），分块向量化计算以控制内存占用
+
+    Args:
+        wav_path: 16bit单声道PCM WAV文件路径
+        header: read_wav_header 的返回值
+        frame_ms: 帧长（毫秒）
+
+    Returns:
+        tuple: (每帧能量的numpy数组, 每帧采样数)
+    """
+    frame_samples = int(header['sample_rate'] * frame_ms / 1000)
+    total_samples = header['data_size'] // 2
+    total_frames = total_samples // frame_samples
+    frames_per_block = max(1, int(VAD_BLOCK_SECONDS * 1000 / frame_ms))
+    energy_db = np.empty(total_frames, dtype=np.float32)
+
+    with open(wav_path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            samples = np.frombuffer(mm, dtype='<i2', count=total_frames * frame_samples, offset=header['data_offset'])
+            for first_frame in range(0, total_frames, frames_per_block):
+                last_frame = min(first_frame + frames_per_block, total_frames)
+                block = samples[first_frame * frame_samples:last_frame * frame_samples].astype(np.float32)
+                block = block.reshape(-1, frame_samples) / 32768.0
+                rms = np.sqrt(np.mean(block * block, axis=1))
+                energy_db[first_frame:last_frame] = 20.0 * np.log10(rms + 1e-10)
+            # 释放对mmap的引用后才能关闭映射
+            del samples
+
+    return energy_db, frame_samples
+
+def detect_voiced_frames(energy_db, frame_ms=VAD_FRAME_MS):
+    """
+    根据帧能量判定语音帧：阈值取噪声底加余量并限制在上下限之间，再向前后扩展缓冲帧
+
+    Returns:
+        numpy.ndarray: 每帧是否为语音的布尔数组
+    """
+    if energy_db.size == 0:
+        return np.zeros(0, dtype=bool)
+
+    noise_floor = float(np.percentile(energy_db, 10))
+    threshold = min(max(noise_floor + VAD_NOISE_MARGIN_DB, VAD_MIN_THRESHOLD_DB), VAD_MAX_THRESHOLD_DB)
+    voiced = energy_db > threshold
+
+    hangover_frames = int(VAD_HANGOVER_MS / frame_ms)
+    if hangover_frames > 0:
+        kernel = np.ones(2 * hangover_frames + 1, dtype=np.int32)
+        voiced = np.convolve(voiced.astype(np.int32), kernel, mode='same') > 0
+    return voiced
+
+def _find_voiced_regions(voiced, min_gap_frames):
+    """返回被长静音隔开的语音区域列表 [(起始帧, 结束帧), ...]，结束帧不包含在内"""
+    if not voiced.any():
+        return []
+
+    padded = np.concatenate(([False], voiced, [False]))
+    changes = np.flatnonzero(padded[1:] != padded[:-1])
+    starts, ends = changes[0::2], changes[1::2]
+
+    regions = [[int(starts[0]), int(ends[0])]]
+    for start, end in zip(starts[1:], ends[1:]):
+        # 静音间隔不够长时并入上一个区域
+        if start - regions[-1][1] < min_gap_frames:
+            regions[-1][1] = int(end)
+        else:
+            regions.append([int(start), int(end)])
+    return [tuple(region) for region in regions]
+
+def _anchor_cut_frames(voiced, half_window_frames):
+    """
+    找出由内容决定的切分点：停顿（非语音帧段）是其中点前后 half_window_frames 帧内最长的停顿时，
+    取其中点作为锚定切分点（同样长的停顿取较早的一个）。
+
+    是否成为锚点只取决于该停顿附近的音频，与文件起点和其他切分点的位置无关，
+    因此裁剪、在开头增删音频或重新导出的文件，除两端附近外得到相同的锚点。
+    相邻锚点的间距大于 half_window_frames。
+
+    Returns:
+        tuple: (锚定切分帧, 对应停顿的起始帧, 结束帧)，均为升序的numpy数组
+    """
+    silent = ~voiced
+    if not silent.any():
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty
+    padded = np.concatenate(([False], silent, [False]))
+    changes = np.flatnonzero(padded[1:] != padded[:-1])
+    starts, ends = changes[0::2], changes[1::2]
+    lengths = ends - starts
+    centers = (starts + ends) // 2
+
+    window_starts = np.searchsorted(centers, centers - half_window_frames, side='left')
+    window_ends = np.searchsorted(centers, centers + half_window_frames, side='right')
+    # argmax 返回第一个最大值，同样长的停顿中只有最早的一个成为锚点
+    selected = np.asarray([
+        window_starts[i] + int(np.argmax(lengths[window_starts[i]:window_ends[i]])) == i
+        for i in range(len(centers))
+    ], dtype=bool)
+    return centers[selected], starts[selected], ends[selected]
+
+def _content_cut_sample(samples, lo, hi):
+    """
+    在采样范围 [lo, hi) 内选一个只由采样值决定的切分采样点：取以该点开始的4个采样哈希值最大的位置
+
+    帧网格随文件起点移动，帧级切分点在裁剪后会偏移不到一帧；取范围内哈希最大的采样点后，
+    只要两个文件的搜索范围覆盖同一个最大值，切分点就落在同一个采样上，分段的PCM字节完全相同。
+    范围内采样值全部相同（数字静音）时取范围中点。
+    """
+    window = samples[lo:min(hi + 3, len(samples))].astype(np.int64).view(np.uint64)
+    count = min(hi - lo, len(window) - 3)
+    if count <= 0:
+        return lo
+    hashes = np.full(count, 0xcbf29ce484222325, dtype=np.uint64)
+    for k in range(4):
+        hashes = (hashes ^ window[k:k + count]) * np.uint64(0x100000001b3)
+    if hashes.min() == hashes.max():
+        return (lo + hi) // 2
+    return lo + int(np.argmax(hashes))
+
+def _choose_cut_frame(energy_db, voiced, window_start, window_end, nominal):
+    """
+    在窗口内选择强制切分帧：取窗口内最长停顿的中点（同样长的停顿取离标称位置最近的），
+    没有静音帧时取能量最低的帧。
+
+    强制切分点相对上一个切分点计算，只用于渐进分段开头的短片段和长时间没有锚定切分点的情况；
+    之后遇到的第一个锚定切分点（见 _anchor_cut_frames）使分段边界重新与内容对齐。
+    """
+    silent = ~voiced[window_start:window_end]
+    if silent.any():
+        padded = np.concatenate(([False], silent, [False]))
+        changes = np.flatnonzero(padded[1:] != padded[:-1])
+        starts, ends = changes[0::2], changes[1::2]
+        lengths = ends - starts
+        candidates = np.flatnonzero(lengths == lengths.max())
+        centers = window_start + (starts[candidates] + ends[candidates]) // 2
+        return int(centers[np.argmin(np.abs(centers - nominal))])
+    return int(window_start + np.argmin(energy_db[window_start:window_end]))
+
+def plan_vad_segments(wav_path, header, segment_length, max_segments=None, first_lengths=()):
+    """
+    基于能量VAD规划分段：在由内容决定的停顿处切分，并跳过整段静音
+
+    切分点取前后半个分段长度内最长的停顿（见 _anchor_cut_frames），不依赖上一个切分点的位置；
+    锚定切分点和语音区域的边界再对齐到由采样值决定的采样点（见 _content_cut_sample）。
+    裁剪或在开头增删音频后，除开头的渐进短片段、两端附近以及长度几乎相同的停顿相互替代之外，
+    分段边界与内容保持不变，分段结果缓存仍能命中。分段长度一般在 segment_length 的0.5到2倍之间；
+    超过2倍仍没有合适的停顿时，在标称位置附近强制切分。
+
+    Args:
+        wav_path: 16kHz单声道16bit PCM WAV文件路径
+        header: read_wav_header 的返回值
+        segment_length: 目标片段长度（秒）
+        max_segments: 最大分段数量（用于控制并行度），超过时合并相邻片段
+        first_lengths: 渐进分段时开头几个片段的目标长度（秒），见 progressive_lengths
+
+    Returns:
+        list: 与 plan_pcm_segments 相同结构的分段描述列表；音频全部为静音时返回空列表
+    """
+    duration = header['duration']
+    if duration <= 0:
+        return []
+
+    if max_segments and duration > segment_length * max_segments:
+        segment_length = int(duration / max_segments) + 1
+        print(f"调整段长度为 {segment_length} 秒以限制分段数不超过 {max_segments}")
+
+    energy_db, frame_samples = compute_frame_energy_db(wav_path, header)
+    voiced = detect_voiced_frames(energy_db)
+
+    frames_per_second = header['sample_rate'] / frame_samples
+    lengths = progressive_lengths(segment_length, first_lengths)
+    min_gap_frames = int(VAD_SKIP_SILENCE_SECONDS * frames_per_second)
+
+    half_window_frames = max(1, int(segment_length * VAD_ANCHOR_WINDOW_RATIO * frames_per_second))
+    max_frames = max(1, int(segment_length * VAD_MAX_SEGMENT_RATIO * frames_per_second))
+    anchors, anchor_starts, anchor_ends = _anchor_cut_frames(voiced, half_window_frames)
+    edge_frames = max(1, int(VAD_HANGOVER_MS / VAD_FRAME_MS))
+
+    # 先按帧规划分段，snap_windows 记录需要对齐到采样点的切分帧及其搜索范围（帧）
+    frame_segments = []
+    snap_windows = {}
+    for region_start, region_end in _find_voiced_regions(voiced, min_gap_frames):
+        # 语音区域的边界位于静音与缓冲帧之间，前后各一个缓冲时长内都不是语音
+        snap_windows[region_start] = (region_start - edge_frames, region_start + edge_frames)
+        snap_windows[region_end] = (region_end - edge_frames, region_end + edge_frames)
+        position = region_start
+        while position < region_end:
+            nominal_length = lengths[len(frame_segments)] if len(frame_segments) < len(lengths) else segment_length
+            segment_frames = max(1, int(nominal_length * frames_per_second))
+            tolerance_frames = int(nominal_length * VAD_CUT_TOLERANCE_RATIO * frames_per_second)
+            if len(frame_segments) < len(lengths):
+                # 渐进分段开头的短片段：在标称位置附近强制切分
+                limit = segment_frames + tolerance_frames
+            else:
+                # 下一个锚定切分点；与当前位置过近（仅在强制切分之后出现）或贴近区域结尾的锚点不用
+                first = int(np.searchsorted(anchors, position + half_window_frames // 2, side='left'))
+                anchor = int(anchors[first]) if first < len(anchors) else None
+                if anchor is not None and anchor < region_end - half_window_frames // 2 and anchor - position <= max_frames:
+                    cut = anchor
+                    limit = None
+                    # 只在停顿内部（去掉两端可能随帧网格变化的帧）寻找切分采样点
+                    pause_start, pause_end = int(anchor_starts[first]), int(anchor_ends[first])
+                    if pause_end - pause_start > 2:
+                        pause_start, pause_end = pause_start + 1, pause_end - 1
+                    snap_windows[cut] = (pause_start, pause_end)
+                else:
+                    limit = max_frames
+            if limit is not None:
+                # 剩余部分不超过上限时整体作为一段，否则在标称位置附近强制切分
+                if region_end - position <= limit:
+                    cut = region_end
+                else:
+                    nominal = position + segment_frames
+                    window_start = max(position + 1, nominal - tolerance_frames)
+                    window_end = min(region_end, nominal + tolerance_frames + 1)
+                    cut = _choose_cut_frame(energy_db, voiced, window_start, window_end, nominal)
+
+            # 整段都是静音（切分后可能出现）时跳过
+            if voiced[position:cut].any():
+                frame_segments.append((position, cut))
+            position = cut
+
+    # 渐进短片段、提前出现的停顿或较多的语音区域都可能使分段数超过上限：
+    # 反复合并首尾跨度最短的相邻两段（两段之间跳过的静音随之一起送识别），合并后的边界仍是原有切分点
+    if max_segments and len(frame_segments) > max_segments:
+        print(f"VAD分段数 {len(frame_segments)} 超过上限 {max_segments}，合并较短的相邻片段")
+        while len(frame_segments) > max_segments:
+            shortest = min(range(len(frame_segments) - 1),
+                           key=lambda i: frame_segments[i + 1][1] - frame_segments[i][0])
+            frame_segments[shortest:shortest + 2] = [(frame_segments[shortest][0], frame_segments[shortest + 1][1])]
+
+    segments = []
+    with open(wav_path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            total_samples = header['data_size'] // header['block_align']
+            samples = np.frombuffer(mm, dtype='<i2', count=total_samples, offset=header['data_offset'])
+
+            def boundary_sample(frame):
+                # 文件两端不需要对齐；最后一帧之后不足一帧的尾部采样并入最后一个分段
+                if frame <= 0:
+                    return 0
+                if frame >= voiced.size:
+                    return total_samples
+                if frame in snap_windows:
+                    lo, hi = snap_windows[frame]
+                    return _content_cut_sample(samples, max(0, lo) * frame_samples, min(voiced.size, hi) * frame_samples)
+                return frame * frame_samples
+
+            for start_frame, end_frame in frame_segments:
+                start_sample, end_sample = boundary_sample(start_frame), boundary_sample(end_frame)
+                segments.append({
+                    'source': wav_path,
+                    'offset': header['data_offset'] + start_sample * header['block_align'],
+                    'length': (end_sample - start_sample) * header['block_align'],
+                    'start': start_sample / header['sample_rate'],
+                    'duration': (end_sample - start_sample) / header['sample_rate']
+                })
+            # 释放对mmap的引用后才能关闭映射
+            del samples
+
+    voiced_seconds = sum(segment['duration'] for segment in segments)
+    print(f"VAD分段完成: {len(segments)} 个片段，送识别 {voiced_seconds:.1f} 秒 / 总时长 {duration:.1f} 秒")
+    return segments
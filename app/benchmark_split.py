@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+"""
+音频分段性能对比脚本
+
+对比三种分段方式在1小时/3小时音频上的耗时：
+  - 逐段ffmpeg：旧实现，每段启动一个ffmpeg进程，每段都从头解码输入
+  - 字节范围：生产路径。转码后的16kHz单声道WAV由 plan_pcm_segments 划分为字节范围，
+    识别时通过 iter_pcm_range 内存映射读取，不写分段文件（这里计时包含把所有范围完整读一遍）
+  - segment复用器：tasks.split_audio_file，仅在WAV头无法确认格式时作为回退使用
+
+使用方法（在app目录下运行，需要已安装ffmpeg）:
+    python benchmark_split.py              # 默认测试1小时和3小时
+    python benchmark_split.py 1 3 5        # 指定测试时长（小时）
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+
+from tasks import split_audio_file, get_audio_duration, DEFAULT_SEGMENT_LENGTH
+from audio_utils import read_wav_header, plan_pcm_segments, iter_pcm_range
+
+def generate_test_audio(output_path, hours):
+    """使用ffmpeg的lavfi生成指定时长的16kHz单声道测试WAV"""
+    cmd = [
+        'ffmpeg',
+        '-f', 'lavfi',
+        '-i', f'sine=frequency=440:sample_rate=16000:duration={int(hours * 3600)}',
+        '-acodec', 'pcm_s16le',
+        '-ar', '16000',
+        '-ac', '1',
+        output_path,
+        '-y'
+    ]
+    process = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if process.returncode != 0:
+        print(f"生成测试音频失败: {process.stderr.decode()}")
+        return False
+    return True
+
+def split_audio_file_per_segment(audio_path, output_dir, segment_length=DEFAULT_SEGMENT_LENGTH, max_segments=None):
+    """旧的分割实现：每个分段启动一个ffmpeg进程，-ss位于-i之后，每段都从头解码"""
+    os.makedirs(output_dir, exist_ok=True)
+    duration = get_audio_duration(audio_path)
+    if duration <= 0:
+        return []
+
+    if max_segments and duration > segment_length * max_segments:
+        segment_length = int(duration / max_segments) + 1
+
+    num_segments = int(duration / segment_length) + 1
+    segment_files = []
+    for i in range(num_segments):
+        segment_file = os.path.join(output_dir, f"segment_{i:03d}.wav")
+        cmd = [
+            'ffmpeg',
+            '-i', audio_path,
+            '-ss', str(i * segment_length),
+            '-t', str(segment_length),
+            '-acodec', 'pcm_s16le',
+            '-ar', '16000',
+            '-ac', '1',
+            segment_file,
+            '-y'
+        ]
+        process = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if process.returncode == 0 and os.path.exists(segment_file):
+            segment_files.append(segment_file)
+    return segment_files
+
+def split_audio_file_byte_ranges(audio_path, output_dir, segment_length=DEFAULT_SEGMENT_LENGTH, max_segments=None):
+    """生产路径：只规划字节范围，再按识别时的方式把每个范围读一遍（output_dir不使用）"""
+    header = read_wav_header(audio_path)
+    if not header:
+        return []
+    segments = plan_pcm_segments(audio_path, header, segment_length, max_segments=max_segments)
+    for segment in segments:
+        for _ in iter_pcm_range(segment['source'], segment['offset'], segment['length']):
+            pass
+    return segments
+
+def run_benchmark(hours, max_segments=30):
+    """对指定时长的音频分别运行两种分割方式并打印耗时"""
+    work_dir = tempfile.mkdtemp(prefix='split_bench_')
+    try:
+        audio_path = os.path.join(work_dir, f'bench_{hours}h.wav')
+        print(f"\n生成 {hours} 小时测试音频: {audio_path}")
+        if not generate_test_audio(audio_path, hours):
+            return
+
+        results = {}
+        for name, split_func in [
+            ('逐段ffmpeg', split_audio_file_per_segment),
+            ('字节范围', split_audio_file_byte_ranges),
+            ('segment复用器(回退)', split_audio_file),
+        ]:
+            output_dir = os.path.join(work_dir, f'segments_{len(results)}')
+            start = time.time()
+            segments = split_func(audio_path, output_dir, segment_length=DEFAULT_SEGMENT_LENGTH, max_segments=max_segments)
+            elapsed = time.time() - start
+            results[name] = elapsed
+            print(f"  {name}: {len(segments)} 个分段，耗时 {elapsed:.2f} 秒")
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+        baseline = results.get('逐段ffmpeg', 0)
+        current = results.get('字节范围', 0)
+        fallback = results.get('segment复用器(回退)', 0)
+        if current > 0:
+            print(f"  加速比（字节范围）: {baseline / current:.2f}x")
+        if fallback > 0:
+            print(f"  加速比（segment复用器）: {baseline / fallback:.2f}x")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    hours_list = [1, 3]
+    if len(sys.argv) > 1:
+        try:
+            hours_list = [float(arg) for arg in sys.argv[1:]]
+        except ValueError:
+            print("用法: python benchmark_split.py [小时数 ...]")
+            sys.exit(1)
+
+    for hours in hours_list:
+        run_benchmark(hours)
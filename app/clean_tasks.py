@@ -10,6 +10,12 @@ REDIS_HOST = os.environ.get('REDIS_HOST', 'localhost')
 REDIS_PORT = int(os.environ.get('REDIS_PORT', 6379))
 redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0)
 
+# 在仓库根目录运行时从 app 目录导入任务索引（Docker镜像中脚本与 task_index.py 位于同一目录）
+_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+_APP_DIR = os.path.join(_SCRIPT_DIR, 'app')
+sys.path.insert(0, _APP_DIR if os.path.isdir(_APP_DIR) else _SCRIPT_DIR)
+from task_index import TASK_INDEX_KEY, ensure_task_index, unregister_task
+
 def is_test_task(task_info):
     """判断任务是否为测试任务"""
     if not task_info:
@@ -39,6 +45,17 @@ def is_test_task(task_info):
     
     return False
 
+def is_file_shared(task_id, relative_path):
+    """释放任务对结果文件的引用，返回是否仍有其他任务（转写结果缓存命中）引用该文件"""
+    refs_key = f'file_refs:{relative_path}'
+    redis_client.srem(refs_key, task_id)
+    return redis_client.scard(refs_key) > 0
+
+def list_task_ids():
+    """所有任务ID：读取任务索引，升级前的任务尚未登记时先用SCAN补建索引（与Web端相同），不使用阻塞Redis的KEYS"""
+    ensure_task_index(redis_client)
+    return [member.decode('utf-8') for member in redis_client.zrange(TASK_INDEX_KEY, 0, -1)]
+
 def clean_tasks(test_only=True):
     """删除任务记录及相关文件
     
@@ -48,13 +65,11 @@ def clean_tasks(test_only=True):
     print("开始清理任务记录...")
     
     # 查找所有任务
-    task_keys = redis_client.keys('task:*')
-    print(f"找到 {len(task_keys)} 个任务记录")
+    task_ids = list_task_ids()
+    print(f"找到 {len(task_ids)} 个任务记录")
     
     cleaned_tasks = 0
-    for key in task_keys:
-        task_id = key.decode('utf-8').split(':')[1]
-        
+    for task_id in task_ids:
         try:
             # 从Redis中获取任务信息
             task_info_json = redis_client.hget(f'task:{task_id}', 'info')
@@ -71,7 +86,9 @@ def clean_tasks(test_only=True):
                 
                 # 1. 删除处理后的音频文件
                 processed_audio_relative_path = task_info.get('processed_audio_file')
-                if processed_audio_relative_path:
+                if processed_audio_relative_path and is_file_shared(task_id, processed_audio_relative_path):
+                    print(f"  音频文件仍被其他任务引用，保留: {processed_audio_relative_path}")
+                elif processed_audio_relative_path:
                     full_audio_path = os.path.join('downloads', processed_audio_relative_path)
                     if os.path.exists(full_audio_path):
                         os.remove(full_audio_path)
@@ -79,12 +96,24 @@ def clean_tasks(test_only=True):
                 
                 # 2. 删除TXT文件
                 txt_file_relative_path = task_info.get('txt_file')
-                if txt_file_relative_path:
+                if txt_file_relative_path and is_file_shared(task_id, txt_file_relative_path):
+                    print(f"  TXT文件仍被其他任务引用，保留: {txt_file_relative_path}")
+                elif txt_file_relative_path:
                     full_txt_path = os.path.join('downloads', txt_file_relative_path)
                     if os.path.exists(full_txt_path):
                         os.remove(full_txt_path)
                         print(f"  已删除TXT文件: {full_txt_path}")
                 
+                # 删除时间轴文件
+                timings_relative_path = task_info.get('timings_file')
+                if timings_relative_path and is_file_shared(task_id, timings_relative_path):
+                    print(f"  时间轴文件仍被其他任务引用，保留: {timings_relative_path}")
+                elif timings_relative_path:
+                    full_timings_path = os.path.join('downloads', timings_relative_path)
+                    if os.path.exists(full_timings_path):
+                        os.remove(full_timings_path)
+                        print(f"  已删除时间轴文件: {full_timings_path}")
+                
                 # 3. 删除临时分段目录
                 segment_temp_dir_name = task_info.get('segment_temp_dir')
                 if segment_temp_dir_name:
@@ -115,8 +144,9 @@ def clean_tasks(test_only=True):
                                         print(f"  已删除上传目录: {full_subdir_path}")
                                         break
             
-            # 6. 从Redis删除任务记录
-            redis_client.delete(f'task:{task_id}')
+            # 6. 从Redis删除任务记录，再从任务索引中移除
+            redis_client.delete(f'task:{task_id}', f'task_logs:{task_id}')
+            unregister_task(redis_client, task_id)
             print(f"  已从Redis删除任务记录: task:{task_id}")
             cleaned_tasks += 1
             
@@ -0,0 +1,304 @@
+"""
+识别会话的自适应并发控制
+
+同一个Speech资源（API密钥+区域）同时打开的会话过多时，Azure会以限流错误取消识别。
+ClusterSessionLimiter 通过Redis（Lua脚本保证原子性）在所有Worker进程/主机之间共享
+并发会话数、每分钟音频秒数配额，以及按 API密钥+区域 维护的AIMD（加性增、乘性减）并发上限：
+每个会话成功结束时上限缓慢增加，遇到限流时上限减半并进入短暂冷却期，
+在途会话数达到上限或处于冷却期时，新的会话在 acquire() 中排队等待。
+上限保存在Redis中，因此无论片段在线程池中还是在各个Celery Worker进程中识别，退避都对整个集群生效。
+"""
+import time
+import uuid
+import random
+import hashlib
+import threading
+
+# 识别取消原因分类
+CANCEL_THROTTLED = 'throttled'   # 429/配额/并发超限，降低并发后重试
+CANCEL_AUTH = 'auth'             # 密钥或区域错误，重试无意义
+CANCEL_BAD_AUDIO = 'bad_audio'   # 音频格式或内容无法识别，重试无意义
+CANCEL_TRANSIENT = 'transient'   # 网络或服务端临时错误，稍后重试
+
+# 不应重试的取消原因
+NON_RETRYABLE_CANCELLATIONS = (CANCEL_AUTH, CANCEL_BAD_AUDIO)
+
+_THROTTLE_MARKERS = ('429', 'too many', 'throttl', 'quota', 'rate limit', 'concurrent')
+_AUTH_MARKERS = ('401', '403', 'authentication', 'unauthorized', 'forbidden', 'spxerr_invalid_header', 'subscription key')
+_BAD_AUDIO_MARKERS = ('invalid audio', 'unsupported audio', 'audio format')
+
+class RecognitionCanceledError(Exception):
+    """识别会话因错误被取消，category 为上面的取消原因分类之一"""
+
+    def __init__(self, category, details):
+        super().__init__(f"识别被取消（{category}）: {details}")
+        self.category = category
+        self.details = details
+
+def classify_cancellation(error_code, error_details):
+    """
+    根据 CancellationDetails 的错误码和错误详情判断取消原因
+
+    Args:
+        error_code: CancellationErrorCode（或其字符串形式）
+        error_details: 错误详情文本
+
+    Returns:
+        str: CANCEL_THROTTLED / CANCEL_AUTH / CANCEL_BAD_AUDIO / CANCEL_TRANSIENT
+    """
+    code = str(error_code or '')
+    details = (error_details or '').lower()
+    if 'TooManyRequests' in code or any(marker in details for marker in _THROTTLE_MARKERS):
+        return CANCEL_THROTTLED
+    if 'AuthenticationFailure' in code or 'Forbidden' in code or any(marker in details for marker in _AUTH_MARKERS):
+        return CANCEL_AUTH
+    if 'BadRequest' in code or any(marker in details for marker in _BAD_AUDIO_MARKERS):
+        return CANCEL_BAD_AUDIO
+    return CANCEL_TRANSIENT
+
+# AIMD上限HASH的过期时间（秒）：长时间没有会话结束时上限回到初始值
+AIMD_STATE_TTL = 24 * 60 * 60
+
+# 集群级限流脚本：按到达顺序排队（公平），同时检查并发会话数、AIMD并发上限和每分钟音频秒数令牌桶。
+# KEYS: 会话租约ZSET, 令牌桶HASH, 排队ZSET(票据->到达时间), 排队心跳HASH(票据->最近一次尝试时间),
+#       AIMD状态HASH(limit, cooldown_until)
+# ARGV: 租约ID(兼作排队票据), 租约有效期, 最大会话数, 每分钟音频秒数(0为不限), 本次音频秒数, 排队票据失效时间,
+#       AIMD初始上限(0为不启用)
+# 返回: {1, 0} 获得许可；{0, 建议等待毫秒数} 需要继续等待
+_ACQUIRE_SCRIPT = """
+local sessions_key, bucket_key, queue_key, seen_key, aimd_key = KEYS[1], KEYS[2], KEYS[3], KEYS[4], KEYS[5]
+local lease_id = ARGV[1]
+local lease_ttl = tonumber(ARGV[2])
+local max_sessions = tonumber(ARGV[3])
+local capacity = tonumber(ARGV[4])
+local cost = tonumber(ARGV[5])
+local stale_after = tonumber(ARGV[6])
+local aimd_initial = tonumber(ARGV[7])
+
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+
+-- 多个调用方的租约有效期不同，键的过期时间只延长不缩短
+local function extend_ttl(key, ttl)
+    if redis.call('TTL', key) < ttl then
+        redis.call('EXPIRE', key, ttl)
+    end
+end
+
+-- 过期租约（进程崩溃未释放）和不再轮询的排队票据直接清除
+redis.call('ZREMRANGEBYSCORE', sessions_key, '-inf', now)
+redis.call('ZADD', queue_key, 'NX', now, lease_id)
+redis.call('HSET', seen_key, lease_id, now)
+local head = redis.call('ZRANGE', queue_key, 0, 19)
+for _, ticket in ipairs(head) do
+    local seen = tonumber(redis.call('HGET', seen_key, ticket) or '0')
+    if seen < now - stale_after then
+        redis.call('ZREM', queue_key, ticket)
+        redis.call('HDEL', seen_key, ticket)
+    end
+end
+extend_ttl(queue_key, lease_ttl)
+extend_ttl(seen_key, lease_ttl)
+
+-- 自适应上限：限流后的冷却期内不发放新许可，并发会话数不超过当前AIMD上限
+if aimd_initial > 0 then
+    local state = redis.call('HMGET', aimd_key, 'limit', 'cooldown_until')
+    local cooldown_until = tonumber(state[2] or '0')
+    if cooldown_until > now then
+        return {0, math.ceil((cooldown_until - now) * 1000)}
+    end
+    max_sessions = math.min(max_sessions, math.floor(tonumber(state[1] or aimd_initial)))
+end
+
+-- 公平排队：只有排在前面、且位次小于空闲会话数的票据才能获得许可
+local active = redis.call('ZCARD', sessions_key)
+local free = max_sessions - active
+local rank = redis.call('ZRANK', queue_key, lease_id)
+if free <= 0 or rank >= free then
+    return {0, 200}
+end
+
+-- 每分钟音频秒数令牌桶；单次请求超过桶容量时等桶满后放行（余额为负，后续请求等待补足）
+if capacity > 0 then
+    local rate = capacity / 60
+    local tokens = tonumber(redis.call('HGET', bucket_key, 'tokens') or tostring(capacity))
+    local updated = tonumber(redis.call('HGET', bucket_key, 'ts') or tostring(now))
+    tokens = math.min(capacity, tokens + (now - updated) * rate)
+    local needed = math.min(cost, capacity)
+    if tokens < needed then
+        redis.call('HSET', bucket_key, 'tokens', tokens, 'ts', now)
+        redis.call('EXPIRE', bucket_key, 120)
+        return {0, math.ceil((needed - tokens) / rate * 1000)}
+    end
+    redis.call('HSET', bucket_key, 'tokens', tokens - cost, 'ts', now)
+    redis.call('EXPIRE', bucket_key, math.ceil(60 + math.max(0, cost - tokens) / rate))
+end
+
+redis.call('ZADD', sessions_key, now + lease_ttl, lease_id)
+-- 租约ZSET在最晚到期的租约之后才过期，较短的租约不会让仍有效的长租约随键一起消失
+local latest = redis.call('ZRANGE', sessions_key, -1, -1, 'WITHSCORES')
+redis.call('EXPIREAT', sessions_key, math.ceil(tonumber(latest[2])) + 1)
+redis.call('ZREM', queue_key, lease_id)
+redis.call('HDEL', seen_key, lease_id)
+return {1, 0}
+"""
+
+# 会话结束：释放租约并按会话结果调整AIMD上限
+# KEYS: 会话租约ZSET, AIMD状态HASH
+# ARGV: 租约ID, 会话结果(ok / throttled / 其他取消原因 / unused), AIMD初始上限, 下限, 上限, 乘性减系数, 冷却时间, 状态过期时间
+# 返回: {本次是否因限流缩减了上限, 当前上限}
+_RELEASE_SCRIPT = """
+local sessions_key, aimd_key = KEYS[1], KEYS[2]
+local lease_id, outcome = ARGV[1], ARGV[2]
+local initial, minimum, maximum = tonumber(ARGV[3]), tonumber(ARGV[4]), tonumber(ARGV[5])
+local decrease_factor, cooldown, state_ttl = tonumber(ARGV[6]), tonumber(ARGV[7]), tonumber(ARGV[8])
+
+redis.call('ZREM', sessions_key, lease_id)
+if initial <= 0 then
+    return {0, '0'}
+end
+
+local state = redis.call('HMGET', aimd_key, 'limit', 'cooldown_until')
+local limit = tonumber(state[1] or initial)
+local cooldown_until = tonumber(state[2] or '0')
+local decreased = 0
+if outcome == 'ok' then
+    -- 加性增：每完成约"上限"个会话上限加一
+    limit = math.min(maximum, limit + 1 / limit)
+elseif outcome == 'throttled' then
+    -- 同一轮限流往往让多个在途会话同时失败，冷却期内只缩减一次
+    local t = redis.call('TIME')
+    local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+    if now >= cooldown_until then
+        limit = math.max(minimum, limit * decrease_factor)
+        cooldown_until = now + cooldown
+        decreased = 1
+    end
+else
+    return {0, tostring(limit)}
+end
+redis.call('HSET', aimd_key, 'limit', tostring(limit), 'cooldown_until', tostring(cooldown_until))
+redis.call('EXPIRE', aimd_key, state_ttl)
+return {decreased, tostring(limit)}
+"""
+
+class ClusterSessionLimiter:
+    """
+    基于Redis的集群级识别会话限流，所有Worker进程/主机共享
+
+    同时限制某个 API密钥+区域 的并发会话数和每分钟可提交的音频秒数；
+    资源不足时请求按到达顺序排队，避免大任务的片段持续抢占导致小任务饿死。
+    租约带有效期，Worker崩溃未释放的名额会在有效期后自动回收。
+
+    initial_limit 大于0时还启用AIMD并发上限（见模块说明），实际并发会话数不超过
+    min(max_sessions, 当前上限)；会话结束时调用 complete() 按结果调整上限。
+    """
+    
+    def __init__(self, redis_client, api_key, api_region, max_sessions, audio_seconds_per_minute=0,
+                 stale_after=10, max_wait_interval=1.0, initial_limit=0, min_limit=1, max_limit=50,
+                 decrease_factor=0.5, cooldown=5.0):
+        key_hash = hashlib.sha1((api_key or '').encode()).hexdigest()[:12]
+        prefix = f'ratelimit:{key_hash}:{api_region}'
+        self.keys = [f'{prefix}:sessions', f'{prefix}:tokens', f'{prefix}:queue', f'{prefix}:queue_seen',
+                     f'{prefix}:aimd']
+        self.redis_client = redis_client
+        self.max_sessions = max_sessions
+        self.audio_seconds_per_minute = audio_seconds_per_minute
+        self.stale_after = stale_after
+        self.max_wait_interval = max_wait_interval
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.initial_limit = min(self.max_limit, max(self.min_limit, initial_limit)) if initial_limit > 0 else 0
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self._script = redis_client.register_script(_ACQUIRE_SCRIPT)
+        self._release_script = redis_client.register_script(_RELEASE_SCRIPT)
+    
+    def acquire(self, audio_seconds, lease_ttl):
+        """
+        阻塞直到获得一个会话许可
+
+        Args:
+            audio_seconds: 本次会话要提交的音频时长（秒），计入每分钟音频秒数
+            lease_ttl: 租约有效期（秒），应不短于会话的最长持续时间
+
+        Returns:
+            str: 租约ID，会话结束后传给 release()
+        """
+        lease_id = uuid.uuid4().hex
+        while True:
+            granted, wait_ms = self._script(
+                keys=self.keys,
+                args=[lease_id, int(lease_ttl), self.max_sessions, self.audio_seconds_per_minute,
+                      float(audio_seconds), self.stale_after, self.initial_limit]
+            )
+            if int(granted) == 1:
+                return lease_id
+            # 等待间隔不超过 max_wait_interval，保证排队心跳不过期
+            time.sleep(min(self.max_wait_interval, max(0.05, int(wait_ms) / 1000.0)) * random.uniform(0.8, 1.2))
+    
+    def release(self, lease_id):
+        """释放会话许可但不调整AIMD上限：获得许可后没有真正开始会话，或会话结果未分类"""
+        self.redis_client.zrem(self.keys[0], lease_id)
+    
+    def complete(self, lease_id, category=None):
+        """
+        会话结束：释放许可并根据会话结果调整AIMD上限
+
+        Args:
+            category: None 表示会话正常结束；CANCEL_THROTTLED 触发乘性减；其他取消原因不调整上限
+
+        Returns:
+            bool: 本次是否因限流缩减了上限
+        """
+        decreased, _ = self._release_script(
+            keys=[self.keys[0], self.keys[4]],
+            args=[lease_id, category or 'ok', self.initial_limit, self.min_limit, self.max_limit,
+                  self.decrease_factor, self.cooldown, AIMD_STATE_TTL]
+        )
+        return int(decreased) == 1
+    
+    def limit(self):
+        """当前生效的并发会话上限（AIMD上限与 max_sessions 中较小者）"""
+        if not self.initial_limit:
+            return self.max_sessions
+        stored = self.redis_client.hget(self.keys[4], 'limit')
+        return min(self.max_sessions, int(float(stored)) if stored else self.initial_limit)
+    
+    def active_sessions(self):
+        """当前仍持有租约的会话数"""
+        return self.redis_client.zcount(self.keys[0], time.time(), '+inf')
+    
+    def is_saturated(self):
+        """会话数已满、限流冷却中或已有请求在排队等待，新的会话无法立即开始"""
+        now = time.time()
+        pipe = self.redis_client.pipeline()
+        pipe.zcount(self.keys[0], now, '+inf')
+        pipe.zcard(self.keys[2])
+        pipe.hmget(self.keys[4], 'limit', 'cooldown_until')
+        active, waiting, (stored_limit, cooldown_until) = pipe.execute()
+        limit = self.max_sessions
+        if self.initial_limit:
+            limit = min(limit, int(float(stored_limit)) if stored_limit else self.initial_limit)
+            if cooldown_until and float(cooldown_until) > now:
+                return True
+        return active >= limit or waiting > 0
+
+_cluster_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_cluster_limiter(redis_client, api_key, api_region, max_sessions, audio_seconds_per_minute, **adaptive):
+    """
+    获取（或创建）某个 API密钥+区域 的集群级限流器，同一进程内复用已注册的脚本
+
+    adaptive 为AIMD参数（initial_limit, min_limit, max_limit, cooldown），见 ClusterSessionLimiter。
+    密钥只以哈希形式作为字典键，不在内存中额外保留明文。
+    """
+    limiter_key = f"{hashlib.sha1((api_key or '').encode()).hexdigest()[:12]}:{api_region}"
+    with _limiters_lock:
+        limiter = _cluster_limiters.get(limiter_key)
+        if limiter is None:
+            limiter = ClusterSessionLimiter(redis_client, api_key, api_region, max_sessions, audio_seconds_per_minute,
+                                            **adaptive)
+            _cluster_limiters[limiter_key] = limiter
+        return limiter
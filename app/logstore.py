@@ -0,0 +1,122 @@
+"""
+任务日志与通用日志的存储（Redis Streams）
+
+每条日志用 XADD 追加到各自的流中，流长度用 MAXLEN ~ 近似截断到 LOG_MAX_ENTRIES 条，
+写入不再需要读出并重写整个日志数组，多个进程同时写入也不会互相覆盖。
+流中条目的ID单调递增，读取时传入上次拿到的最后一个ID即可只取新增的日志。
+
+早期版本把日志作为JSON数组保存在任务哈希的 logs 字段（通用日志在 general_logs 字符串键）中，
+第一次读取时自动迁移到流中。
+"""
+import json
+import time
+from datetime import datetime
+
+# 每个日志流保留的最大条数（近似）与过期时间（秒）
+LOG_MAX_ENTRIES = 500
+LOG_TTL = 7 * 24 * 60 * 60
+
+GENERAL_LOG_KEY = 'general_log_stream'
+LEGACY_GENERAL_LOG_KEY = 'general_logs'
+
+def task_log_key(task_id):
+    """任务日志流的键名（不使用 task: 前缀，避免被当作任务记录）"""
+    return f'task_logs:{task_id}'
+
+def make_log_entry(message, log_type='info', source='server', kind=None, timestamp=None):
+    """
+    构造一条日志
+
+    Args:
+        message: 日志内容
+        log_type: info / warning / error / success
+        source: server 为后端写入，client 为页面提交
+        kind: 日志类别，progress 表示没有文本的进度变化记录
+        timestamp: 时间戳，为None时取当前时间
+    """
+    timestamp = time.time() if timestamp is None else timestamp
+    entry = {
+        'time': datetime.fromtimestamp(timestamp).strftime('%H:%M:%S'),
+        'timestamp': timestamp,
+        'message': message,
+        'type': log_type,
+        'source': source
+    }
+    if kind:
+        entry['kind'] = kind
+    return entry
+
+def append_log(redis_client, key, entry, pipe=None):
+    """
+    追加一条日志到日志流
+
+    Args:
+        redis_client: Redis客户端
+        key: 日志流键名
+        entry: make_log_entry 的返回值
+        pipe: 传入时只把命令加入该管道，由调用方执行
+    """
+    target = pipe if pipe is not None else redis_client.pipeline(transaction=False)
+    target.xadd(key, {field: str(value) for field, value in entry.items()},
+                maxlen=LOG_MAX_ENTRIES, approximate=True)
+    target.expire(key, LOG_TTL)
+    if pipe is None:
+        target.execute()
+    return entry
+
+def _decode_entry(entry_id, fields):
+    entry = {
+        (field.decode('utf-8') if isinstance(field, bytes) else field):
+        (value.decode('utf-8') if isinstance(value, bytes) else value)
+        for field, value in fields.items()
+    }
+    entry['id'] = entry_id.decode('utf-8') if isinstance(entry_id, bytes) else entry_id
+    try:
+        entry['timestamp'] = float(entry.get('timestamp', 0))
+    except ValueError:
+        entry['timestamp'] = 0.0
+    return entry
+
+def read_logs(redis_client, key, after=None, count=None):
+    """
+    读取日志流
+
+    Args:
+        after: 上次读到的最后一个日志ID，只返回其后的日志；为None时从头读取
+        count: 最多返回的条数
+
+    Returns:
+        list: 日志字典列表（按时间顺序），每条带 id 字段，可作为下次读取的 after
+    """
+    start = '-' if not after else after
+    # XRANGE 的起点是包含的，多取一条再去掉游标本身
+    entries = redis_client.xrange(key, min=start, max='+', count=count + 1 if count and after else count)
+    logs = [_decode_entry(entry_id, fields) for entry_id, fields in entries]
+    if after and logs and logs[0]['id'] == after:
+        logs = logs[1:]
+    return logs[:count] if count else logs
+
+def clear_logs(redis_client, key):
+    """删除日志流"""
+    redis_client.delete(key)
+
+def migrate_legacy_logs(redis_client, key, legacy_json):
+    """
+    把旧版JSON数组格式的日志写入日志流
+
+    Returns:
+        int: 迁移的日志条数
+    """
+    try:
+        legacy_logs = json.loads(legacy_json)
+    except (TypeError, ValueError):
+        return 0
+    if not isinstance(legacy_logs, list) or not legacy_logs:
+        return 0
+    pipe = redis_client.pipeline(transaction=False)
+    for log in legacy_logs[-LOG_MAX_ENTRIES:]:
+        entry = make_log_entry(log.get('message', ''), log.get('type', 'info'),
+                               timestamp=log.get('timestamp') or time.time())
+        append_log(redis_client, key, entry, pipe=pipe)
+    pipe.execute()
+    return len(legacy_logs)
@@ -0,0 +1,102 @@
+"""
+任务进度事件的推送（Redis发布订阅 + 进程内分发）
+
+Worker 在更新进度的Lua脚本中同时 PUBLISH 到 task_events:{task_id}，事件随进度写入一起完成，不额外往返。
+每个Web进程只有一个监听线程，用一个Redis连接 PSUBSCRIBE task_events:*，收到事件后放入
+订阅了该任务的各个连接（SSE）的内存队列。等待事件的连接只阻塞在自己的队列上，不访问Redis；
+没有任何订阅者时不启动监听线程。
+
+Web进程自身产生的事件（如文件格式转换进度）用 notify() 直接在进程内分发。
+"""
+import json
+import time
+import queue
+import threading
+
+TASK_EVENT_CHANNEL_PREFIX = 'task_events:'
+
+# 每个订阅队列最多缓存的事件数，消费过慢时丢弃最旧的事件（事件都是完整状态，只有最新的一条有意义）
+SUBSCRIBER_QUEUE_SIZE = 100
+
+def task_event_channel(task_id):
+    """任务进度事件的频道名"""
+    return f'{TASK_EVENT_CHANNEL_PREFIX}{task_id}'
+
+class EventHub:
+    """每个Web进程一个的事件分发器"""
+
+    def __init__(self, redis_client, channel_prefix=TASK_EVENT_CHANNEL_PREFIX):
+        self.redis_client = redis_client
+        self.channel_prefix = channel_prefix
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._listener = None
+
+    def subscribe(self, key):
+        """
+        订阅某个任务（或转换ID）的事件
+
+        Returns:
+            queue.Queue: 事件字典队列，用完后调用 unsubscribe() 归还
+        """
+        subscriber = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.setdefault(key, set()).add(subscriber)
+        self._ensure_listener()
+        return subscriber
+
+    def unsubscribe(self, key, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(key)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[key]
+
+    def notify(self, key, event):
+        """把事件放入该键所有订阅者的队列"""
+        with self._lock:
+            subscribers = list(self._subscribers.get(key, ()))
+        for subscriber in subscribers:
+            while True:
+                try:
+                    subscriber.put_nowait(event)
+                    break
+                except queue.Full:
+                    try:
+                        subscriber.get_nowait()
+                    except queue.Empty:
+                        pass
+
+    def _ensure_listener(self):
+        with self._lock:
+            if self._listener is not None and self._listener.is_alive():
+                return
+            self._listener = threading.Thread(target=self._listen, name='progress-events', daemon=True)
+            self._listener.start()
+
+    def _listen(self):
+        while True:
+            pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.psubscribe(f'{self.channel_prefix}*')
+                for message in pubsub.listen():
+                    if message.get('type') != 'pmessage':
+                        continue
+                    channel = message['channel']
+                    if isinstance(channel, bytes):
+                        channel = channel.decode('utf-8')
+                    try:
+                        event = json.loads(message['data'])
+                    except (TypeError, ValueError):
+                        continue
+                    self.notify(channel[len(self.channel_prefix):], event)
+            except Exception as e:
+                # 连接断开时重新订阅；断开期间的事件会丢失，但之后的每个事件都带有完整的进度状态
+                print(f"进度事件订阅中断，1秒后重连: {str(e)}")
+                time.sleep(1)
+            finally:
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
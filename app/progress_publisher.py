@@ -0,0 +1,110 @@
+"""
+识别进度事件的后台合并写入
+
+识别回调（Speech SDK的回调线程、进度轮询）每次识别出一句话或每隔两秒都会产生进度事件。
+回调只把事件交给本进程的发布器（内存操作，不做任何网络I/O），后台线程每隔 interval 秒
+把每个任务积累的事件合并成一份最新状态，由 write_batch 用一个管道一次写入Redis：
+
+    进度        处理中的进度取最大值，文本取最新值，日志只保留最后一条
+    进度计数器  已完成片段数取最大值，总片段数取最新值
+    部分文本    每个片段只保留最新文本
+    首段文本    只记录第一次出现的时间
+
+片段或任务结束前调用 flush() 同步写出该任务尚未写入的事件，保证结束状态之后不会再有旧事件落地。
+"""
+import os
+import time
+import threading
+
+class ProgressPublisher:
+    """每个进程一个的进度事件合并写入器"""
+
+    def __init__(self, write_batch, interval=1.0):
+        """
+        Args:
+            write_batch: 回调，参数为 {task_id: 合并后的状态}，一次往返写入Redis
+            interval: 合并写入的间隔（秒）
+        """
+        self.write_batch = write_batch
+        self.interval = interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def _state(self, task_id):
+        state = self._pending.get(task_id)
+        if state is None:
+            state = {
+                'progress': None, 'text': None, 'has_text': False,
+                'total_segments': None, 'completed_segments': None,
+                'partial': {}, 'first_text_at': None
+            }
+            self._pending[task_id] = state
+        return state
+
+    def progress(self, task_id, progress, text=None):
+        """处理中的进度（百分比）和当前文本"""
+        with self._lock:
+            state = self._state(task_id)
+            if state['progress'] is None or progress > state['progress']:
+                state['progress'] = progress
+            if text is not None:
+                state['text'] = text
+                state['has_text'] = True
+        self._ensure_thread()
+
+    def counter(self, task_id, total_segments, completed_segments):
+        """按片段数计算的进度（已完成片段数可带小数）"""
+        with self._lock:
+            state = self._state(task_id)
+            state['total_segments'] = total_segments
+            if state['completed_segments'] is None or completed_segments > state['completed_segments']:
+                state['completed_segments'] = completed_segments
+        self._ensure_thread()
+
+    def partial_text(self, task_id, segment_index, text, done=False):
+        """某个片段当前已识别的文本"""
+        with self._lock:
+            self._state(task_id)['partial'][segment_index] = (text, done)
+        self._ensure_thread()
+
+    def first_text(self, task_id):
+        """任务识别出了第一句文本"""
+        with self._lock:
+            state = self._state(task_id)
+            if state['first_text_at'] is None:
+                state['first_text_at'] = time.time()
+        self._ensure_thread()
+
+    def flush(self, task_id=None):
+        """同步写出指定任务（为None时为所有任务）尚未写入的事件"""
+        with self._flush_lock:
+            with self._lock:
+                if task_id is None:
+                    batch, self._pending = self._pending, {}
+                else:
+                    state = self._pending.pop(task_id, None)
+                    batch = {task_id: state} if state is not None else {}
+            if batch:
+                try:
+                    self.write_batch(batch)
+                except Exception as e:
+                    print(f"写入进度事件失败: {str(e)}")
+
+    def _ensure_thread(self):
+        # Celery prefork在导入后fork子进程，线程不会被继承，按进程ID在各子进程中懒启动
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='progress-publisher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
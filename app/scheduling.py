@@ -0,0 +1,43 @@
+"""
+片段调度：最长优先的提交顺序与任务完成时间（makespan）估计
+
+片段时长并不相同（最后一段较短，VAD切分后差异更大）。按时长从长到短提交，
+长片段不会排在最后才开始而单独拖长整个任务；估计完成时间时按同样的顺序
+把片段贪心地分配给最先空闲的并行槽位（LPT调度）。
+"""
+import heapq
+
+def order_longest_first(segments, leading=0):
+    """
+    按时长从长到短排列片段，时长相同时保持原顺序
+
+    Args:
+        segments: 分段描述字典列表（含 duration 字段）
+        leading: 保持在最前面、按原顺序提交的片段数（渐进分段开头的短片段，用于尽快显示第一段文本）
+
+    Returns:
+        list: (片段索引, 分段描述) 列表，索引为片段在时间轴上的原始位置
+    """
+    indexed = list(enumerate(segments))
+    return indexed[:leading] + sorted(indexed[leading:], key=lambda item: (-item[1].get('duration', 0.0), item[0]))
+
+def estimate_makespan(durations, slots, rtf):
+    """
+    估计按给定顺序识别全部片段所需的时间（秒）
+
+    每个片段交给当前负载最小的槽位，识别耗时按 音频时长 × rtf 计算。
+
+    Args:
+        durations: 各片段音频时长（秒），按提交顺序
+        slots: 同时识别的片段数
+        rtf: 识别耗时与音频时长之比
+
+    Returns:
+        float: 最后一个片段完成的时间
+    """
+    if not durations:
+        return 0.0
+    loads = [0.0] * max(1, min(slots, len(durations)))
+    for duration in durations:
+        heapq.heapreplace(loads, loads[0] + duration * rtf)
+    return max(loads)
@@ -0,0 +1,385 @@
+"""
+语音识别后端
+
+短音频、分段和流式识别只通过 RecognitionSession 与识别引擎交互：
+    session.connect(on_recognized, on_canceled, on_stopped)
+    session.start()        # 阻塞直到识别已启动
+    session.write(chunk)   # 推送模式下写入16kHz单声道16bit PCM
+    session.close()        # 推送模式下表示音频已写完
+    session.stop()         # 阻塞直到识别已停止
+
+回调参数:
+    on_recognized(text, offset, duration, words)
+                                            offset/duration 为相对本会话音频起点的秒数；
+                                            words 为 (词, 偏移, 时长) 列表，后端不提供词级时间戳时为None
+    on_canceled(error_code, error_details)  仅在因错误取消时调用，error_code 为字符串
+    on_stopped()                            会话结束（正常结束或出错取消后）时调用一次
+
+内置三个后端：azure（Azure Speech SDK）、local（Vosk离线模型，纯CPU运行，
+不受Azure配额限制）和 fake（本地确定性假引擎，按设定的实时率输出脚本文本并按设定的
+比例注入错误，用于无网络压测整条处理流水线）。
+"""
+import os
+import json
+import queue
+import random
+import itertools
+import threading
+
+try:
+    import azure.cognitiveservices.speech as speechsdk
+except ImportError:  # 只使用假引擎压测时可以不安装Azure Speech SDK
+    speechsdk = None
+
+try:
+    import vosk
+except ImportError:  # 本地识别引擎为可选依赖，只有本地识别Worker需要安装
+    vosk = None
+
+from audio_utils import read_wav_header, iter_pcm_range, TARGET_SAMPLE_RATE, TARGET_CHANNELS, TARGET_BITS_PER_SAMPLE
+
+BYTES_PER_SECOND = TARGET_SAMPLE_RATE * TARGET_CHANNELS * TARGET_BITS_PER_SAMPLE // 8
+
+# Azure SDK的偏移和时长以100纳秒为单位
+AZURE_TICKS_PER_SECOND = 10 ** 7
+
+# 假引擎会话序号：参与错误注入的随机种子，使重试同一段音频时不会必然再次失败
+_fake_session_counter = itertools.count()
+
+# 已加载的本地识别模型（模型路径 -> vosk.Model），同一进程内所有会话共享
+_local_models = {}
+_local_models_lock = threading.Lock()
+
+class RecognitionSession:
+    """识别会话基类，负责保存回调并保证 on_stopped 只触发一次"""
+
+    def __init__(self):
+        self._on_recognized = None
+        self._on_canceled = None
+        self._on_stopped = None
+        self._stopped_fired = threading.Event()
+
+    def connect(self, on_recognized, on_canceled, on_stopped):
+        self._on_recognized = on_recognized
+        self._on_canceled = on_canceled
+        self._on_stopped = on_stopped
+
+    def _emit_recognized(self, text, offset, duration, words=None):
+        if self._on_recognized:
+            self._on_recognized(text, offset, duration, words)
+
+    def _emit_canceled(self, error_code, error_details):
+        if self._on_canceled:
+            self._on_canceled(error_code, error_details)
+
+    def _emit_stopped(self):
+        if self._stopped_fired.is_set():
+            return
+        self._stopped_fired.set()
+        if self._on_stopped:
+            self._on_stopped()
+
+    def start(self):
+        raise NotImplementedError
+
+    def write(self, chunk):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    def stop(self):
+        raise NotImplementedError
+
+class AzureRecognitionSession(RecognitionSession):
+    """基于Azure Speech SDK连续识别的会话"""
+
+    def __init__(self, speech_config, audio_path=None):
+        super().__init__()
+        self._push_stream = None
+        if audio_path:
+            audio_config = speechsdk.audio.AudioConfig(filename=audio_path)
+        else:
+            stream_format = speechsdk.audio.AudioStreamFormat(
+                samples_per_second=TARGET_SAMPLE_RATE,
+                bits_per_sample=TARGET_BITS_PER_SAMPLE,
+                channels=TARGET_CHANNELS
+            )
+            self._push_stream = speechsdk.audio.PushAudioInputStream(stream_format=stream_format)
+            audio_config = speechsdk.audio.AudioConfig(stream=self._push_stream)
+        self._recognizer = speechsdk.SpeechRecognizer(speech_config=speech_config, audio_config=audio_config)
+        self._recognizer.recognized.connect(self._recognized_cb)
+        self._recognizer.canceled.connect(self._canceled_cb)
+        self._recognizer.session_stopped.connect(lambda evt: self._emit_stopped())
+
+    def _recognized_cb(self, evt):
+        result = evt.result
+        self._emit_recognized(result.text, result.offset / AZURE_TICKS_PER_SECOND, result.duration / AZURE_TICKS_PER_SECOND,
+                              self._parse_words(result))
+
+    @staticmethod
+    def _parse_words(result):
+        """从详细结果JSON中取出最佳候选的词级时间戳（request_word_level_timestamps 开启后提供）"""
+        try:
+            best = (json.loads(result.json).get('NBest') or [{}])[0]
+            return [
+                (word['Word'], word['Offset'] / AZURE_TICKS_PER_SECOND, word['Duration'] / AZURE_TICKS_PER_SECOND)
+                for word in best.get('Words') or []
+            ]
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return None
+
+    def _canceled_cb(self, evt):
+        details = evt.cancellation_details
+        # 音频读完（含推送流关闭）时会以EndOfStream原因取消，只有Error才是真正的失败
+        if details.reason == speechsdk.CancellationReason.Error:
+            self._emit_canceled(str(details.error_code), details.error_details)
+        self._emit_stopped()
+
+    def start(self):
+        self._recognizer.start_continuous_recognition_async().get()
+
+    def write(self, chunk):
+        self._push_stream.write(chunk)
+
+    def close(self):
+        self._push_stream.close()
+
+    def stop(self):
+        self._recognizer.stop_continuous_recognition_async().get()
+
+class AzureRecognitionBackend:
+    """Azure Speech 识别后端"""
+
+    name = 'azure'
+
+    def __init__(self, api_key, api_region, language, diarization='true', profanity_filter='None'):
+        self.speech_config = speechsdk.SpeechConfig(subscription=api_key, region=api_region)
+        self.speech_config.speech_recognition_language = language
+
+        # 根据微软文档配置识别选项
+        self.speech_config.set_property_by_name("DiarizationEnabled", diarization)
+        self.speech_config.set_property_by_name("ProfanityFilterMode", profanity_filter)
+        self.speech_config.request_word_level_timestamps()
+
+    def create_session(self, audio_path=None):
+        """创建识别会话；audio_path 为None时使用推送流"""
+        return AzureRecognitionSession(self.speech_config, audio_path)
+
+class FakeRecognitionSession(RecognitionSession):
+    """
+    本地假识别会话
+
+    每凑够 phrase_seconds 秒音频，等待 phrase_seconds*rtf 秒后输出一句脚本文本。
+    是否注入错误由种子、会话序号、已处理音频字节数和句子序号决定：
+    固定种子下按相同顺序创建会话时结果完全相同，重试则相当于新的一次抽样。
+    """
+
+    def __init__(self, backend, audio_path=None):
+        super().__init__()
+        self._backend = backend
+        self._condition = threading.Condition()
+        self._available = 0
+        self._closed = False
+        self._stop_requested = threading.Event()
+        self._thread = None
+        self._sequence = next(_fake_session_counter)
+        if audio_path:
+            header = read_wav_header(audio_path)
+            self._available = header['data_size'] if header else max(0, os.path.getsize(audio_path) - 44)
+            self._closed = True
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self, chunk):
+        with self._condition:
+            self._available += len(chunk)
+            self._condition.notify_all()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def stop(self):
+        self._stop_requested.set()
+        with self._condition:
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        self._emit_stopped()
+
+    def _run(self):
+        backend = self._backend
+        phrase_bytes = max(2, int(backend.phrase_seconds * BYTES_PER_SECOND) // 2 * 2)
+        emitted = 0
+        phrase_index = 0
+        while True:
+            with self._condition:
+                while (not self._stop_requested.is_set() and not self._closed
+                       and self._available - emitted < phrase_bytes):
+                    self._condition.wait()
+                if self._stop_requested.is_set():
+                    return
+                chunk_bytes = min(phrase_bytes, self._available - emitted)
+                last = self._closed and self._available - emitted <= phrase_bytes
+
+            if chunk_bytes > 0:
+                chunk_seconds = chunk_bytes / BYTES_PER_SECOND
+                # 模拟识别耗时；stop() 可以随时打断
+                if self._stop_requested.wait(chunk_seconds * backend.rtf):
+                    return
+                rng = random.Random(f"{backend.seed}:{self._sequence}:{emitted}:{phrase_index}")
+                if rng.random() < backend.error_rate:
+                    self._emit_canceled(backend.error_code, f"Fake engine injected error ({backend.error_code})")
+                    self._emit_stopped()
+                    return
+                text = backend.script[phrase_index % len(backend.script)].format(n=phrase_index + 1)
+                self._emit_recognized(text, emitted / BYTES_PER_SECOND, chunk_seconds)
+                emitted += chunk_bytes
+                phrase_index += 1
+
+            if last:
+                self._emit_stopped()
+                return
+
+class FakeRecognitionBackend:
+    """本地确定性假识别后端，不访问网络"""
+
+    name = 'fake'
+
+    DEFAULT_SCRIPT = ["这是第{n}句测试文本。"]
+
+    def __init__(self, rtf=0.05, error_rate=0.0, error_code='TooManyRequests', phrase_seconds=5.0, seed=0, script_path=None):
+        """
+        Args:
+            rtf: 实时率，处理1秒音频耗时 rtf 秒（0.05 即20倍实时）
+            error_rate: 每句注入取消错误的概率
+            error_code: 注入错误的错误码（TooManyRequests 可用于演练自适应限流）
+            phrase_seconds: 每句文本对应的音频秒数
+            seed: 随机种子
+            script_path: 脚本文本文件，每行一句，可用 {n} 表示句子序号；为空时使用内置文本
+        """
+        self.rtf = rtf
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.phrase_seconds = phrase_seconds
+        self.seed = seed
+        self.script = self.DEFAULT_SCRIPT
+        if script_path:
+            with open(script_path, 'r', encoding='utf-8') as f:
+                lines = [line.strip() for line in f if line.strip()]
+            if lines:
+                self.script = lines
+
+    def create_session(self, audio_path=None):
+        """创建识别会话；audio_path 为None时使用推送模式"""
+        return FakeRecognitionSession(self, audio_path)
+
+def local_engine_installed():
+    """是否已安装本地识别引擎（vosk）"""
+    return vosk is not None
+
+def load_local_model(model_path):
+    """
+    加载本地识别模型；每个进程每个模型只加载一次
+
+    模型加载耗时数秒且占用数百MB内存，因此在进程内缓存并由所有会话共享
+    （vosk.Model 可以被多个识别器同时使用）。
+    """
+    with _local_models_lock:
+        model = _local_models.get(model_path)
+        if model is None:
+            if vosk is None:
+                raise RuntimeError('未安装vosk，无法使用本地识别引擎')
+            vosk.SetLogLevel(-1)
+            model = vosk.Model(model_path)
+            _local_models[model_path] = model
+            print(f"已加载本地识别模型: {model_path}")
+        return model
+
+class LocalRecognitionSession(RecognitionSession):
+    """
+    基于Vosk的本地识别会话
+
+    识别在独立线程中进行：文件模式直接读取WAV中的PCM数据，推送模式从队列中取出写入的数据块。
+    每识别出一句（Vosk判定的停顿处）输出一次文本，偏移和时长取自词级时间戳。
+    """
+
+    def __init__(self, model, audio_path=None):
+        super().__init__()
+        self._recognizer = vosk.KaldiRecognizer(model, TARGET_SAMPLE_RATE)
+        self._recognizer.SetWords(True)
+        self._audio_path = audio_path
+        self._chunks = queue.Queue()
+        self._stop_requested = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self, chunk):
+        self._chunks.put(chunk)
+
+    def close(self):
+        self._chunks.put(None)
+
+    def stop(self):
+        self._stop_requested.set()
+        self._chunks.put(None)
+        if self._thread is not None:
+            self._thread.join()
+        self._emit_stopped()
+
+    def _iter_file_chunks(self):
+        header = read_wav_header(self._audio_path)
+        if header:
+            offset, length = header['data_offset'], header['data_size']
+        else:
+            offset, length = 44, max(0, os.path.getsize(self._audio_path) - 44)
+        return iter_pcm_range(self._audio_path, offset, length)
+
+    def _emit_result(self, result_json):
+        result = json.loads(result_json)
+        text = result.get('text', '').strip()
+        if not text:
+            return
+        words = result.get('result') or []
+        offset = words[0]['start'] if words else 0.0
+        end = words[-1]['end'] if words else offset
+        self._emit_recognized(text, offset, end - offset,
+                              [(word['word'], word['start'], word['end'] - word['start']) for word in words])
+
+    def _run(self):
+        try:
+            chunks = self._iter_file_chunks() if self._audio_path else iter(self._chunks.get, None)
+            for chunk in chunks:
+                if self._stop_requested.is_set():
+                    return
+                if self._recognizer.AcceptWaveform(bytes(chunk)):
+                    self._emit_result(self._recognizer.Result())
+            if not self._stop_requested.is_set():
+                self._emit_result(self._recognizer.FinalResult())
+        except Exception as e:
+            self._emit_canceled('LocalEngineError', str(e))
+        finally:
+            self._emit_stopped()
+
+class LocalRecognitionBackend:
+    """本地离线识别后端（Vosk），只占用CPU，不访问网络"""
+
+    name = 'local'
+
+    def __init__(self, model_path):
+        """
+        Args:
+            model_path: Vosk模型目录，同一进程内重复创建后端不会重复加载模型
+        """
+        self.model = load_local_model(model_path)
+
+    def create_session(self, audio_path=None):
+        """创建识别会话；audio_path 为None时使用推送模式"""
+        return LocalRecognitionSession(self.model, audio_path)
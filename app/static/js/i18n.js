@@ -27,6 +27,9 @@ const translations = {
     'api-region': 'Azure 区域',
     'parallel-threads': '并行处理线程数',
     'segment-length': '音频分段长度 (秒)',
+    'recognition-engine': '识别引擎',
+    'engine-azure': 'Azure Speech（云端）',
+    'engine-local': '本地引擎（离线，无需API密钥）',
     'clean-temp': '清除临时文件',
     'test-api': '测试API连接',
     'cancel': '取消',
@@ -35,6 +38,7 @@ const translations = {
     'confirm-clean': '确定要清除所有临时文件和上传文件吗？此操作不会影响已完成的转写记录。',
     'cleaning': '清理中...',
     'download-txt': 'TXT',
+    'download-srt': 'SRT',
     'download-audio': 'WAV',
     'delete-task': '删除任务',
     'confirm-delete': '确认删除',
@@ -42,6 +46,7 @@ const translations = {
     'delete': '删除',
     'no-summary': '暂无摘要',
     'no-tasks': '没有任务记录',
+    'load-more': '加载更多',
     'unknown-file': '未知文件',
     'unknown-time': '未知时间',
     'language-selector': '界面语言',
@@ -125,6 +130,9 @@ const translations = {
     'api-region': 'Azure Region',
     'parallel-threads': 'Parallel Processing Threads',
     'segment-length': 'Audio Segment Length (seconds)',
+    'recognition-engine': 'Recognition Engine',
+    'engine-azure': 'Azure Speech (cloud)',
+    'engine-local': 'Local engine (offline, no API key needed)',
     'clean-temp': 'Clean Temporary Files',
     'test-api': 'Test API Connection',
     'cancel': 'Cancel',
@@ -133,6 +141,7 @@ const translations = {
     'confirm-clean': 'Are you sure you want to clear all temporary files and uploads? This will not affect completed transcription records.',
     'cleaning': 'Cleaning...',
     'download-txt': 'TXT',
+    'download-srt': 'SRT',
     'download-audio': 'WAV',
     'delete-task': 'Delete Task',
     'confirm-delete': 'Confirm Deletion',
@@ -140,6 +149,7 @@ const translations = {
     'delete': 'Delete',
     'no-summary': 'No summary',
     'no-tasks': 'No task records',
+    'load-more': 'Load more',
     'unknown-file': 'Unknown file',
     'unknown-time': 'Unknown time',
     'language-selector': 'Interface Language',
@@ -223,6 +233,9 @@ const translations = {
     'api-region': 'Azureリージョン',
     'parallel-threads': '並列処理スレッド数',
     'segment-length': '音声セグメント長（秒）',
+    'recognition-engine': '認識エンジン',
+    'engine-azure': 'Azure Speech（クラウド）',
+    'engine-local': 'ローカルエンジン（オフライン、APIキー不要）',
     'clean-temp': '一時ファイルをクリア',
     'test-api': 'API接続テスト',
     'cancel': 'キャンセル',
@@ -231,6 +244,7 @@ const translations = {
     'confirm-clean': '一時ファイルとアップロードファイルをすべてクリアしてもよろしいですか？完了した変換記録には影響しません。',
     'cleaning': 'クリア中...',
     'download-txt': 'TXT',
+    'download-srt': 'SRT',
     'download-audio': 'WAV',
     'delete-task': 'タスクを削除',
     'confirm-delete': '削除の確認',
@@ -238,6 +252,7 @@ const translations = {
     'delete': '削除',
     'no-summary': '要約なし',
     'no-tasks': 'タスク記録がありません',
+    'load-more': 'さらに読み込む',
     'unknown-file': '不明なファイル',
     'unknown-time': '不明な時間',
     'language-selector': 'インターフェース言語',
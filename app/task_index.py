@@ -0,0 +1,172 @@
+"""
+任务的二级索引与分页读取
+
+    task_index:created              ZSET  任务ID -> created_at，所有任务
+    task_index:status:<状态>        ZSET  任务ID -> created_at，处于该状态（processing/completed/failed）的任务
+
+任务创建时登记到按创建时间的索引（register_task）；状态变化时由更新进度的Lua脚本把任务移到对应的状态索引
+（见 tasks._PROGRESS_SCRIPT）；删除任务时从所有索引中移除（unregister_task）。状态索引同样以创建时间为分数，
+按状态筛选时也能直接分页。
+
+列表按创建时间倒序、以游标分页，每页的任务字段用一个管道批量 HMGET，不再使用会阻塞Redis的 KEYS task:*。
+任务哈希已过期的索引项在读取时顺带移除。升级前没有索引的数据在第一次读取时用 SCAN 补建一次。
+"""
+import json
+
+TASK_INDEX_KEY = 'task_index:created'
+TASK_STATUS_INDEX_PREFIX = 'task_index:status:'
+TASK_STATUSES = ('processing', 'completed', 'failed')
+
+# 索引已补建的标记（没有任何任务时索引键不存在，不能用索引键本身判断）
+TASK_INDEX_BUILT_KEY = 'task_index:built'
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# 补建索引时每批SCAN/HMGET的任务数
+_REBUILD_BATCH = 500
+
+def task_status_index_key(status):
+    """某个状态的任务索引键名"""
+    return f'{TASK_STATUS_INDEX_PREFIX}{status}'
+
+def register_task(redis_client, task_id, created_at, status=None, pipe=None):
+    """
+    登记新任务
+
+    Args:
+        created_at: 任务创建时间（时间戳），作为索引分数
+        status: 已知的初始状态（如直接复用缓存结果的已完成任务）；处理中的任务由进度脚本登记状态
+        pipe: 传入时只把命令加入该管道，由调用方执行
+    """
+    target = pipe if pipe is not None else redis_client.pipeline(transaction=False)
+    target.zadd(TASK_INDEX_KEY, {task_id: created_at})
+    if status:
+        target.zadd(task_status_index_key(status), {task_id: created_at})
+    if pipe is None:
+        target.execute()
+
+def unregister_task(redis_client, task_id, pipe=None):
+    """从所有索引中移除任务（应在删除任务哈希之后调用，避免并发的进度更新重新登记状态）"""
+    target = pipe if pipe is not None else redis_client.pipeline(transaction=False)
+    target.zrem(TASK_INDEX_KEY, task_id)
+    for status in TASK_STATUSES:
+        target.zrem(task_status_index_key(status), task_id)
+    if pipe is None:
+        target.execute()
+
+def ensure_task_index(redis_client):
+    """升级前的任务没有索引时补建一次"""
+    if not redis_client.exists(TASK_INDEX_BUILT_KEY):
+        rebuild_task_index(redis_client)
+
+def rebuild_task_index(redis_client):
+    """
+    用 SCAN 遍历所有任务哈希重建索引（分批进行，不阻塞Redis）
+
+    Returns:
+        int: 登记的任务数
+    """
+    indexed = 0
+    batch = []
+    for key in redis_client.scan_iter(match='task:*', count=_REBUILD_BATCH):
+        batch.append(key.decode('utf-8') if isinstance(key, bytes) else key)
+        if len(batch) >= _REBUILD_BATCH:
+            indexed += _index_batch(redis_client, batch)
+            batch = []
+    if batch:
+        indexed += _index_batch(redis_client, batch)
+    redis_client.set(TASK_INDEX_BUILT_KEY, 1)
+    return indexed
+
+def _index_batch(redis_client, keys):
+    pipe = redis_client.pipeline(transaction=False)
+    for key in keys:
+        pipe.hmget(key, 'info', 'progress_data')
+    rows = pipe.execute()
+
+    pipe = redis_client.pipeline(transaction=False)
+    indexed = 0
+    for key, (info_json, progress_json) in zip(keys, rows):
+        if not info_json:
+            continue
+        try:
+            created_at = float(json.loads(info_json).get('created_at') or 0)
+            status = json.loads(progress_json).get('status') if progress_json else None
+        except (TypeError, ValueError):
+            continue
+        register_task(redis_client, key.split(':', 1)[1], created_at,
+                      status if status in TASK_STATUSES else None, pipe=pipe)
+        indexed += 1
+    pipe.execute()
+    return indexed
+
+def task_cursor(task_id, created_at):
+    """指向某个任务的分页游标，下一页从比它更早创建的任务开始"""
+    return f'{created_at!r}:{task_id}'
+
+def _decode_cursor(cursor):
+    created_at, _, task_id = cursor.partition(':')
+    try:
+        return task_id, float(created_at)
+    except ValueError:
+        return None, None
+
+def page_task_ids(redis_client, cursor=None, limit=DEFAULT_PAGE_SIZE, status=None):
+    """
+    按创建时间倒序读取一页任务ID
+
+    Args:
+        cursor: 上一页返回的 next_cursor，为None时从最新的任务开始
+        limit: 每页条数
+        status: 只列出该状态的任务
+
+    Returns:
+        tuple: (任务ID列表, 下一页游标；没有更多任务时为None)
+    """
+    key = task_status_index_key(status) if status else TASK_INDEX_KEY
+    if cursor:
+        last_id, last_score = _decode_cursor(cursor)
+        if last_id is None:
+            return [], None
+        rank = redis_client.zrevrank(key, last_id)
+        if rank is not None:
+            entries = redis_client.zrevrange(key, rank + 1, rank + limit, withscores=True)
+        else:
+            # 游标所在的任务已被删除，从比它更早创建的任务继续
+            entries = redis_client.zrevrangebyscore(key, f'({last_score!r}', '-inf', start=0, num=limit, withscores=True)
+    else:
+        entries = redis_client.zrevrange(key, 0, limit - 1, withscores=True)
+
+    task_ids = [member.decode('utf-8') if isinstance(member, bytes) else member for member, _ in entries]
+    next_cursor = task_cursor(task_ids[-1], entries[-1][1]) if len(entries) == limit else None
+    return task_ids, next_cursor
+
+def fetch_tasks(redis_client, task_ids, fields=('info', 'progress_data', 'result')):
+    """
+    一个管道批量读取多个任务的字段
+
+    Returns:
+        list: 与 task_ids 对应的 {字段: 原始值} 字典；任务哈希已不存在（过期）时为None，并从索引中移除
+    """
+    if not task_ids:
+        return []
+    pipe = redis_client.pipeline(transaction=False)
+    for task_id in task_ids:
+        pipe.hmget(f'task:{task_id}', *fields)
+    rows = pipe.execute()
+
+    tasks = []
+    missing = []
+    for task_id, values in zip(task_ids, rows):
+        if all(value is None for value in values):
+            missing.append(task_id)
+            tasks.append(None)
+        else:
+            tasks.append(dict(zip(fields, values)))
+    if missing:
+        pipe = redis_client.pipeline(transaction=False)
+        for task_id in missing:
+            unregister_task(redis_client, task_id, pipe=pipe)
+        pipe.execute()
+    return tasks
@@ -3,14 +3,32 @@ import time
 import subprocess
 import json
 import uuid
-from pathlib import Path
-import azure.cognitiveservices.speech as speechsdk
+import hashlib
 import redis
 import multiprocessing
-from celery import shared_task, chord, group
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import wave
+from celery.signals import worker_process_init
 from celery_config import celery
 import shutil
 from datetime import datetime
+from audio_utils import (
+    read_wav_header, is_speech_compatible_wav, can_resample_in_process, resample_pcm_wav,
+    plan_pcm_segments, plan_vad_segments, apply_segment_overlap, iter_pcm_range, progressive_lengths, segment_cut_points,
+    TARGET_SAMPLE_RATE, TARGET_CHANNELS, TARGET_BITS_PER_SAMPLE, PCM_CHUNK_SIZE, WAVE_FORMAT_PCM
+)
+from timings import TranscriptTimings
+from scheduling import order_longest_first, estimate_makespan
+from logstore import task_log_key, make_log_entry, append_log
+from progress_publisher import ProgressPublisher
+from progress_events import task_event_channel
+from task_index import TASK_INDEX_KEY, TASK_STATUSES, task_status_index_key
+from speech_backends import AzureRecognitionBackend, FakeRecognitionBackend, LocalRecognitionBackend, local_engine_installed
+from concurrency import (
+    get_cluster_limiter, classify_cancellation, RecognitionCanceledError,
+    CANCEL_THROTTLED, CANCEL_TRANSIENT, NON_RETRYABLE_CANCELLATIONS
+)
 
 # 连接Redis
 REDIS_HOST = os.environ.get('REDIS_HOST', 'localhost')
@@ -21,6 +39,118 @@ redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0)
 DEFAULT_PARALLEL_THREADS = 10  # 默认使用10个并行线程
 DEFAULT_SEGMENT_LENGTH = 60  # 默认60秒一段
 
+# 是否启用基于能量的语音活动检测（在停顿处切分并跳过静音段）
+VAD_ENABLED = os.environ.get('VAD_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+# 相邻分段共享的音频时长（秒），0为不重叠。启用后分段边界处的词不会被切坏，
+# 合并时按词级时间戳去掉重叠部分的重复词，因此可以使用15~20秒的短分段提高并行度
+SEGMENT_OVERLAP = float(os.environ.get('SEGMENT_OVERLAP', 0))
+
+# 渐进分段：开头几个片段的长度（秒，逗号分隔），之后恢复为设置的分段长度，
+# 第一段文本几秒内即可显示而总吞吐不变；留空则所有片段等长
+PROGRESSIVE_SEGMENT_LENGTHS = [float(length) for length in os.environ.get('PROGRESSIVE_SEGMENT_LENGTHS', '5,10,20').split(',') if length.strip()]
+
+# 是否启用流式处理：ffmpeg边转码边把PCM推送给Azure，不等待完整转码、不生成中间WAV
+STREAMING_ENABLED = os.environ.get('STREAMING_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+
+# transcribe_audio 的任务超时（秒），流式模式下整个识别过程都在该任务内完成
+TRANSCRIBE_TIME_LIMIT = int(os.environ.get('TRANSCRIBE_TIME_LIMIT', 4 * 60 * 60))
+
+# 媒体信息探测缓存：过期时间（秒）与最大条目数（超出后按最近最少使用淘汰）
+PROBE_CACHE_TTL = int(os.environ.get('PROBE_CACHE_TTL', 7 * 24 * 60 * 60))
+PROBE_CACHE_MAX_ENTRIES = int(os.environ.get('PROBE_CACHE_MAX_ENTRIES', 10000))
+
+# 转写结果缓存（按内容哈希+语言+识别选项）：过期时间（秒）与最大条目数
+TRANSCRIPT_CACHE_TTL = int(os.environ.get('TRANSCRIPT_CACHE_TTL', 30 * 24 * 60 * 60))
+TRANSCRIPT_CACHE_MAX_ENTRIES = int(os.environ.get('TRANSCRIPT_CACHE_MAX_ENTRIES', 5000))
+
+# 分段识别结果缓存（按分段PCM内容指纹+语言+识别选项）：过期时间（秒）与最大条目数
+SEGMENT_CACHE_TTL = int(os.environ.get('SEGMENT_CACHE_TTL', 30 * 24 * 60 * 60))
+SEGMENT_CACHE_MAX_ENTRIES = int(os.environ.get('SEGMENT_CACHE_MAX_ENTRIES', 100000))
+
+# 任务级统计指标（如分段缓存命中数）的保留时间（秒）
+TASK_METRICS_TTL = 7 * 24 * 60 * 60
+
+# 任务记录（task:{task_id}）的过期时间（秒）
+TASK_TTL = 7 * 24 * 60 * 60
+
+# 默认识别后端：azure 使用Azure Speech；local 使用本地离线模型（Vosk）；
+# fake 使用本地确定性假引擎（不访问网络，用于压测处理流水线）。任务可单独指定 engine 覆盖
+RECOGNITION_BACKEND = os.environ.get('RECOGNITION_BACKEND', 'azure').lower()
+RECOGNITION_ENGINES = ('azure', 'local', 'fake')
+
+# 假引擎参数：实时率（处理1秒音频的耗时秒数）、每句错误注入概率与错误码、每句对应的音频秒数、随机种子、脚本文本文件
+FAKE_ASR_RTF = float(os.environ.get('FAKE_ASR_RTF', 0.05))
+FAKE_ASR_ERROR_RATE = float(os.environ.get('FAKE_ASR_ERROR_RATE', 0))
+FAKE_ASR_ERROR_CODE = os.environ.get('FAKE_ASR_ERROR_CODE', 'TooManyRequests')
+FAKE_ASR_PHRASE_SECONDS = float(os.environ.get('FAKE_ASR_PHRASE_SECONDS', 5))
+FAKE_ASR_SEED = int(os.environ.get('FAKE_ASR_SEED', 0))
+FAKE_ASR_SCRIPT = os.environ.get('FAKE_ASR_SCRIPT', '')
+
+# 本地识别引擎：模型目录（每种语言一个子目录，如 models/ja-JP）、专用Celery队列、
+# 每个进程同时运行的本地识别会话数（CPU密集，默认等于CPU核心数）
+LOCAL_ASR_MODEL_DIR = os.environ.get('LOCAL_ASR_MODEL_DIR', 'models')
+LOCAL_ASR_QUEUE = os.environ.get('LOCAL_ASR_QUEUE', 'local_asr')
+LOCAL_ASR_CONCURRENCY = int(os.environ.get('LOCAL_ASR_CONCURRENCY', multiprocessing.cpu_count()))
+
+# Azure限流或不可用时是否把片段溢出到本地识别引擎
+LOCAL_ASR_OVERFLOW = os.environ.get('LOCAL_ASR_OVERFLOW', 'false').lower() in ('1', 'true', 'yes')
+
+# Worker进程启动时预加载的本地模型语言（逗号分隔），为空则在首次使用时加载
+LOCAL_ASR_WARMUP_LANGUAGES = [lang.strip() for lang in os.environ.get('LOCAL_ASR_WARMUP_LANGUAGES', '').split(',') if lang.strip()]
+
+# 识别选项（会影响识别结果，因此也是结果缓存键的一部分）
+DIARIZATION_ENABLED = "true"
+PROFANITY_FILTER_MODE = "None"
+
+# 标准PCM WAV文件头长度（字节）
+WAV_HEADER_SIZE = 44
+
+# 长音频片段的识别方式：threads 在转写任务内用线程池并发识别（并发数即 parallel_threads），
+# celery 把每个片段作为独立的Celery任务分发（并发数取决于Worker的进程数）
+RECOGNITION_EXECUTOR = os.environ.get('RECOGNITION_EXECUTOR', 'threads').lower()
+
+# 片段识别失败时的重试次数与间隔（秒）
+SEGMENT_MAX_RETRIES = 3
+SEGMENT_RETRY_DELAY = 5
+
+# 每个 API密钥+区域 的自适应并发上限（AIMD）：初始值、下限、上限，以及遇到限流后暂停新会话的冷却时间（秒）；
+# 上限保存在Redis中由集群级限流器执行，threads 与 celery 两种识别方式下都对所有Worker生效
+RECOGNITION_INITIAL_CONCURRENCY = int(os.environ.get('RECOGNITION_INITIAL_CONCURRENCY', 10))
+RECOGNITION_MIN_CONCURRENCY = int(os.environ.get('RECOGNITION_MIN_CONCURRENCY', 1))
+RECOGNITION_MAX_CONCURRENCY = int(os.environ.get('RECOGNITION_MAX_CONCURRENCY', 50))
+THROTTLE_COOLDOWN = float(os.environ.get('THROTTLE_COOLDOWN', 5))
+
+# 集群级（所有Worker共享）每个 API密钥+区域 的最大并发会话数，以及每分钟可提交的音频秒数（0为不限）
+AZURE_MAX_SESSIONS = int(os.environ.get('AZURE_MAX_SESSIONS', 100))
+AZURE_AUDIO_SECONDS_PER_MINUTE = int(os.environ.get('AZURE_AUDIO_SECONDS_PER_MINUTE', 0))
+
+# 分段汇合计数（segments:{task_id}）的过期时间（秒）
+SEGMENT_JOIN_TTL = 24 * 60 * 60
+
+# 落后片段的对冲识别：所有片段都已开始后，耗时超过已完成片段耗时的 SEGMENT_HEDGE_PERCENTILE 分位数
+# 乘以 SEGMENT_HEDGE_MULTIPLIER（且不少于 SEGMENT_HEDGE_MIN_SECONDS 秒）的片段再识别一次，先完成的结果生效；
+# 至少有 SEGMENT_HEDGE_MIN_SAMPLES 个已完成片段才估计阈值，每 SEGMENT_HEDGE_CHECK_INTERVAL 秒检查一次
+SEGMENT_HEDGE_ENABLED = os.environ.get('SEGMENT_HEDGE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+SEGMENT_HEDGE_PERCENTILE = float(os.environ.get('SEGMENT_HEDGE_PERCENTILE', 90))
+SEGMENT_HEDGE_MULTIPLIER = float(os.environ.get('SEGMENT_HEDGE_MULTIPLIER', 1.5))
+SEGMENT_HEDGE_MIN_SECONDS = float(os.environ.get('SEGMENT_HEDGE_MIN_SECONDS', 30))
+SEGMENT_HEDGE_MIN_SAMPLES = int(os.environ.get('SEGMENT_HEDGE_MIN_SAMPLES', 3))
+SEGMENT_HEDGE_CHECK_INTERVAL = float(os.environ.get('SEGMENT_HEDGE_CHECK_INTERVAL', 5))
+
+# 片段按时长从长到短提交（最后一段和VAD切出的短片段排在后面），缩短整个任务的完成时间
+SEGMENT_LONGEST_FIRST = os.environ.get('SEGMENT_LONGEST_FIRST', 'true').lower() in ('1', 'true', 'yes')
+
+# 估计任务完成时间所用的识别耗时/音频时长之比：尚无实测值时的初始估计，以及实测值滑动平均的权重
+RECOGNITION_RTF_ESTIMATE = float(os.environ.get('RECOGNITION_RTF_ESTIMATE', 0.5))
+RECOGNITION_RTF_SMOOTHING = 0.2
+
+# 识别回调产生的进度、部分文本等事件在本进程内合并，每隔 PROGRESS_FLUSH_INTERVAL 秒一次性写入Redis
+PROGRESS_FLUSH_INTERVAL = float(os.environ.get('PROGRESS_FLUSH_INTERVAL', 1.0))
+
+# 本进程内同时运行的本地识别会话数
+_local_asr_slots = threading.BoundedSemaphore(max(1, LOCAL_ASR_CONCURRENCY))
+
 def extract_audio_from_video(video_path, output_audio_path):
     """
     使用ffmpeg从视频文件中提取音频并转换为WAV格式
@@ -99,521 +229,1706 @@ def convert_audio_to_wav(audio_path, output_path):
         print(f"音频转换时发生错误: {str(e)}")
         return False
 
-def get_audio_duration(audio_path):
+def _cache_get(namespace, key):
     """
-    获取音频或视频文件的时长（秒）
+    从Redis缓存读取JSON值，命中时刷新LRU时间并累计命中/未命中次数
     
     Args:
-        audio_path: 音频或视频文件路径
+        namespace: 缓存命名空间（如 probe）
+        key: 缓存键
         
     Returns:
-        float: 时长（秒），如果失败则返回 0.0
+        缓存的值，未命中或出错时返回None
     """
     try:
-        cmd = [
-            'ffprobe', 
-            '-v', 'error', 
-            '-show_entries', 'format=duration', 
-            '-of', 'default=noprint_wrappers=1:nokey=1', 
-            audio_path
-        ]
+        value = redis_client.get(f'cache:{namespace}:{key}')
+        pipe = redis_client.pipeline(transaction=False)
+        if value is None:
+            pipe.hincrby('cache_stats', f'{namespace}:misses', 1)
+            pipe.execute()
+            return None
+        pipe.zadd(f'cache_lru:{namespace}', {key: time.time()})
+        pipe.hincrby('cache_stats', f'{namespace}:hits', 1)
+        pipe.execute()
+        return json.loads(value)
+    except Exception as e:
+        print(f"读取缓存失败 ({namespace}:{key}): {str(e)}")
+        return None
+
+def _cache_set(namespace, key, value, ttl, max_entries):
+    """
+    写入Redis缓存，并按最近最少使用（LRU）淘汰超过 max_entries 的旧条目
+    
+    Args:
+        namespace: 缓存命名空间
+        key: 缓存键
+        value: 可JSON序列化的值
+        ttl: 过期时间（秒）
+        max_entries: 该命名空间最多保留的条目数
+    """
+    try:
+        lru_key = f'cache_lru:{namespace}'
+        now = time.time()
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.set(f'cache:{namespace}:{key}', json.dumps(value), ex=ttl)
+        pipe.zadd(lru_key, {key: now})
+        # 已过期的条目无需再参与LRU
+        pipe.zremrangebyscore(lru_key, '-inf', now - ttl)
+        pipe.zcard(lru_key)
+        entry_count = pipe.execute()[-1]
+        
+        if entry_count > max_entries:
+            evicted = redis_client.zrange(lru_key, 0, entry_count - max_entries - 1)
+            if evicted:
+                pipe = redis_client.pipeline(transaction=False)
+                pipe.delete(*[f'cache:{namespace}:{k.decode("utf-8")}' for k in evicted])
+                pipe.zrem(lru_key, *evicted)
+                pipe.hincrby('cache_stats', f'{namespace}:evictions', len(evicted))
+                pipe.execute()
+    except Exception as e:
+        print(f"写入缓存失败 ({namespace}:{key}): {str(e)}")
+
+def _file_fingerprint(file_path):
+    """没有内容哈希时的探测缓存键：文件路径、大小和修改时间，不读取文件内容"""
+    stat = os.stat(file_path)
+    return hashlib.sha1(f"{os.path.abspath(file_path)}:{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()
+
+def get_recognition_options(engine=None):
+    """返回会影响识别结果的选项，用于构造结果缓存键"""
+    options = {
+        'backend': engine or RECOGNITION_BACKEND,
+        'diarization': DIARIZATION_ENABLED,
+        'profanity_filter': PROFANITY_FILTER_MODE,
+        'vad': VAD_ENABLED
+    }
+    # 只在启用时加入，不重叠时已有的缓存键保持不变
+    if SEGMENT_OVERLAP > 0:
+        options['overlap'] = SEGMENT_OVERLAP
+    return options
+
+def _recognition_options_digest(engine=None):
+    """识别选项的短摘要，选项变化后旧的缓存条目自然失效"""
+    return hashlib.sha1(json.dumps(get_recognition_options(engine), sort_keys=True).encode()).hexdigest()[:12]
+
+def _transcript_cache_key(content_hash, language, engine=None):
+    """转写结果缓存键：内容哈希 + 语言 + 识别选项摘要"""
+    return f"{content_hash}:{language}:{_recognition_options_digest(engine)}"
+
+def _segment_fingerprint(segment_path, pcm_range=None):
+    """
+    计算分段PCM数据的内容指纹（不含WAV文件头）
+    
+    分段边界由停顿位置决定，同一段录音重复上传或与其他录音共享片头片尾时，
+    切出的分段字节完全相同，可以直接复用之前的识别结果。
+    
+    Returns:
+        str: sha1十六进制摘要，无法读取时返回None
+    """
+    try:
+        if pcm_range:
+            source, offset, length = pcm_range['source'], pcm_range['offset'], pcm_range['length']
+        else:
+            header = read_wav_header(segment_path)
+            if not header:
+                return None
+            source, offset, length = segment_path, header['data_offset'], header['data_size']
+        digest = hashlib.sha1()
+        for chunk in iter_pcm_range(source, offset, length):
+            digest.update(chunk)
+        return digest.hexdigest()
+    except Exception as e:
+        print(f"计算分段指纹失败: {str(e)}")
+        return None
+
+def _incr_task_metric(task_id, name, amount=1):
+    """累加任务级统计指标，保存在 metrics:{task_id} 哈希中"""
+    try:
+        metrics_key = f'metrics:{task_id}'
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.hincrby(metrics_key, name, amount)
+        pipe.expire(metrics_key, TASK_METRICS_TTL)
+        pipe.execute()
+    except Exception as e:
+        print(f"更新任务指标失败 ({name}): {str(e)}")
+
+def _set_task_metric(task_id, name, value):
+    """设置任务级统计指标的当前值（如当前并发上限）"""
+    try:
+        metrics_key = f'metrics:{task_id}'
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.hset(metrics_key, name, int(value))
+        pipe.expire(metrics_key, TASK_METRICS_TTL)
+        pipe.execute()
+    except Exception as e:
+        print(f"更新任务指标失败 ({name}): {str(e)}")
+
+def get_task_metrics(task_id):
+    """读取任务级统计指标，返回 {指标名: 整数值}"""
+    try:
+        metrics = redis_client.hgetall(f'metrics:{task_id}')
+        return {k.decode('utf-8'): int(v) for k, v in metrics.items()}
+    except Exception as e:
+        print(f"读取任务指标失败: {str(e)}")
+        return {}
+
+def _record_first_text(task_id):
+    """记录任务从提交到识别出第一句文本的时间（毫秒），只记录第一次；由进度发布器合并写入"""
+    _progress_publisher.first_text(task_id)
+
+def _publish_partial_text(task_id, segment_index, text, done=False):
+    """
+    发布从开头起已识别的文本，供页面在任务完成前显示
+    
+    各片段的当前文本记录在 partial_segments:{task_id} 中；从第一个片段起依次拼接，
+    拼到第一个尚未完成的片段（含其已识别部分）为止，写入任务哈希的 partial_text 字段（见 _PARTIAL_TEXT_SCRIPT）。
+    重叠分段边界处的重复词在预览中保留，合并时才去重。事件由进度发布器合并写入。
+    """
+    _progress_publisher.partial_text(task_id, segment_index, text, done)
+
+def _recognition_rtf(engine):
+    """某个识别后端实测的 识别耗时/音频时长 滑动平均，尚无实测值时返回 RECOGNITION_RTF_ESTIMATE"""
+    try:
+        value = redis_client.hget('recognition_rtf', engine)
+        return float(value) if value is not None else RECOGNITION_RTF_ESTIMATE
+    except Exception as e:
+        print(f"读取识别速度统计失败: {str(e)}")
+        return RECOGNITION_RTF_ESTIMATE
+
+# 识别速度滑动平均：读取与写回在同一脚本内完成，并发结束的片段不会互相覆盖更新
+# KEYS: 识别速度哈希   ARGV: 后端名称, 本次 识别耗时/音频时长, 平滑系数
+_RTF_SCRIPT = """
+local previous = tonumber(redis.call('HGET', KEYS[1], ARGV[1]))
+local rtf = tonumber(ARGV[2])
+if previous then
+    rtf = previous + tonumber(ARGV[3]) * (rtf - previous)
+end
+redis.call('HSET', KEYS[1], ARGV[1], tostring(rtf))
+return tostring(rtf)
+"""
+_rtf_update = redis_client.register_script(_RTF_SCRIPT)
+
+def _record_recognition_rtf(engine, elapsed, audio_seconds):
+    """用一次正常结束的片段识别更新该后端的 识别耗时/音频时长 滑动平均"""
+    if audio_seconds <= 0:
+        return
+    try:
+        _rtf_update(keys=['recognition_rtf'], args=[engine, elapsed / audio_seconds, RECOGNITION_RTF_SMOOTHING])
+    except Exception as e:
+        print(f"更新识别速度统计失败: {str(e)}")
+
+def get_cache_stats():
+    """
+    汇总各缓存命名空间的命中、未命中、淘汰次数及当前条目数
+    
+    Returns:
+        dict: {命名空间: {'hits', 'misses', 'evictions', 'entries', 'hit_rate'}}
+    """
+    stats = {}
+    for field, value in redis_client.hgetall('cache_stats').items():
+        namespace, counter = field.decode('utf-8').rsplit(':', 1)
+        stats.setdefault(namespace, {'hits': 0, 'misses': 0, 'evictions': 0})[counter] = int(value)
+    for namespace, entry in stats.items():
+        entry['entries'] = redis_client.zcard(f'cache_lru:{namespace}')
+        lookups = entry['hits'] + entry['misses']
+        entry['hit_rate'] = round(entry['hits'] / lookups, 4) if lookups else 0.0
+    return stats
+
+def add_file_refs(task_id, relative_paths):
+    """记录任务对 downloads 下文件的引用，多个任务共享同一结果文件时删除任务不会误删文件"""
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for relative_path in relative_paths:
+            if relative_path:
+                pipe.sadd(f'file_refs:{relative_path}', task_id)
+        pipe.execute()
+    except Exception as e:
+        print(f"记录文件引用失败: {str(e)}")
+
+def release_file_ref(task_id, relative_path):
+    """
+    释放任务对文件的引用
+    
+    Returns:
+        bool: 没有其他任务引用该文件、可以删除时返回True
+    """
+    try:
+        refs_key = f'file_refs:{relative_path}'
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.srem(refs_key, task_id)
+        pipe.scard(refs_key)
+        remaining = pipe.execute()[1]
+        return remaining == 0
+    except Exception as e:
+        print(f"释放文件引用失败: {str(e)}")
+        return True
+
+def lookup_transcript_cache(content_hash, language, engine=None):
+    """
+    按内容哈希、语言和识别选项查找已完成的转写结果
+    
+    Returns:
+        dict: 缓存条目（task_id, text, txt_file, processed_audio_file），未命中或结果文件已被删除时返回None
+    """
+    if not content_hash:
+        return None
+    cache_key = _transcript_cache_key(content_hash, language, engine)
+    entry = _cache_get('transcript', cache_key)
+    if not entry:
+        return None
+    
+    # 源任务的结果文件已被删除时缓存失效
+    txt_file = entry.get('txt_file')
+    if not txt_file or not os.path.exists(os.path.join('downloads', txt_file)):
+        redis_client.delete(f'cache:transcript:{cache_key}')
+        return None
+    return entry
+
+def _store_transcript_cache(task_id, text_content):
+    """任务成功完成后，按任务的内容哈希把结果写入转写结果缓存"""
+    try:
+        task_info_json = redis_client.hget(f'task:{task_id}', 'info')
+        if not task_info_json:
+            return
+        task_info = json.loads(task_info_json)
+        content_hash = task_info.get('content_hash')
+        if not content_hash or not task_info.get('txt_file'):
+            return
         
-        process = subprocess.Popen(
-            cmd, 
-            stdout=subprocess.PIPE, 
-            stderr=subprocess.PIPE
-        )
-        stdout, stderr = process.communicate()
+        entry = {
+            'task_id': task_id,
+            'text': text_content,
+            'txt_file': task_info.get('txt_file'),
+            'processed_audio_file': task_info.get('processed_audio_file'),
+            'timings_file': task_info.get('timings_file'),
+            'original_duration': task_info.get('original_duration', 0)
+        }
+        add_file_refs(task_id, [entry['txt_file'], entry['processed_audio_file'], entry['timings_file']])
+        _cache_set('transcript', _transcript_cache_key(content_hash, task_info.get('language'), task_info.get('engine')), entry,
+                   TRANSCRIPT_CACHE_TTL, TRANSCRIPT_CACHE_MAX_ENTRIES)
+        print(f"已缓存任务 {task_id} 的转写结果，内容哈希: {content_hash[:12]}")
+    except Exception as e:
+        print(f"写入转写结果缓存失败: {str(e)}")
+
+def _run_ffprobe(media_path):
+    """调用一次ffprobe，以JSON格式获取时长、封装格式及各流的编码、采样率、声道数"""
+    cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-show_entries', 'format=duration,format_name:stream=codec_type,codec_name,sample_rate,channels',
+        '-of', 'json',
+        media_path
+    ]
+    
+    process = subprocess.Popen(
+        cmd, 
+        stdout=subprocess.PIPE, 
+        stderr=subprocess.PIPE
+    )
+    stdout, stderr = process.communicate()
+    
+    if process.returncode != 0:
+        print(f"探测媒体信息失败 for {media_path}: {stderr.decode()}")
+        return None
+    
+    probe_data = json.loads(stdout.decode() or '{}')
+    format_data = probe_data.get('format', {})
+    duration_str = format_data.get('duration')
+    try:
+        duration = float(duration_str)
+    except (TypeError, ValueError):
+        print(f"获取的时长无效 for {media_path}: {duration_str}")
+        duration = 0.0
+    
+    media_info = {
+        'duration': duration,
+        'format_name': format_data.get('format_name'),
+        'audio_codec': None,
+        'sample_rate': None,
+        'channels': None,
+        'has_video': False
+    }
+    for stream in probe_data.get('streams', []):
+        if stream.get('codec_type') == 'video':
+            media_info['has_video'] = True
+        elif stream.get('codec_type') == 'audio' and media_info['audio_codec'] is None:
+            media_info['audio_codec'] = stream.get('codec_name')
+            media_info['sample_rate'] = int(stream['sample_rate']) if stream.get('sample_rate') else None
+            media_info['channels'] = stream.get('channels')
+    return media_info
+
+def probe_media(media_path, content_hash=None):
+    """
+    获取媒体文件的时长、编码、采样率和声道数
+    
+    PCM WAV直接解析文件头，不启动子进程；其他格式调用一次ffprobe，结果缓存在Redis中。
+    缓存键优先使用上传时计算的SHA-256内容哈希（与转写结果缓存相同），同样内容的文件
+    再次上传时直接命中；没有内容哈希时退回到文件路径、大小和修改时间。
+    
+    Args:
+        media_path: 音频或视频文件路径
+        content_hash: 该文件的SHA-256内容哈希（上传时计算），为None时使用文件指纹
         
-        if process.returncode != 0:
-            print(f"获取时长失败 for {audio_path}: {stderr.decode()}")
-            return 0.0
-            
-        duration_str = stdout.decode().strip()
-        if not duration_str or duration_str == 'N/A':
-            print(f"获取的时长无效 for {audio_path}: {duration_str}")
-            return 0.0
+    Returns:
+        dict: 媒体信息（duration, format_name, audio_codec, sample_rate, channels, has_video），失败时返回None
+    """
+    try:
+        wav_header = read_wav_header(media_path)
+        if wav_header and wav_header['audio_format'] == WAVE_FORMAT_PCM:
+            return {
+                'duration': wav_header['duration'],
+                'format_name': 'wav',
+                'audio_codec': f"pcm_s{wav_header['bits_per_sample']}le",
+                'sample_rate': wav_header['sample_rate'],
+                'channels': wav_header['channels'],
+                'has_video': False
+            }
         
-        return float(duration_str)
+        fingerprint = content_hash or _file_fingerprint(media_path)
+        media_info = _cache_get('probe', fingerprint)
+        if media_info is not None:
+            return media_info
+        
+        media_info = _run_ffprobe(media_path)
+        if media_info is not None:
+            _cache_set('probe', fingerprint, media_info, PROBE_CACHE_TTL, PROBE_CACHE_MAX_ENTRIES)
+        return media_info
     except Exception as e:
-        print(f"获取时长时发生错误 for {audio_path}: {str(e)}")
+        print(f"探测媒体信息时发生错误 for {media_path}: {str(e)}")
+        return None
+
+def get_audio_duration(audio_path, content_hash=None):
+    """
+    获取音频或视频文件的时长（秒）
+    
+    Args:
+        audio_path: 音频或视频文件路径
+        content_hash: 该文件的SHA-256内容哈希，用作探测缓存键（见 probe_media）
+        
+    Returns:
+        float: 时长（秒），如果失败则返回 0.0
+    """
+    media_info = probe_media(audio_path, content_hash)
+    if not media_info:
         return 0.0
+    return float(media_info.get('duration') or 0.0)
+
+def _effective_segment_length(duration, segment_length, max_segments=None):
+    """动态调整分段大小，确保分段数不超过max_segments"""
+    if max_segments and duration > segment_length * max_segments:
+        # 计算需要的段长度，使得分段数量不超过max_segments
+        return int(duration / max_segments) + 1
+    return segment_length
 
-def split_audio_file(audio_path, output_dir, segment_length=DEFAULT_SEGMENT_LENGTH, max_segments=None):
+def iter_audio_segments(audio_path, output_dir, segment_length=DEFAULT_SEGMENT_LENGTH, max_segments=None, duration=None, first_lengths=()):
     """
-    将长音频文件分割成多个较小的片段
+    边分割边产出音频片段：ffmpeg每写完并关闭一个分段文件，就通过 -segment_list pipe:1
+    输出其文件名和起止时间，生成器随即校验并产出该分段，调用方无需等待整个文件分割完成
+    
+    转码、提取或重采样后的文件都是16kHz单声道PCM WAV，分段处理走 plan_pcm_segments /
+    plan_vad_segments 的字节范围（内存映射读取），不经过本函数；流式模式直接按字节数切分
+    ffmpeg的PCM输出，也不经过本函数。只有准备好的音频无法通过RIFF头确认为该格式时
+    （WAV头无法解析，或格式不符）才回退到这里用segment复用器写出分段文件。
     
     Args:
         audio_path: 输入音频文件路径
         output_dir: 输出目录
         segment_length: 每个片段的长度（秒）
         max_segments: 最大分段数量（用于控制并行度）
+        duration: 已知的音频时长（秒），为None时重新探测
+        first_lengths: 渐进分段时开头几个片段的长度（秒），见 progressive_lengths
         
-    Returns:
-        list: 分割后的音频片段路径列表
-    """
-    try:
-        # 检查输入文件是否存在
-        if not os.path.exists(audio_path):
-            print(f"输入音频文件不存在: {audio_path}")
-            return []
-        
-        # 使用绝对路径，避免路径问题
-        audio_path = os.path.abspath(audio_path)
-        output_dir = os.path.abspath(output_dir)
+    Yields:
+        dict: 已写完的音频片段（按时间顺序），结构与 plan_pcm_segments 的字节范围相同
+              （source/offset/length/start/duration），另有 temporary=True 表示分段文件识别后删除
         
-        # 确保输出目录存在
-        os.makedirs(output_dir, exist_ok=True)
-        print(f"音频分段存储目录: {output_dir}")
-        
-        # 获取音频时长
+    Raises:
+        RuntimeError: ffmpeg分割失败
+    """
+    # 检查输入文件是否存在
+    if not os.path.exists(audio_path):
+        print(f"输入音频文件不存在: {audio_path}")
+        return
+    
+    # 使用绝对路径，避免路径问题
+    audio_path = os.path.abspath(audio_path)
+    output_dir = os.path.abspath(output_dir)
+    
+    # 确保输出目录存在
+    os.makedirs(output_dir, exist_ok=True)
+    print(f"音频分段存储目录: {output_dir}")
+    
+    # 获取音频时长（调用方已探测过时直接复用）
+    if duration is None:
         duration = get_audio_duration(audio_path)
-        if duration <= 0:
-            print(f"获取音频时长失败或音频为空: {audio_path}")
-            return []
-        
-        print(f"原始音频时长: {duration}秒，计划分段长度: {segment_length}秒")
-        
-        # 动态调整分段大小，确保分段数不超过max_segments
-        if max_segments and duration > segment_length * max_segments:
-            # 计算需要的段长度，使得分段数量不超过max_segments
-            segment_length = int(duration / max_segments) + 1
-            print(f"调整段长度为 {segment_length} 秒以限制分段数不超过 {max_segments}")
-        
-        # 计算需要分割的片段数
-        num_segments = int(duration / segment_length) + 1
-        print(f"计划分割为 {num_segments} 个片段")
-        
-        # 分割音频
-        segment_files = []
-        for i in range(num_segments):
-            start_time = i * segment_length
-            segment_file = os.path.join(output_dir, f"segment_{i:03d}.wav")
-            
-            # 使用ffmpeg分割
-            cmd = [
-                'ffmpeg',
-                '-i', audio_path,
-                '-ss', str(start_time),
-                '-t', str(segment_length),
-                '-acodec', 'pcm_s16le',
-                '-ar', '16000',
-                '-ac', '1',
-                segment_file,
-                '-y'
-            ]
-            
-            print(f"执行分割命令: {' '.join(cmd)}")
-            
-            process = subprocess.Popen(
-                cmd, 
-                stdout=subprocess.PIPE, 
-                stderr=subprocess.PIPE
-            )
-            stdout, stderr = process.communicate()
-            
-            if process.returncode != 0:
-                print(f"分割音频片段{i}失败: {stderr.decode()}")
+    if duration <= 0:
+        print(f"获取音频时长失败或音频为空: {audio_path}")
+        return
+    
+    print(f"原始音频时长: {duration}秒，计划分段长度: {segment_length}秒")
+    
+    adjusted_length = _effective_segment_length(duration, segment_length, max_segments)
+    if adjusted_length != segment_length:
+        print(f"调整段长度为 {adjusted_length} 秒以限制分段数不超过 {max_segments}")
+        segment_length = adjusted_length
+    
+    # 计算需要分割的片段数（仅用于日志，实际数量以ffmpeg输出为准）；
+    # 渐进分段时开头几段较短，按显式切分点分割
+    cut_points = segment_cut_points(duration, segment_length, first_lengths) if progressive_lengths(segment_length, first_lengths) else None
+    num_segments = len(cut_points) + 1 if cut_points is not None else int(duration / segment_length) + 1
+    print(f"计划分割为 {num_segments} 个片段")
+    if cut_points:
+        split_args = ['-segment_times', ','.join(f'{point:.3f}' for point in cut_points)]
+    else:
+        split_args = ['-segment_time', str(segment_length)]
+    
+    # 使用segment复用器一次解码输出所有分段，避免每段都从头解码输入文件；
+    # 分段列表写到stdout，每完成一个分段输出一行"文件名,起点,终点"
+    segment_pattern = os.path.join(output_dir, "segment_%03d.wav")
+    cmd = [
+        'ffmpeg',
+        '-i', audio_path,
+        '-vn',
+        '-acodec', 'pcm_s16le',
+        '-ar', '16000',
+        '-ac', '1',
+        '-f', 'segment',
+        *split_args,
+        '-segment_list', 'pipe:1',
+        '-segment_list_type', 'csv',
+        '-reset_timestamps', '1',
+        segment_pattern,
+        '-y'
+    ]
+    
+    print(f"执行分割命令: {' '.join(cmd)}")
+    
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    
+    # 持续读取stderr，避免管道写满阻塞ffmpeg
+    stderr_lines = []
+    stderr_thread = threading.Thread(target=lambda: stderr_lines.extend(process.stderr), daemon=True)
+    stderr_thread.start()
+    
+    produced = 0
+    finished = False
+    try:
+        for line in process.stdout:
+            fields = line.decode('utf-8', errors='replace').strip().rsplit(',', 2)
+            if len(fields) != 3:
                 continue
-                
-            # 验证分段文件是否存在
-            if not os.path.exists(segment_file):
-                print(f"分段文件创建失败: {segment_file}")
+            segment_name, segment_start, segment_end = fields
+            segment_file = os.path.join(output_dir, os.path.basename(segment_name))
+            # 只有WAV头的空分段直接丢弃
+            if not os.path.exists(segment_file) or os.path.getsize(segment_file) <= WAV_HEADER_SIZE:
+                print(f"跳过空分段文件: {segment_file}")
+                if os.path.exists(segment_file):
+                    os.remove(segment_file)
                 continue
-                
-            print(f"成功创建分段 {i+1}/{num_segments}: {segment_file}")
-            segment_files.append(segment_file)
+            segment_header = read_wav_header(segment_file)
+            if segment_header:
+                data_offset, data_size = segment_header['data_offset'], segment_header['data_size']
+            else:
+                data_offset, data_size = WAV_HEADER_SIZE, os.path.getsize(segment_file) - WAV_HEADER_SIZE
+            produced += 1
+            yield {
+                'source': segment_file,
+                'offset': data_offset,
+                'length': data_size,
+                'start': float(segment_start),
+                'duration': float(segment_end) - float(segment_start),
+                'temporary': True
+            }
+        finished = True
+    finally:
+        # 调用方提前停止迭代（或分发出错）时结束ffmpeg，避免遗留进程
+        if not finished and process.poll() is None:
+            process.kill()
+        process.stdout.close()
+        returncode = process.wait()
+        stderr_thread.join(timeout=5)
+    
+    if returncode != 0:
+        raise RuntimeError(f"分割音频失败: {b''.join(stderr_lines).decode(errors='replace')[-2000:]}")
+    
+    print(f"成功创建 {produced} 个分段（计划 {num_segments} 个）")
+
+def split_audio_file(audio_path, output_dir, segment_length=DEFAULT_SEGMENT_LENGTH, max_segments=None, duration=None, first_lengths=()):
+    """
+    将长音频文件分割成多个较小的片段
+    
+    Args:
+        audio_path: 输入音频文件路径
+        output_dir: 输出目录
+        segment_length: 每个片段的长度（秒）
+        max_segments: 最大分段数量（用于控制并行度）
+        duration: 已知的音频时长（秒），为None时重新探测
+        first_lengths: 渐进分段时开头几个片段的长度（秒）
         
-        print(f"成功创建 {len(segment_files)}/{num_segments} 个分段")
-        return segment_files
+    Returns:
+        list: 分割后的音频片段（结构见 iter_audio_segments）
+    """
+    try:
+        return list(iter_audio_segments(audio_path, output_dir, segment_length, max_segments, duration, first_lengths))
     except Exception as e:
         print(f"分割音频文件时发生错误: {str(e)}")
         return []
 
+def _cleanup_segment_temp_dir(task_id):
+    """删除任务的临时分段目录（包含字节范围分段共享的源WAV）"""
+    try:
+        task_info_json = redis_client.hget(f'task:{task_id}', 'info')
+        if not task_info_json:
+            return
+        segment_temp_dir_name = json.loads(task_info_json).get('segment_temp_dir')
+        if segment_temp_dir_name:
+            full_segment_dir_path = os.path.join(os.getcwd(), segment_temp_dir_name)
+            if os.path.isdir(full_segment_dir_path):
+                shutil.rmtree(full_segment_dir_path)
+                print(f"已删除临时分段目录: {full_segment_dir_path}")
+    except Exception as e:
+        print(f"删除临时分段目录失败: {str(e)}")
+
+# 任务进度更新脚本：在Redis内原子地修改 progress_data，多个片段并发更新时不会互相覆盖。
+# 处理中的进度只增不减；任务已完成或失败后不再被处理中的更新改回；任务记录已删除时不做任何修改。
+# 更新后的 progress_data 同时发布到任务的进度事件频道（见 progress_events.py）；
+# 状态变化时把已登记的任务移到新状态的索引中（见 task_index.py）。
+# KEYS: 任务HASH, 按创建时间的任务索引, 新状态的索引, 所有状态的索引...
+# ARGV: 状态, 进度(空串表示按片段数计算), 是否更新文本(0/1), 文本, 总片段数(可为空串),
+#       已完成片段数(可为空串，可带小数表示分段内进度), 是否把已完成片段计数加一(0/1), 当前时间, 过期时间, 事件频道
+# 返回: 更新后的进度；未更新时返回 false
+_PROGRESS_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+local raw = redis.call('HGET', KEYS[1], 'progress_data')
+local data = {}
+if raw then
+    data = cjson.decode(raw)
+end
+local status = ARGV[1]
+local previous_status = data['status']
+if status == 'processing' and (data['status'] == 'completed' or data['status'] == 'failed') then
+    return false
+end
+
+local total = tonumber(ARGV[5])
+local completed = tonumber(ARGV[6])
+if ARGV[7] == '1' then
+    completed = redis.call('HINCRBY', KEYS[1], 'segments_completed', 1)
+end
+local progress = tonumber(ARGV[2])
+if progress == nil and total and total > 0 and completed then
+    progress = math.min(95, 20 + math.floor(completed * 80 / total))
+end
+local current = tonumber(data['progress']) or 0
+if progress == nil or (status == 'processing' and progress < current) then
+    progress = current
+end
+
+data['status'] = status
+data['progress'] = progress
+data['updated_at'] = tonumber(ARGV[8])
+if total then
+    data['total_segments'] = total
+end
+if completed and completed > (tonumber(data['completed_segments']) or -1) then
+    data['completed_segments'] = completed
+end
+if ARGV[3] == '1' then
+    data['current_text'] = ARGV[4]
+end
+local encoded = cjson.encode(data)
+redis.call('HSET', KEYS[1], 'progress_data', encoded)
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[9]))
+redis.call('PUBLISH', ARGV[10], encoded)
+
+if previous_status ~= status then
+    local task_id = string.sub(KEYS[1], 6)
+    local created_at = redis.call('ZSCORE', KEYS[2], task_id)
+    if created_at then
+        for i = 4, #KEYS do
+            if KEYS[i] ~= KEYS[3] then
+                redis.call('ZREM', KEYS[i], task_id)
+            end
+        end
+        redis.call('ZADD', KEYS[3], created_at, task_id)
+    end
+end
+return progress
+"""
+_progress_update = redis_client.register_script(_PROGRESS_SCRIPT)
+_STATUS_INDEX_KEYS = [task_status_index_key(status) for status in TASK_STATUSES]
+
+def _apply_progress(pipe, task_id, status='processing', progress=None, text=None, total_segments=None,
+                    completed_segments=None, increment_completed=False):
+    """把一次进度更新加入管道（见 _PROGRESS_SCRIPT）"""
+    _progress_update(
+        keys=[f'task:{task_id}', TASK_INDEX_KEY, task_status_index_key(status)] + _STATUS_INDEX_KEYS,
+        args=[status, '' if progress is None else progress, 0 if text is None else 1, text or '',
+              '' if total_segments is None else total_segments,
+              '' if completed_segments is None else completed_segments,
+              1 if increment_completed else 0, time.time(), TASK_TTL, task_event_channel(task_id)],
+        client=pipe
+    )
+
 def update_task_progress(task_id, progress, text=None, status='processing'):
     """
-    更新任务进度到Redis
+    更新任务进度到Redis，并把此次进度/信息追加到任务日志流（一次往返）
     
     Args:
         task_id: 任务ID
-        progress: 进度百分比 (0-100)
+        progress: 进度百分比 (0-100)，处理中时只增不减
         text: 当前识别的文本
         status: 任务状态
     """
     try:
-        task_data = {
-            'status': status,
-            'progress': progress,
-            'updated_at': time.time()
-        }
+        pipe = redis_client.pipeline(transaction=False)
         
-        if text is not None:
-            task_data['current_text'] = text
-            
-        redis_client.hset(f'task:{task_id}', 'progress_data', json.dumps(task_data))
-        
-        # 如果是最终结果，也保存到结果字段
+        # 如果是最终结果，也保存到结果字段（先于进度写入，收到完成事件的订阅方即可读到结果）
         if status == 'completed' and text is not None:
-            redis_client.hset(f'task:{task_id}', 'result', json.dumps({
+            pipe.hset(f'task:{task_id}', 'result', json.dumps({
                 'status': 'success',
                 'text': text
             }))
-            
-        # 设置过期时间（7天）
-        redis_client.expire(f'task:{task_id}', 60 * 60 * 24 * 7)
+        _apply_progress(pipe, task_id, status, progress, text)
+        
+        # 写入日志流，便于页面刷新后回溯
+        log_type = 'error' if status == 'failed' else ('success' if status == 'completed' else 'info')
+        if text is not None:
+            log_entry = make_log_entry(text, log_type)
+        else:
+            # 若无文本，则记录进度百分比或状态变动
+            log_entry = make_log_entry(f"进度更新: {progress}% (状态: {status})", log_type, kind='progress')
+        append_log(redis_client, task_log_key(task_id), log_entry, pipe=pipe)
+        pipe.execute()
+    except Exception as e:
+        print(f"更新任务进度失败: {str(e)}")
 
-        # --- 新增：将此次进度/信息写入日志列表，便于页面刷新后回溯 ---
-        try:
-            # 生成日志文本
+def update_progress_counter(task_id, total_segments, completed_segments, text=None):
+    """
+    基于完成的片段数量更新进度条
+    
+    前20%用于准备工作，后80%按片段完成比例计算（最多到95%，留5%给最终的合并工作）；
+    新进度不大于当前进度时只更新文本。
+    
+    Args:
+        task_id: 任务ID
+        total_segments: 总片段数
+        completed_segments: 已完成的片段数（可带小数表示分段内进度）
+        text: 当前识别的文本
+    """
+    try:
+        _apply_progress(redis_client, task_id, text=text, total_segments=total_segments,
+                        completed_segments=completed_segments)
+    except Exception as e:
+        print(f"更新任务进度计数器失败: {str(e)}")
+
+# 部分识别文本：写入各片段的当前文本，再从第一个片段起拼接到第一个未完成的片段为止；
+# 任务已不在处理中（完成、失败或已删除）时不写入，避免结束后的旧事件重新写出预览文本；拼出的文本同时发布到进度事件频道
+# KEYS: 任务哈希, 部分文本哈希   ARGV: 过期时间, 事件频道, 之后依次为 片段索引, 片段文本JSON
+_PARTIAL_TEXT_SCRIPT = """
+local raw = redis.call('HGET', KEYS[1], 'progress_data')
+if not raw or cjson.decode(raw)['status'] ~= 'processing' then
+    return false
+end
+for i = 3, #ARGV, 2 do
+    redis.call('HSET', KEYS[2], ARGV[i], ARGV[i + 1])
+end
+redis.call('EXPIRE', KEYS[2], tonumber(ARGV[1]))
+
+local texts = {}
+local index = 0
+while true do
+    local entry = redis.call('HGET', KEYS[2], tostring(index))
+    if not entry then
+        break
+    end
+    entry = cjson.decode(entry)
+    if entry['text'] ~= '' then
+        table.insert(texts, entry['text'])
+    end
+    if not entry['done'] then
+        break
+    end
+    index = index + 1
+end
+if #texts > 0 then
+    local partial_text = table.concat(texts, ' ')
+    redis.call('HSET', KEYS[1], 'partial_text', partial_text)
+    redis.call('PUBLISH', ARGV[2], cjson.encode({partial_text = partial_text}))
+end
+return #texts
+"""
+_partial_text_update = redis_client.register_script(_PARTIAL_TEXT_SCRIPT)
+
+# 首段文本时间：只记录第一次，按任务信息中的 created_at 计算
+# KEYS: 任务指标哈希, 任务哈希   ARGV: 识别出文本的时间, 过期时间
+_FIRST_TEXT_SCRIPT = """
+if redis.call('HEXISTS', KEYS[1], 'time_to_first_text_ms') == 1 then
+    return false
+end
+local raw = redis.call('HGET', KEYS[2], 'info')
+if not raw then
+    return false
+end
+local created_at = tonumber(cjson.decode(raw)['created_at'])
+if not created_at then
+    return false
+end
+redis.call('HSET', KEYS[1], 'time_to_first_text_ms', math.floor((tonumber(ARGV[1]) - created_at) * 1000))
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[2]))
+return true
+"""
+_first_text_update = redis_client.register_script(_FIRST_TEXT_SCRIPT)
+
+def _write_progress_batch(batch):
+    """把进度发布器合并后的各任务事件用一个管道写入Redis"""
+    pipe = redis_client.pipeline(transaction=False)
+    for task_id, state in batch.items():
+        if state['progress'] is not None or state['has_text']:
+            text = state['text'] if state['has_text'] else None
+            _apply_progress(pipe, task_id, progress=state['progress'], text=text)
             if text is not None:
-                log_message = text
+                log_entry = make_log_entry(text)
             else:
-                # 若无文本，则记录进度百分比或状态变动
-                log_message = f"进度更新: {progress}% (状态: {status})"
-
-            log_entry = {
-                'time': datetime.now().strftime('%H:%M:%S'),
-                'timestamp': time.time(),
-                'message': log_message,
-                'type': 'error' if status == 'failed' else ('success' if status == 'completed' else 'info')
-            }
+                log_entry = make_log_entry(f"进度更新: {state['progress']}% (状态: processing)", kind='progress')
+            append_log(redis_client, task_log_key(task_id), log_entry, pipe=pipe)
+        if state['completed_segments'] is not None:
+            _apply_progress(pipe, task_id, total_segments=state['total_segments'],
+                            completed_segments=state['completed_segments'])
+        if state['partial']:
+            args = [SEGMENT_JOIN_TTL, task_event_channel(task_id)]
+            for segment_index, (text, done) in sorted(state['partial'].items()):
+                args += [segment_index, json.dumps({'text': text, 'done': done})]
+            _partial_text_update(keys=[f'task:{task_id}', f'partial_segments:{task_id}'], args=args, client=pipe)
+        if state['first_text_at'] is not None:
+            _first_text_update(keys=[f'metrics:{task_id}', f'task:{task_id}'],
+                               args=[state['first_text_at'], TASK_METRICS_TTL], client=pipe)
+    # 单个任务的脚本出错不影响同批其他任务的写入
+    for result in pipe.execute(raise_on_error=False):
+        if isinstance(result, Exception):
+            print(f"写入进度事件失败: {str(result)}")
+
+# 识别回调（Speech SDK回调线程、进度轮询）只把事件交给发布器，不在回调线程中访问Redis；
+# 片段或任务结束前调用 _progress_publisher.flush(task_id) 写出尚未写入的事件
+_progress_publisher = ProgressPublisher(_write_progress_batch, PROGRESS_FLUSH_INTERVAL)
+
+def _save_transcription_to_txt(task_id, text_content):
+    """
+    辅助函数：将识别文本保存到TXT文件，并更新Redis中的路径。
+    命名逻辑与 app.py 中的 generate_txt 保持一致。
+    """
+    try:
+        task_info_json = redis_client.hget(f'task:{task_id}', 'info')
+        if not task_info_json:
+            print(f"[Save TXT Error {task_id}] 未能从Redis获取任务信息，无法保存TXT文件。")
+            return
+
+        task_info = json.loads(task_info_json)
+        # Log the task_info and specifically the override value when saving TXT
+        print(f"[Celery Task {task_id} - Save TXT] Task info from Redis: {task_info}")
+        original_name = task_info.get('original_name', 'unknown_file')
+        created_at_timestamp = task_info.get('created_at', time.time()) # Fallback to current time if not found
+        filename_ts_override = task_info.get('filename_timestamp_override')
+        print(f"[Celery Task {task_id} - Save TXT] filename_timestamp_override from Redis: {filename_ts_override}")
+        txt_filename_only = ""
 
-            # 读取已有日志
-            logs_raw = redis_client.hget(f'task:{task_id}', 'logs')
-            logs = []
-            if logs_raw:
+        if original_name == "microphone-recording.wav":
+            if filename_ts_override:
+                txt_filename_only = f"{filename_ts_override}-recording.txt"
+            else:
                 try:
-                    logs = json.loads(logs_raw)
-                except Exception:
-                    # 若解析失败则丢弃旧日志，避免阻断
-                    logs = []
+                    dt_object = datetime.fromtimestamp(float(created_at_timestamp))
+                    formatted_timestamp = dt_object.strftime("%Y-%m-%d-%H-%M-%S")
+                    txt_filename_only = f"{formatted_timestamp}-recording.txt"
+                except ValueError: 
+                    formatted_timestamp = datetime.fromtimestamp(time.time()).strftime("%Y-%m-%d-%H-%M-%S")
+                    txt_filename_only = f"{formatted_timestamp}-recording-fallback.txt"
+        else:
+            base_name = os.path.splitext(original_name)[0]
+            txt_filename_only = f"{base_name}.txt"
+        
+        stored_txt_path_in_redis = _task_download_path(task_id, 'text', txt_filename_only)
+        txt_path_on_disk = os.path.join('downloads', stored_txt_path_in_redis)
+        
+        with open(txt_path_on_disk, 'w', encoding='utf-8') as f:
+            f.write(text_content)
+        
+        task_info['txt_file'] = stored_txt_path_in_redis 
+        redis_client.hset(f'task:{task_id}', 'info', json.dumps(task_info))
+        print(f"[Save TXT Success {task_id}] 文本已自动保存到: {txt_path_on_disk}")
+        
+    except Exception as e:
+        print(f"[Save TXT Error {task_id}] 自动保存TXT文件时出错: {str(e)}")
+
+def _save_transcript_timings(task_id, timings):
+    """把句子/词级时间轴保存到 downloads/timings/任务ID（与TXT同名，扩展名 .timings），供字幕导出使用"""
+    if not len(timings):
+        return
+    try:
+        task_info_json = redis_client.hget(f'task:{task_id}', 'info')
+        if not task_info_json:
+            return
+        task_info = json.loads(task_info_json)
+        txt_file = task_info.get('txt_file')
+        base_name = os.path.splitext(os.path.basename(txt_file))[0] if txt_file else task_id
+        
+        timings_file = _task_download_path(task_id, 'timings', f"{base_name}.timings")
+        timings.save(os.path.join('downloads', timings_file))
+        
+        task_info['timings_file'] = timings_file
+        redis_client.hset(f'task:{task_id}', 'info', json.dumps(task_info))
+        print(f"已保存任务 {task_id} 的时间轴: {len(timings)} 句，{len(timings.word_offsets)} 个词")
+    except Exception as e:
+        print(f"保存时间轴失败: {str(e)}")
 
-            logs.append(log_entry)
+def _local_model_path(language):
+    """本地识别模型目录：LOCAL_ASR_MODEL_DIR 下以语言代码命名的子目录"""
+    return os.path.join(LOCAL_ASR_MODEL_DIR, language)
 
-            # 保持日志长度不过长（最近 500 条）
-            if len(logs) > 500:
-                logs = logs[-500:]
+def local_asr_available(language):
+    """本进程能否使用本地识别引擎识别该语言（已安装vosk且模型目录存在）"""
+    return local_engine_installed() and os.path.isdir(_local_model_path(language))
 
-            redis_client.hset(f'task:{task_id}', 'logs', json.dumps(logs))
-        except Exception as log_exc:
-            # 日志写入失败时仅打印，不影响主逻辑
-            print(f"写入任务日志失败: {str(log_exc)}")
+@worker_process_init.connect
+def _warm_up_local_models(**kwargs):
+    """Worker子进程启动时预加载本地识别模型，避免第一个片段承担数秒的加载时间"""
+    for language in LOCAL_ASR_WARMUP_LANGUAGES:
+        try:
+            LocalRecognitionBackend(_local_model_path(language))
+        except Exception as e:
+            print(f"预加载本地识别模型失败（{language}）: {str(e)}")
+
+def _create_recognition_backend(api_key, api_region, language, engine=None):
+    """
+    创建识别后端（短音频、分段与流式识别共用）
+    
+    Args:
+        engine: azure / local / fake，为None时使用 RECOGNITION_BACKEND
+    """
+    engine = engine or RECOGNITION_BACKEND
+    if engine == 'local':
+        return LocalRecognitionBackend(_local_model_path(language))
+    if engine == 'fake':
+        return FakeRecognitionBackend(
+            rtf=FAKE_ASR_RTF,
+            error_rate=FAKE_ASR_ERROR_RATE,
+            error_code=FAKE_ASR_ERROR_CODE,
+            phrase_seconds=FAKE_ASR_PHRASE_SECONDS,
+            seed=FAKE_ASR_SEED,
+            script_path=FAKE_ASR_SCRIPT or None
+        )
+    return AzureRecognitionBackend(
+        api_key, api_region, language,
+        diarization=DIARIZATION_ENABLED,
+        profanity_filter=PROFANITY_FILTER_MODE
+    )
+
+def _task_download_path(task_id, kind, filename):
+    """
+    任务结果文件在 downloads 下的相对路径：kind/任务ID/文件名
+    
+    文件名保持用户可读的命名（下载时使用），按任务分目录存放，文件名相同的不同上传不会覆盖
+    转写结果缓存和其他任务仍在引用的文件。
+    """
+    os.makedirs(os.path.join('downloads', kind, task_id), exist_ok=True)
+    return os.path.join(kind, task_id, filename)
+
+def _build_persistent_audio_filename(task_info, extension):
+    """根据任务信息生成保存到 downloads/audio 的处理后音频文件名（与TXT命名规则一致）"""
+    original_name_for_naming = task_info.get('original_name', 'unknown_file')
+    created_at_timestamp = task_info.get('created_at', time.time())
+    filename_ts_override = task_info.get('filename_timestamp_override')
+    
+    if original_name_for_naming == "microphone-recording.wav":
+        if filename_ts_override:
+            return f"{filename_ts_override}-recording{extension}"
+        # Fallback to created_at
+        dt_object = datetime.fromtimestamp(float(created_at_timestamp))
+        formatted_timestamp = dt_object.strftime("%Y-%m-%d-%H-%M-%S")
+        return f"{formatted_timestamp}-recording{extension}"
+    
+    base_name = os.path.splitext(original_name_for_naming)[0]
+    # For other uploaded files, use base name + extension. Override not typically used here for WAV.
+    return f"{base_name}{extension}"
+
+def _run_continuous_recognition(session, on_recognized, timeout, label, feed_audio=None, on_tick=None, tick_interval=2, should_cancel=None):
+    """
+    运行一次连续识别，会话结束或因错误取消后立即返回
+    
+    Args:
+        session: 识别后端创建的 RecognitionSession
+        on_recognized: 识别到非空文本时的回调 (text, offset, duration, words)，偏移和时长单位为秒，
+            words 为 (词, 偏移, 时长) 列表或None
+        timeout: 最长等待时间（秒）
+        label: 日志中使用的名称（如"片段3"）
+        feed_audio: 启动识别后调用，用于向推送模式的会话写入数据（写完需调用 session.close()）
+        on_tick: 等待期间每 tick_interval 秒调用一次 (已等待秒数)，用于基于时间的进度更新
+        should_cancel: 每 tick_interval 秒调用一次，返回True时提前停止识别（例如重复识别的另一方已完成）
+        
+    Returns:
+        dict: {'timed_out': 是否超时, 'cancelled': 是否被 should_cancel 提前停止,
+               'error': 因错误取消时的错误详情，否则为None, 'error_code': 对应的错误码}
+    """
+    finished = threading.Event()
+    outcome = {'timed_out': False, 'cancelled': False, 'error': None, 'error_code': None}
+    
+    def recognized_cb(text, offset, duration, words=None):
+        if text.strip():
+            on_recognized(text, offset, duration, words)
+    
+    def canceled_cb(error_code, error_details):
+        print(f"{label}识别取消: {error_code} - {error_details}")
+        outcome['error'] = error_details
+        outcome['error_code'] = error_code
+        finished.set()
+    
+    def session_stopped_cb():
+        print(f"{label}会话结束")
+        finished.set()
+    
+    session.connect(recognized_cb, canceled_cb, session_stopped_cb)
+    session.start()
+    try:
+        if feed_audio:
+            feed_audio()
+        
+        start_time = time.time()
+        while True:
+            remaining = timeout - (time.time() - start_time)
+            if remaining <= 0:
+                outcome['timed_out'] = True
+                print(f"{label}处理超时")
+                break
+            if finished.wait(timeout=min(tick_interval, remaining)):
+                break
+            if should_cancel and should_cancel():
+                outcome['cancelled'] = True
+                print(f"{label}已由另一次识别完成，停止本次识别")
+                break
+            if on_tick:
+                on_tick(time.time() - start_time)
+    finally:
+        # 等待停止完成后再返回，而不是固定休眠
+        session.stop()
+    
+    return outcome
+
+def _cluster_limiter(api_key, api_region):
+    """某个 API密钥+区域 的集群级限流器（并发会话数、音频秒数配额与AIMD并发上限）"""
+    return get_cluster_limiter(redis_client, api_key, api_region, AZURE_MAX_SESSIONS, AZURE_AUDIO_SECONDS_PER_MINUTE,
+                               initial_limit=RECOGNITION_INITIAL_CONCURRENCY, min_limit=RECOGNITION_MIN_CONCURRENCY,
+                               max_limit=RECOGNITION_MAX_CONCURRENCY, cooldown=THROTTLE_COOLDOWN)
+
+def _acquire_cluster_session(api_key, api_region, audio_seconds, lease_ttl, task_id=None):
+    """
+    获取集群级会话许可（阻塞排队直到并发会话数、AIMD上限和音频秒数配额允许）
+    
+    Args:
+        task_id: 传入时把当前并发上限记入该任务的统计指标
+    
+    Returns:
+        tuple: (限流器, 租约ID)；Redis不可用时返回 (None, None) 并直接放行，不阻塞识别
+    """
+    try:
+        cluster_limiter = _cluster_limiter(api_key, api_region)
+        lease_id = cluster_limiter.acquire(audio_seconds, lease_ttl)
+        if task_id:
+            _set_task_metric(task_id, 'concurrency_limit', cluster_limiter.limit())
+        return cluster_limiter, lease_id
     except Exception as e:
-        print(f"更新任务进度失败: {str(e)}")
+        print(f"获取集群会话许可失败，跳过集群限流: {str(e)}")
+        return None, None
 
-def update_progress_counter(task_id, total_segments, completed_segments, text=None):
+def _release_cluster_session(cluster_limiter, lease_id, started=False, category=None):
     """
-    基于完成的片段数量更新进度条
+    释放集群级会话许可
     
     Args:
-        task_id: 任务ID
+        started: 会话是否真正开始；为 True 时按 category（None 为成功）调整AIMD上限
+    
+    Returns:
+        bool: 本次是否因限流缩减了上限
+    """
+    if cluster_limiter is None or lease_id is None:
+        return False
+    try:
+        if not started:
+            cluster_limiter.release(lease_id)
+            return False
+        return cluster_limiter.complete(lease_id, category)
+    except Exception as e:
+        print(f"释放集群会话许可失败: {str(e)}")
+        return False
+
+def _mark_segment_completed(task_id, total_segments):
+    """把已完成片段数原子地加一并更新进度计数器"""
+    try:
+        _apply_progress(redis_client, task_id, total_segments=total_segments, increment_completed=True)
+    except Exception as e:
+        print(f"更新片段进度失败: {str(e)}")
+
+def _remove_segment_file(segment_path):
+    """删除已处理完的临时片段文件"""
+    try:
+        if os.path.exists(segment_path):
+            os.remove(segment_path)
+            print(f"已删除临时片段文件: {segment_path}")
+        else:
+            print(f"临时片段文件已不存在: {segment_path}")
+    except Exception as e:
+        print(f"删除临时片段文件失败: {str(e)}")
+
+def _recognize_segment(segment_file, task_id, segment_index, total_segments, language, api_key, api_region, engine=None, should_cancel=None):
+    """
+    识别单个音频片段（Celery片段任务与任务内线程池共用）
+    
+    Args:
+        segment_file: 音频片段文件路径，或源WAV中的字节范围描述（source/offset/length/start）
+        task_id: 主任务ID
+        segment_index: 片段索引
         total_segments: 总片段数
-        completed_segments: 已完成的片段数
-        text: 当前识别的文本
+        language: 语言代码
+        api_key: Azure API密钥
+        api_region: Azure API区域
+        engine: 识别后端，为None时使用 RECOGNITION_BACKEND
+        should_cancel: 对冲识别时传入，返回True表示同一片段的另一次识别已完成，本次提前停止
+        
+    Returns:
+        dict: 识别结果（被另一次识别取代时带 superseded 标记）；识别过程中的异常直接抛出，由调用方决定是否重试
     """
+    # 分段既可以是独立的WAV文件，也可以是WAV中的一段字节范围；
+    # temporary 表示该范围所在的文件是本片段独占的临时分段文件，识别后删除
+    pcm_range = segment_file if isinstance(segment_file, dict) else None
+    owns_segment_file = pcm_range is None or pcm_range.get('temporary', False)
+    segment_start = pcm_range.get('start', 0.0) if pcm_range else 0.0
+    segment_overlap = pcm_range.get('overlap', 0.0) if pcm_range else 0.0
+    if pcm_range:
+        segment_path = os.path.abspath(pcm_range['source'])
+        print(f"开始处理音频片段 {segment_index+1}/{total_segments}: {segment_path} [字节 {pcm_range['offset']} 起，共 {pcm_range['length']} 字节]")
+    else:
+        # 使用绝对路径
+        segment_path = os.path.abspath(segment_file)
+        print(f"开始处理音频片段 {segment_index+1}/{total_segments}: {segment_path}")
+    
+    # 检查文件是否存在
+    if not os.path.exists(segment_path):
+        error_msg = f"音频片段文件不存在: {segment_path}"
+        print(error_msg)
+        
+        # 查看目录内容，帮助调试
+        dir_path = os.path.dirname(segment_path)
+        if os.path.exists(dir_path):
+            print(f"目录 {dir_path} 内容:")
+            for file in os.listdir(dir_path):
+                print(f"  - {file}")
+        else:
+            print(f"目录不存在: {dir_path}")
+            
+        return {'index': segment_index, 'text': '', 'error': '文件不存在'}
+    
+    # 检查文件大小
+    file_size = pcm_range['length'] if pcm_range else os.path.getsize(segment_path)
+    if file_size == 0:
+        print(f"音频片段文件为空: {segment_path}")
+        return {'index': segment_index, 'text': '', 'error': '文件为空'}
+    
+    print(f"音频片段存在，大小: {file_size} 字节")
+    
+    # 计算整体进度基准 - 每个片段占总进度的(80/总片段数)，前20%留给准备阶段
+    base_progress = 20 + (segment_index * 80.0 / total_segments)
+    segment_progress_share = 80.0 / total_segments
+    
+    # 分段结果缓存：相同PCM内容、语言和识别选项的分段直接复用已有识别结果
+    segment_cache_key = None
+    fingerprint = _segment_fingerprint(segment_path, pcm_range)
+    if fingerprint:
+        segment_cache_key = f"{fingerprint}:{language}:{_recognition_options_digest(engine)}"
+        cached = _cache_get('segment', segment_cache_key)
+        if cached is not None:
+            _incr_task_metric(task_id, 'segment_cache_hits')
+            print(f"片段{segment_index}命中分段缓存，跳过识别")
+            update_task_progress(task_id, int(base_progress + segment_progress_share), None)
+            _mark_segment_completed(task_id, total_segments)
+            _publish_partial_text(task_id, segment_index, cached.get('text', ''), done=True)
+            if owns_segment_file:
+                _remove_segment_file(segment_path)
+            return {'index': segment_index, 'text': cached.get('text', ''), 'cached': True,
+                    'start': segment_start, 'overlap': segment_overlap, 'timings': cached.get('timings')}
+        _incr_task_metric(task_id, 'segment_cache_misses')
+    
+    # 更新进度（开始处理片段）
+    _progress_publisher.progress(task_id, int(base_progress), f"正在处理第 {segment_index+1}/{total_segments} 段音频...")
+    
     try:
-        # 前20%用于准备工作，后80%用于实际处理
-        progress_share_per_segment = 80.0 / total_segments if total_segments > 0 else 0
-        progress = 20 + int(completed_segments * progress_share_per_segment)
-        progress = min(95, progress)  # 确保不超过95%，留5%给最终的合并工作
-        
-        # 获取已有的进度数据
-        progress_data_json = redis_client.hget(f'task:{task_id}', 'progress_data')
-        if progress_data_json:
-            progress_data = json.loads(progress_data_json)
-            # 只有新进度更大时才更新进度
-            if progress <= progress_data.get('progress', 0) and progress_data.get('status') != 'failed':
-                # 即使进度相同，也要确保文本能更新
-                if text is not None:
-                    progress_data['current_text'] = text
-                    redis_client.hset(f'task:{task_id}', 'progress_data', json.dumps(progress_data))
-                return
-        
-        # 更新进度
-        task_data = {
-            'status': 'processing',
-            'progress': progress,
-            'updated_at': time.time(),
-            'completed_segments': completed_segments,
-            'total_segments': total_segments
-        }
+        # 创建识别会话；字节范围分段以推送模式直接送入识别后端
+        backend = _create_recognition_backend(api_key, api_region, language, engine)
+        session = backend.create_session(audio_path=None if pcm_range else segment_path)
         
-        if text is not None:
-            task_data['current_text'] = text
+        print(f"已配置语音识别器（{backend.name}），语言: {language}, 区域: {api_region}")
+    except Exception as config_error:
+        error_msg = f"配置语音识别器失败: {str(config_error)}"
+        print(error_msg)
+        return {'index': segment_index, 'text': '', 'error': error_msg}
+    
+    # 处理片段；时间轴相对片段起点，合并时再整体平移
+    all_results = []
+    segment_timings = TranscriptTimings()
+    
+    def on_recognized(text, offset, duration, words=None):
+        all_results.append(text)
+        segment_timings.add_phrase(text, offset, duration, words)
+        if len(all_results) == 1:
+            _record_first_text(task_id)
+        _publish_partial_text(task_id, segment_index, " ".join(all_results))
+        # 实时更新识别进度 - 根据识别结果数量更新进度
+        # 假设每个结果占10%的片段进度，最多更新到70%的片段进度
+        recognition_progress = min(0.7, len(all_results) * 0.1)
+        current_progress = base_progress + (recognition_progress * segment_progress_share)
+        
+        # 两种进度更新方式同时使用（由进度发布器合并写入）
+        _progress_publisher.progress(task_id, int(current_progress))
+        
+        # 同时更新进度计数器（分段内进度，计算部分完成）
+        _progress_publisher.counter(task_id, total_segments, segment_index + recognition_progress)
             
-        redis_client.hset(f'task:{task_id}', 'progress_data', json.dumps(task_data))
-        redis_client.expire(f'task:{task_id}', 60 * 60 * 24 * 7)  # 7天过期
-    except Exception as e:
-        print(f"更新任务进度计数器失败: {str(e)}")
+        print(f"片段{segment_index}识别到: {text}")
+    
+    # 等待识别完成，且定期更新进度
+    timeout = 600  # 10分钟超时
+    progress_value = base_progress
+    
+    def on_tick(elapsed):
+        nonlocal progress_value
+        # 计算经过时间的百分比，最多到70%
+        elapsed_percent = min(0.7, elapsed / timeout)
+        # 计算基于时间的进度值
+        time_based_progress = base_progress + (elapsed_percent * segment_progress_share)
+        
+        # 如果基于时间的进度比当前进度大，则更新
+        if time_based_progress > progress_value:
+            progress_value = time_based_progress
+            # 更新进度
+            _progress_publisher.progress(task_id, int(progress_value), f"正在处理第 {segment_index+1}/{total_segments} 段音频...")
+            # 更新进度计数器
+            _progress_publisher.counter(task_id, total_segments, segment_index + elapsed_percent)
+            
+            print(f"片段{segment_index}处理中: {int(elapsed_percent*100)}% (基于时间)")
+    
+    # 通过内存映射把该分段的PCM数据写入会话，写完后关闭输入以触发会话结束
+    def feed_audio():
+        for chunk in iter_pcm_range(segment_path, pcm_range['offset'], pcm_range['length']):
+            session.write(chunk)
+        session.close()
+    
+    # 本地引擎只受本进程的CPU名额限制；Azure会话受所有Worker共享的会话数、音频秒数配额和
+    # 自适应并发上限约束（限流时自动收缩），饱和时按到达顺序排队
+    use_local = backend.name == 'local'
+    cluster_limiter, lease_id = None, None
+    recognition_started = None
+    cancel_category = None
+    session_category = CANCEL_TRANSIENT  # 识别抛出异常或超时时不计为成功，也不计为限流
+    if use_local:
+        _local_asr_slots.acquire()
+    # 占用名额后的任何异常（读取片段头、获取集群许可等）都必须经过 finally 归还名额
+    try:
+        if pcm_range:
+            audio_seconds = pcm_range['length'] / float(TARGET_SAMPLE_RATE * TARGET_CHANNELS * TARGET_BITS_PER_SAMPLE // 8)
+        else:
+            segment_header = read_wav_header(segment_path)
+            audio_seconds = segment_header['duration'] if segment_header else DEFAULT_SEGMENT_LENGTH
+        # 开始连续识别，会话结束或取消时立即返回
+        if not use_local:
+            cluster_limiter, lease_id = _acquire_cluster_session(api_key, api_region, audio_seconds, timeout + 60, task_id)
+        if should_cancel and should_cancel():
+            # 等待配额期间另一次识别已经完成，不再开始会话
+            outcome = {'timed_out': False, 'cancelled': True, 'error': None, 'error_code': None}
+        else:
+            print(f"开始连续识别片段 {segment_index+1}/{total_segments}")
+            recognition_started = time.time()
+            outcome = _run_continuous_recognition(
+                session, on_recognized, timeout, f"片段{segment_index}",
+                feed_audio=feed_audio if pcm_range else None,
+                on_tick=on_tick, should_cancel=should_cancel
+            )
+        if outcome['error'] is not None:
+            cancel_category = classify_cancellation(outcome['error_code'], outcome['error'])
+        if not outcome['timed_out']:
+            session_category = cancel_category
+    finally:
+        # 会话没有开始（等待配额时被取代）时只释放许可，不能计为成功而增加上限
+        if _release_cluster_session(cluster_limiter, lease_id, recognition_started is not None, session_category):
+            print(f"Azure限流，{api_region} 并发上限降至 {cluster_limiter.limit()}")
+        if use_local:
+            _local_asr_slots.release()
+    timed_out = outcome['timed_out']
+    recognition_error = outcome['error']
+    print(f"已停止识别片段 {segment_index+1}/{total_segments}")
+    
+    # 同一片段的另一次识别已先完成：本次结果作废，进度与临时文件都由完成的一方处理
+    if outcome['cancelled']:
+        return {'index': segment_index, 'text': '', 'superseded': True}
+    
+    if cancel_category is not None:
+        if cancel_category == CANCEL_THROTTLED and cluster_limiter is not None:
+            _incr_task_metric(task_id, 'throttle_events')
+            _set_task_metric(task_id, 'concurrency_limit', cluster_limiter.limit())
+        # 部分结果不可用：可重试的错误交给调用方重试，认证/音频错误直接作为失败片段返回
+        if cancel_category in NON_RETRYABLE_CANCELLATIONS:
+            if owns_segment_file:
+                _remove_segment_file(segment_path)
+            return {'index': segment_index, 'text': '', 'error': recognition_error}
+        raise RecognitionCanceledError(cancel_category, recognition_error)
+    
+    # 合并片段结果
+    result_text = " ".join(all_results)
+    print(f"片段{segment_index}识别完成，文本长度: {len(result_text)}")
+    
+    # 如果结果为空但没有报错，可能是语音太短或没有内容
+    if not result_text.strip():
+        print(f"片段{segment_index}识别结果为空，可能是无声片段")
+    
+    # 更新最终进度 - 片段完成
+    current_progress = base_progress + segment_progress_share
+    _progress_publisher.progress(task_id, int(current_progress))
+    
+    if should_cancel and should_cancel():
+        print(f"片段{segment_index}已由另一次识别完成，丢弃本次结果")
+        return {'index': segment_index, 'text': '', 'superseded': True}
+    
+    # 更新进度 - 该段已完成
+    _mark_segment_completed(task_id, total_segments)
+    _publish_partial_text(task_id, segment_index, result_text, done=True)
+    if use_local:
+        _incr_task_metric(task_id, 'local_segments')
+    if not timed_out and recognition_error is None:
+        _record_recognition_rtf(backend.name, time.time() - recognition_started, audio_seconds)
+    
+    encoded_timings = segment_timings.encode()
+    
+    # 只缓存正常结束的识别结果，超时或出错时的部分结果不能复用
+    if segment_cache_key and not timed_out and recognition_error is None:
+        _cache_set('segment', segment_cache_key, {'text': result_text, 'timings': encoded_timings},
+                   SEGMENT_CACHE_TTL, SEGMENT_CACHE_MAX_ENTRIES)
+    
+    # 删除临时片段文件（共享源WAV的字节范围分段由合并任务统一清理）
+    if owns_segment_file:
+        _remove_segment_file(segment_path)
+    
+    return {'index': segment_index, 'text': result_text, 'start': segment_start, 'overlap': segment_overlap,
+            'timings': encoded_timings}
+    
 
-def _save_transcription_to_txt(task_id, text_content):
-    """
-    辅助函数：将识别文本保存到TXT文件，并更新Redis中的路径。
-    命名逻辑与 app.py 中的 generate_txt 保持一致。
-    """
-    try:
-        task_info_json = redis_client.hget(f'task:{task_id}', 'info')
-        if not task_info_json:
-            print(f"[Save TXT Error {task_id}] 未能从Redis获取任务信息，无法保存TXT文件。")
-            return
+def _describe_segment_error(error):
+    """把片段识别异常转换为展示给用户的错误信息"""
+    error_msg = str(error)
+    # 识别出API相关错误
+    if "SPXERR_INVALID_HEADER" in error_msg:
+        error_msg = '认证错误: API密钥或区域设置不正确'
+    return error_msg
 
-        task_info = json.loads(task_info_json)
-        # Log the task_info and specifically the override value when saving TXT
-        print(f"[Celery Task {task_id} - Save TXT] Task info from Redis: {task_info}")
-        original_name = task_info.get('original_name', 'unknown_file')
-        created_at_timestamp = task_info.get('created_at', time.time()) # Fallback to current time if not found
-        filename_ts_override = task_info.get('filename_timestamp_override')
-        print(f"[Celery Task {task_id} - Save TXT] filename_timestamp_override from Redis: {filename_ts_override}")
-        txt_filename_only = ""
+def _can_overflow_to_local(engine, language):
+    """Azure片段在重试耗尽后能否改用本地引擎识别"""
+    return (LOCAL_ASR_OVERFLOW and (engine or RECOGNITION_BACKEND) != 'local'
+            and local_asr_available(language))
 
-        if original_name == "microphone-recording.wav":
-            if filename_ts_override:
-                txt_filename_only = f"{filename_ts_override}-recording.txt"
-            else:
-                try:
-                    dt_object = datetime.fromtimestamp(float(created_at_timestamp))
-                    formatted_timestamp = dt_object.strftime("%Y-%m-%d-%H-%M-%S")
-                    txt_filename_only = f"{formatted_timestamp}-recording.txt"
-                except ValueError: 
-                    formatted_timestamp = datetime.fromtimestamp(time.time()).strftime("%Y-%m-%d-%H-%M-%S")
-                    txt_filename_only = f"{formatted_timestamp}-recording-fallback.txt"
-        else:
-            base_name = os.path.splitext(original_name)[0]
-            txt_filename_only = f"{base_name}.txt"
-        
-        text_dir = os.path.join('downloads', 'text')
-        os.makedirs(text_dir, exist_ok=True)
-        txt_path_on_disk = os.path.join(text_dir, txt_filename_only)
-        
-        with open(txt_path_on_disk, 'w', encoding='utf-8') as f:
-            f.write(text_content)
-        
-        stored_txt_path_in_redis = os.path.join('text', txt_filename_only)
-        task_info['txt_file'] = stored_txt_path_in_redis 
-        redis_client.hset(f'task:{task_id}', 'info', json.dumps(task_info))
-        print(f"[Save TXT Success {task_id}] 文本已自动保存到: {txt_path_on_disk}")
-        
+def _overflow_to_local(segment_file, task_id, segment_index, total_segments, language, error):
+    """Azure持续限流或不可用时，在本进程内用本地引擎识别该片段"""
+    print(f"片段{segment_index}在Azure上重试耗尽（{str(error)}），改用本地识别引擎")
+    _incr_task_metric(task_id, 'local_overflow_segments')
+    return _recognize_segment(segment_file, task_id, segment_index, total_segments, language, None, None, engine='local')
+
+def _record_segment_start(task_id, segment_index):
+    """记录片段首次开始识别的时间，供落后片段检查使用（重试与对冲识别不覆盖）"""
+    try:
+        redis_client.hsetnx(f'segments:{task_id}', f'started:{segment_index}', time.time())
     except Exception as e:
-        print(f"[Save TXT Error {task_id}] 自动保存TXT文件时出错: {str(e)}")
+        print(f"记录片段开始时间失败: {str(e)}")
+
+def _segment_result_recorded(task_id, segment_index):
+    """片段结果是否已由某一次识别写入汇合哈希"""
+    try:
+        return bool(redis_client.hexists(f'segments:{task_id}', f'result:{segment_index}'))
+    except Exception:
+        return False
 
 @celery.task(name='tasks.process_audio_segment', bind=True, max_retries=3)
-def process_audio_segment(self, segment_file, task_id, segment_index, total_segments, language, api_key, api_region):
+def process_audio_segment(self, segment_file, task_id, segment_index, total_segments, language, api_key, api_region, engine=None, hedge=False):
     """
-    处理单个音频片段并返回识别结果
+    处理单个音频片段并返回识别结果（RECOGNITION_EXECUTOR=celery 时每个片段一个任务）
     
     Args:
-        segment_file: 音频片段文件路径
+        segment_file: 音频片段文件路径，或源WAV中的字节范围描述（source/offset/length/start）
         task_id: 主任务ID
         segment_index: 片段索引
         total_segments: 总片段数
         language: 语言代码
         api_key: Azure API密钥
         api_region: Azure API区域
+        engine: 识别后端，为None时使用 RECOGNITION_BACKEND
+        hedge: 是否为落后片段的对冲识别（结果带 hedge 标记）
         
     Returns:
         dict: 识别结果
     """
+    if not hedge:
+        _record_segment_start(task_id, segment_index)
+    should_cancel = (lambda: _segment_result_recorded(task_id, segment_index)) if SEGMENT_HEDGE_ENABLED else None
     try:
-        print(f"开始处理音频片段 {segment_index+1}/{total_segments}: {segment_file}")
-        
-        # 使用绝对路径
-        segment_file = os.path.abspath(segment_file)
-        
-        # 检查文件是否存在
-        if not os.path.exists(segment_file):
-            error_msg = f"音频片段文件不存在: {segment_file}"
-            print(error_msg)
+        result = _recognize_segment(segment_file, task_id, segment_index, total_segments, language, api_key, api_region, engine, should_cancel)
+        if hedge:
+            result['hedge'] = True
+        return result
+    except Exception as e:
+        print(f"处理音频片段时发生错误: {str(e)}")
+        error_msg = _describe_segment_error(e)
             
-            # 查看目录内容，帮助调试
-            dir_path = os.path.dirname(segment_file)
-            if os.path.exists(dir_path):
-                print(f"目录 {dir_path} 内容:")
-                for file in os.listdir(dir_path):
-                    print(f"  - {file}")
-            else:
-                print(f"目录不存在: {dir_path}")
-                
-            return {'index': segment_index, 'text': '', 'error': '文件不存在'}
-        
-        # 检查文件大小
-        file_size = os.path.getsize(segment_file)
-        if file_size == 0:
-            print(f"音频片段文件为空: {segment_file}")
-            return {'index': segment_index, 'text': '', 'error': '文件为空'}
-        
-        print(f"音频片段文件存在，大小: {file_size} 字节")
-        
-        # 计算整体进度基准 - 每个片段占总进度的(80/总片段数)，前20%留给准备阶段
-        base_progress = 20 + (segment_index * 80.0 / total_segments)
-        segment_progress_share = 80.0 / total_segments
+        # 如果是非致命错误，可以尝试重试；限流时等待冷却期后重试，由并发控制器决定何时真正开始
+        if self.request.retries < self.max_retries:
+            countdown = THROTTLE_COOLDOWN if getattr(e, 'category', None) == CANCEL_THROTTLED else SEGMENT_RETRY_DELAY
+            print(f"将在{countdown}秒后重试任务，当前重试次数: {self.request.retries+1}/{self.max_retries}")
+            self.retry(exc=e, countdown=countdown)
         
-        # 更新进度（开始处理片段）
-        update_task_progress(task_id, int(base_progress), f"正在处理第 {segment_index+1}/{total_segments} 段音频...")
+        if isinstance(e, RecognitionCanceledError) and _can_overflow_to_local(engine, language):
+            try:
+                return _overflow_to_local(segment_file, task_id, segment_index, total_segments, language, e)
+            except Exception as local_error:
+                print(f"本地识别引擎处理片段{segment_index}失败: {str(local_error)}")
         
+        return {'index': segment_index, 'text': '', 'error': error_msg}
+    finally:
+        # 结果交给汇合任务前写出本片段尚未写入的进度事件
+        _progress_publisher.flush(task_id)
+
+def _recognize_segment_with_retries(segment_file, task_id, segment_index, total_segments, language, api_key, api_region, engine=None, should_cancel=None):
+    """线程池中识别单个片段，失败时按与Celery片段任务相同的次数重试"""
+    for attempt in range(SEGMENT_MAX_RETRIES + 1):
         try:
-            # 配置Azure语音识别
-            speech_config = speechsdk.SpeechConfig(subscription=api_key, region=api_region)
-            speech_config.speech_recognition_language = language
-            
-            # 配置识别选项
-            speech_config.set_property_by_name("DiarizationEnabled", "true")
-            speech_config.set_property_by_name("ProfanityFilterMode", "None")
-            speech_config.request_word_level_timestamps()
-            
-            # 创建音频配置和识别器
-            audio_config = speechsdk.audio.AudioConfig(filename=segment_file)
-            speech_recognizer = speechsdk.SpeechRecognizer(speech_config=speech_config, audio_config=audio_config)
-            
-            print(f"已配置语音识别器，语言: {language}, 区域: {api_region}")
-        except Exception as config_error:
-            error_msg = f"配置语音识别器失败: {str(config_error)}"
-            print(error_msg)
-            return {'index': segment_index, 'text': '', 'error': error_msg}
-        
-        # 处理片段
-        all_results = []
-        done = False
-        
-        def recognized_cb(evt):
-            text = evt.result.text
-            if text.strip():
-                all_results.append(text)
-                # 实时更新识别进度 - 根据识别结果数量更新进度
-                # 假设每个结果占10%的片段进度，最多更新到70%的片段进度
-                recognition_progress = min(0.7, len(all_results) * 0.1)
-                current_progress = base_progress + (recognition_progress * segment_progress_share)
-                
-                # 两种进度更新方式同时使用
-                update_task_progress(task_id, int(current_progress), None)
-                
-                # 同时更新进度计数器
+            return _recognize_segment(segment_file, task_id, segment_index, total_segments, language, api_key, api_region, engine, should_cancel)
+        except Exception as e:
+            print(f"处理音频片段时发生错误: {str(e)}")
+            error_msg = _describe_segment_error(e)
+            if should_cancel and should_cancel():
+                return {'index': segment_index, 'text': '', 'superseded': True}
+            if attempt < SEGMENT_MAX_RETRIES:
+                print(f"重试片段{segment_index}，当前重试次数: {attempt+1}/{SEGMENT_MAX_RETRIES}")
+                # 限流时不做固定等待：并发控制器已进入冷却期，重试会在 acquire() 中等到名额为止
+                if getattr(e, 'category', None) != CANCEL_THROTTLED:
+                    time.sleep(SEGMENT_RETRY_DELAY)
+            elif isinstance(e, RecognitionCanceledError) and _can_overflow_to_local(engine, language):
                 try:
-                    progress_data_json = redis_client.hget(f'task:{task_id}', 'progress_data')
-                    completed_segments = 0
-                    if progress_data_json:
-                        progress_data = json.loads(progress_data_json)
-                        completed_segments = progress_data.get('completed_segments', 0)
-                        # 分段内进度，计算部分完成
-                        partial_complete = segment_index + recognition_progress
-                        update_progress_counter(task_id, total_segments, partial_complete)
-                except Exception as e:
-                    print(f"更新部分进度失败: {str(e)}")
-                    
-                print(f"片段{segment_index}识别到: {text}")
-        
-        def canceled_cb(evt):
-            nonlocal done
-            print(f"片段{segment_index}识别取消: {evt.reason}")
-            print(f"取消详情: {evt.cancellation_details.reason} - {evt.cancellation_details.error_details}")
-            done = True
-        
-        def session_stopped_cb(evt):
-            nonlocal done
-            print(f"片段{segment_index}会话结束")
-            done = True
-        
-        # 添加回调
-        speech_recognizer.recognized.connect(recognized_cb)
-        speech_recognizer.canceled.connect(canceled_cb)
-        speech_recognizer.session_stopped.connect(session_stopped_cb)
-        
-        # 开始连续识别
-        print(f"开始连续识别片段 {segment_index+1}/{total_segments}")
-        speech_recognizer.start_continuous_recognition_async()
-        
-        # 等待识别完成，且定期更新进度
-        timeout = 600  # 10分钟超时
-        start_time = time.time()
-        last_update_time = start_time
-        progress_value = base_progress
-        
-        while not done and (time.time() - start_time) < timeout:
-            time.sleep(0.5)  # 减少等待时间，更频繁检查状态
-            
-            # 每2秒更新一次进度，即使没有新的识别结果
-            current_time = time.time()
-            if current_time - last_update_time >= 2:
-                last_update_time = current_time
-                
-                # 计算经过时间的百分比，最多到70%
-                elapsed_percent = min(0.7, (current_time - start_time) / timeout)
-                # 计算基于时间的进度值
-                time_based_progress = base_progress + (elapsed_percent * segment_progress_share)
-                
-                # 如果基于时间的进度比当前进度大，则更新
-                if time_based_progress > progress_value:
-                    progress_value = time_based_progress
-                    # 更新进度
-                    update_task_progress(task_id, int(progress_value), f"正在处理第 {segment_index+1}/{total_segments} 段音频...")
-                    # 更新进度计数器
-                    partial_complete = segment_index + elapsed_percent
-                    update_progress_counter(task_id, total_segments, partial_complete)
-                    
-                    print(f"片段{segment_index}处理中: {int(elapsed_percent*100)}% (基于时间)")
-        
-        # 检查是否超时
-        if (time.time() - start_time) >= timeout:
-            print(f"片段{segment_index}处理超时")
-        
-        # 停止识别
-        print(f"停止识别片段 {segment_index+1}/{total_segments}")
-        speech_recognizer.stop_continuous_recognition_async()
-        time.sleep(2)  # 等待停止完成
-        
-        # 合并片段结果
-        result_text = " ".join(all_results)
-        print(f"片段{segment_index}识别完成，文本长度: {len(result_text)}")
-        
-        # 如果结果为空但没有报错，可能是语音太短或没有内容
-        if not result_text.strip():
-            print(f"片段{segment_index}识别结果为空，可能是无声片段")
+                    return _overflow_to_local(segment_file, task_id, segment_index, total_segments, language, e)
+                except Exception as local_error:
+                    print(f"本地识别引擎处理片段{segment_index}失败: {str(local_error)}")
+    return {'index': segment_index, 'text': '', 'error': error_msg}
+
+def _recognize_segments_in_threads(segment_source, task_id, estimated_total, language, api_key, api_region, parallel_threads, engine=None):
+    """
+    在当前任务内用线程池并发识别各片段，同时运行的识别会话数等于 parallel_threads
+    
+    识别主要在等待网络，线程数可以远大于CPU核心数；片段边产生边提交，
+    分割与识别仍然重叠进行。所有片段都已开始后，耗时远超其余片段的落后片段
+    再提交一次相同的识别，先完成的一次生效，另一次在下个检查周期内停止。
+    
+    Args:
+        segment_source: (片段索引, 片段) 的可迭代对象，按提交顺序排列；片段为文件路径或字节范围描述
         
-        # 更新最终进度 - 片段完成
-        current_progress = base_progress + segment_progress_share
-        update_task_progress(task_id, int(current_progress), None)
+    Returns:
+        list: 按片段索引排列的识别结果（结构与 process_audio_segment 的返回值一致）
         
-        # 更新进度 - 该段已完成
-        # 从Redis获取当前已完成的段数，并递增
-        try:
-            progress_data_json = redis_client.hget(f'task:{task_id}', 'progress_data')
-            completed_segments = 0
-            if progress_data_json:
-                progress_data = json.loads(progress_data_json)
-                completed_segments = progress_data.get('completed_segments', 0)
-            completed_segments += 1
+    Raises:
+        分割片段时的异常原样抛出（已提交的片段会先执行完）
+    """
+    segments = {}  # 片段索引 -> 状态：描述、首次开始时间、取消标记、是否已对冲
+    attempts = {}  # future -> (片段索引, 是否为对冲识别)
+    
+    def run(index):
+        state = segments[index]
+        if state['started'] is None:
+            state['started'] = time.monotonic()
+        return _recognize_segment_with_retries(state['segment'], task_id, index, estimated_total, language,
+                                               api_key, api_region, engine, state['cancel'].is_set)
+    
+    with ThreadPoolExecutor(max_workers=max(1, parallel_threads), thread_name_prefix=f'recognize-{task_id[:8]}') as executor:
+        for index, segment in segment_source:
+            segments[index] = {'segment': segment, 'started': None, 'cancel': threading.Event(), 'hedged': False}
+            attempts[executor.submit(run, index)] = (index, False)
+            if len(segments) == 1:
+                print(f"第一个片段已提交识别线程池（{parallel_threads}个并行线程）")
+        
+        results = {}
+        durations = []  # 已完成片段从首次开始到完成的秒数
+        pending = set(attempts)
+        while pending:
+            done, pending = wait(pending, timeout=SEGMENT_HEDGE_CHECK_INTERVAL, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, hedge = attempts[future]
+                result = future.result()
+                if index in results or result.get('superseded'):
+                    continue
+                # 失败的一次不抢先：同一片段另一次识别仍在进行时等待它的结果
+                if result.get('error') and any(i == index and f in pending for f, (i, _) in attempts.items()):
+                    continue
+                results[index] = result
+                segments[index]['cancel'].set()
+                durations.append(time.monotonic() - segments[index]['started'])
+                if hedge:
+                    _incr_task_metric(task_id, 'hedge_wins')
+                    print(f"片段{index}的对冲识别先完成")
             
-            # 使用新的进度更新函数
-            update_progress_counter(task_id, total_segments, completed_segments)
-        except Exception as e:
-            print(f"更新片段进度失败: {str(e)}")
-        
-        # 删除临时片段文件
-        try:
-            if os.path.exists(segment_file):
-                os.remove(segment_file)
-                print(f"已删除临时片段文件: {segment_file}")
-            else:
-                print(f"临时片段文件已不存在: {segment_file}")
-        except Exception as e:
-            print(f"删除临时片段文件失败: {str(e)}")
-        
-        return {'index': segment_index, 'text': result_text}
-        
+            threshold = _hedge_threshold(durations)
+            if threshold is None or any(state['started'] is None for state in segments.values()):
+                continue
+            now = time.monotonic()
+            for index, state in segments.items():
+                if index in results or state['hedged'] or now - state['started'] <= threshold:
+                    continue
+                state['hedged'] = True
+                future = executor.submit(run, index)
+                attempts[future] = (index, True)
+                pending.add(future)
+                _incr_task_metric(task_id, 'hedged_segments')
+                print(f"片段{index}已识别 {int(now - state['started'])} 秒，超过落后阈值 {int(threshold)} 秒，发起对冲识别")
+    _progress_publisher.flush(task_id)
+    return [results[index] for index in sorted(results)]
+
+def _try_combine_segments(task_id):
+    """所有片段都已完成时触发合并；用 combined 标记保证只触发一次"""
+    join_key = f'segments:{task_id}'
+    if not redis_client.hsetnx(join_key, 'combined', 1):
+        return
+    results = [
+        json.loads(value)
+        for field, value in redis_client.hgetall(join_key).items()
+        if field.startswith(b'result:')
+    ]
+    print(f"任务 {task_id} 的 {len(results)} 个片段已全部完成，开始合并")
+    combine_segment_results.delay(results, task_id)
+
+def _close_segment_join(task_id, total_segments):
+    """分段全部分发后写入实际片段总数；若此时片段已全部完成（分发慢于识别），由这里触发合并"""
+    join_key = f'segments:{task_id}'
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.hset(join_key, 'total', total_segments)
+    pipe.hget(join_key, 'done')
+    pipe.expire(join_key, SEGMENT_JOIN_TTL)
+    done = pipe.execute()[1]
+    if done is not None and int(done) >= total_segments:
+        _try_combine_segments(task_id)
+
+def _abort_segment_join(task_id):
+    """分段过程失败时阻止已分发的片段触发合并，尚未分发的片段不再分发"""
+    try:
+        redis_client.hset(f'segments:{task_id}', 'combined', 1)
+        redis_client.expire(f'segments:{task_id}', SEGMENT_JOIN_TTL)
+        redis_client.delete(f'segment_backlog:{task_id}')
     except Exception as e:
-        error_msg = str(e)
-        print(f"处理音频片段时发生错误: {error_msg}")
-        
-        # 识别出API相关错误
-        if "SPXERR_INVALID_HEADER" in error_msg:
-            error_msg = '认证错误: API密钥或区域设置不正确'
-            
-        # 如果是非致命错误，可以尝试重试
-        if self.request.retries < self.max_retries:
-            print(f"将在5秒后重试任务，当前重试次数: {self.request.retries+1}/{self.max_retries}")
-            time.sleep(5)  # 等待5秒后重试
-            self.retry(exc=e, countdown=5)
+        print(f"标记分段汇合中止失败: {str(e)}")
+
+# 积压片段出队脚本：任务的在途片段数低于窗口时弹出一个片段并计入在途数。
+# 出队与计数在同一脚本内完成，分发方入队和回调方完成同时发生时也不会漏发。
+# KEYS: 分段汇合HASH, 积压LIST   ARGV: 窗口大小
+_BACKLOG_POP_SCRIPT = """
+local inflight = tonumber(redis.call('HGET', KEYS[1], 'inflight') or '0')
+if inflight >= tonumber(ARGV[1]) then
+    return false
+end
+local item = redis.call('LPOP', KEYS[2])
+if item then
+    redis.call('HINCRBY', KEYS[1], 'inflight', 1)
+end
+return item
+"""
+_backlog_pop = redis_client.register_script(_BACKLOG_POP_SCRIPT)
+
+def _pump_segment_backlog(task_id, window):
+    """在途片段数低于窗口时依次分发积压的片段"""
+    while True:
+        item = _backlog_pop(keys=[f'segments:{task_id}', f'segment_backlog:{task_id}'], args=[window])
+        if item is None:
+            return
+        segment, segment_index, estimated_total, language, api_key, api_region, engine = json.loads(item)
+        _dispatch_segment(segment, task_id, segment_index, estimated_total, language, api_key, api_region, engine)
+
+def _queue_segment(segment, task_id, segment_index, estimated_total, language, api_key, api_region, engine, window):
+    """
+    把片段放入任务的积压队列，再按窗口分发
+    
+    每个任务在Celery队列中最多只有 window 个片段，其余片段在某个片段完成后才分发；
+    多个任务的片段因此在Worker之间交替执行，单个超长任务不会占满所有Worker。
+    """
+    backlog_key = f'segment_backlog:{task_id}'
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.rpush(backlog_key, json.dumps([segment, segment_index, estimated_total, language, api_key, api_region, engine]))
+    pipe.expire(backlog_key, SEGMENT_JOIN_TTL)
+    pipe.hset(f'segments:{task_id}', 'window', window)
+    pipe.expire(f'segments:{task_id}', SEGMENT_JOIN_TTL)
+    pipe.execute()
+    _pump_segment_backlog(task_id, window)
+
+@celery.task(name='tasks.collect_segment_result')
+def collect_segment_result(result, task_id):
+    """
+    片段识别任务的回调：记录结果并递增完成计数，最后一个片段完成时触发合并
+    
+    片段总数在分割结束后才写入，因此先完成的片段只计数；
+    总数已知且计数达到总数时，由最后完成的片段触发合并。
+    每个片段完成后释放一个分发窗口名额，分发下一个积压的片段。
+    对冲识别时同一片段可能有两个结果，只有先写入的一个计数；失败的对冲识别不记录，
+    等原识别的结果。
+    """
+    if result.get('superseded') or (result.get('hedge') and result.get('error')):
+        return
+    join_key = f'segments:{task_id}'
+    segment_index = result['index']
+    if not redis_client.hsetnx(join_key, f"result:{segment_index}", json.dumps(result)):
+        print(f"片段{segment_index}已有结果，忽略重复的识别结果")
+        return
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.hincrby(join_key, 'done', 1)
+    pipe.hincrby(join_key, 'inflight', -1)
+    pipe.hget(join_key, 'total')
+    pipe.hget(join_key, f'started:{segment_index}')
+    pipe.hget(join_key, 'window')
+    pipe.expire(join_key, SEGMENT_JOIN_TTL)
+    done, _, total, started, window, _ = pipe.execute()
+    if started is not None:
+        redis_client.hset(join_key, f'elapsed:{segment_index}', time.time() - float(started))
+    if window is not None:
+        _pump_segment_backlog(task_id, int(window))
+    if result.get('hedge'):
+        _incr_task_metric(task_id, 'hedge_wins')
+    if total is not None and done >= int(total):
+        _try_combine_segments(task_id)
+
+@celery.task(name='tasks.collect_segment_failure')
+def collect_segment_failure(request, exc, traceback, task_id):
+    """片段任务重试耗尽仍抛出异常时的回调，按失败片段计数，保证合并仍会触发"""
+    segment_index = request.args[2]
+    hedge = len(request.args) > 8 and bool(request.args[8])
+    print(f"片段{segment_index}处理失败: {str(exc)}")
+    collect_segment_result({'index': segment_index, 'text': '', 'error': str(exc), 'hedge': hedge}, task_id)
+
+def _cluster_saturated(api_key, api_region):
+    """集群级Azure会话是否已饱和（会话数已满或有请求在排队）；Redis不可用时按未饱和处理"""
+    try:
+        return _cluster_limiter(api_key, api_region).is_saturated()
+    except Exception as e:
+        print(f"检查集群会话占用失败: {str(e)}")
+        return False
+
+def _dispatch_segment(segment, task_id, segment_index, estimated_total, language, api_key, api_region, engine=None, hedge=False):
+    """
+    把单个片段交给 process_audio_segment，完成（或失败）后回调汇合计数
+    
+    本地引擎的片段发送到 LOCAL_ASR_QUEUE；启用溢出时，Azure会话已饱和的片段
+    也改由本地识别Worker处理，而不是继续排队等待Azure配额。
+    启用对冲识别时片段描述同时写入汇合哈希，供落后片段检查重新分发。
+    """
+    options = {}
+    if SEGMENT_HEDGE_ENABLED and not hedge:
+        redis_client.hset(f'segments:{task_id}', f'segment:{segment_index}', json.dumps(segment))
+    if (engine or RECOGNITION_BACKEND) != 'local' and LOCAL_ASR_OVERFLOW and _cluster_saturated(api_key, api_region):
+        engine = 'local'
+        _incr_task_metric(task_id, 'local_overflow_segments')
+        print(f"Azure会话已饱和，片段{segment_index}溢出到本地识别队列 {LOCAL_ASR_QUEUE}")
+    if (engine or RECOGNITION_BACKEND) == 'local':
+        options['queue'] = LOCAL_ASR_QUEUE
+    process_audio_segment.apply_async(
+        args=(segment, task_id, segment_index, estimated_total, language, api_key, api_region, engine, hedge),
+        link=collect_segment_result.s(task_id),
+        link_error=collect_segment_failure.s(task_id),
+        **options
+    )
+
+def _hedge_threshold(durations):
+    """根据已完成片段的耗时（秒）计算落后阈值；未启用或样本不足时返回None"""
+    if not SEGMENT_HEDGE_ENABLED or len(durations) < max(1, SEGMENT_HEDGE_MIN_SAMPLES):
+        return None
+    ordered = sorted(durations)
+    rank = min(len(ordered) - 1, int(len(ordered) * SEGMENT_HEDGE_PERCENTILE / 100.0))
+    return max(SEGMENT_HEDGE_MIN_SECONDS, ordered[rank] * SEGMENT_HEDGE_MULTIPLIER)
+
+@celery.task(name='tasks.hedge_segment_stragglers')
+def hedge_segment_stragglers(task_id, language, api_key, api_region, engine=None):
+    """
+    Celery分发模式下定期检查落后片段，并为其再分发一次识别
+    
+    各片段的首次开始时间和完成耗时记录在汇合哈希中；所有片段都已开始后，
+    耗时超过阈值且尚未对冲的片段再分发一次，先完成的结果由 collect_segment_result 记录，
+    另一次识别发现结果已存在后停止。合并已触发、任务已删除或汇合哈希过期后不再检查。
+    """
+    join_key = f'segments:{task_id}'
+    try:
+        fields = redis_client.hgetall(join_key)
+    except Exception as e:
+        print(f"读取分段汇合状态失败: {str(e)}")
+        return
+    if not fields or b'combined' in fields or b'total' not in fields:
+        return
+    
+    total = int(fields[b'total'])
+    started = {
+        int(field[len(b'started:'):]): float(value)
+        for field, value in fields.items() if field.startswith(b'started:')
+    }
+    durations = [float(value) for field, value in fields.items() if field.startswith(b'elapsed:')]
+    threshold = _hedge_threshold(durations)
+    if threshold is not None and len(started) >= total:
+        now = time.time()
+        for index, start_time in started.items():
+            if f'result:{index}'.encode() in fields or now - start_time <= threshold:
+                continue
+            segment_json = fields.get(f'segment:{index}'.encode())
+            if segment_json is None or not redis_client.hsetnx(join_key, f'hedged:{index}', 1):
+                continue
+            _incr_task_metric(task_id, 'hedged_segments')
+            print(f"片段{index}已识别 {int(now - start_time)} 秒，超过落后阈值 {int(threshold)} 秒，发起对冲识别")
+            _dispatch_segment(json.loads(segment_json), task_id, index, total, language, api_key, api_region, engine, hedge=True)
+    
+    hedge_segment_stragglers.apply_async(args=(task_id, language, api_key, api_region, engine),
+                                         countdown=SEGMENT_HEDGE_CHECK_INTERVAL)
+
+def _task_word_separator(task_id):
+    """按任务语言决定重新拼接词时使用的分隔符（中日泰等语言的词之间不加空格）"""
+    try:
+        task_info = json.loads(redis_client.hget(f'task:{task_id}', 'info') or '{}')
+    except Exception:
+        task_info = {}
+    language = (task_info.get('language') or '').split('-')[0].lower()
+    return '' if language in ('zh', 'ja', 'th', 'lo', 'km', 'my') else ' '
+
+def _merge_segment_timings(results, word_separator=' '):
+    """
+    按片段起点平移并拼接各片段的时间轴
+    
+    相邻片段都识别成功且后一片段带有重叠窗口时，以重叠窗口的中点为界：
+    前一片段保留中点之前的词，后一片段保留中点之后的词。切分点附近的词在各自保留的一侧是完整的。
+    
+    Args:
+        results: 成功片段的识别结果（已按 index 排序）
+        word_separator: 重新拼接被截断句子时词之间的分隔符
         
-        return {'index': segment_index, 'text': '', 'error': error_msg}
+    Returns:
+        tuple: (TranscriptTimings, 各句文本列表)；没有时间轴的片段整体使用其文本
+    """
+    by_index = {r['index']: r for r in results}
+    merged = TranscriptTimings()
+    phrases = []
+    for r in results:
+        start = r.get('start', 0.0)
+        keep_from = keep_until = None
+        if r.get('overlap') and r['index'] - 1 in by_index:
+            keep_from = start + r['overlap'] / 2
+        following = by_index.get(r['index'] + 1)
+        if following and following.get('overlap'):
+            keep_until = following.get('start', 0.0) + following['overlap'] / 2
+        if r.get('timings'):
+            phrases.extend(merged.extend(TranscriptTimings.decode(r['timings']), start,
+                                         keep_from, keep_until, word_separator))
+        elif r.get('text'):
+            phrases.append(r['text'])
+    return merged, phrases
 
 @celery.task(name='tasks.combine_segment_results')
 def combine_segment_results(results, task_id):
@@ -631,6 +1946,9 @@ def combine_segment_results(results, task_id):
         # 打印收到的结果数量
         print(f"收到分段结果，总共 {len(results)} 个片段")
         
+        # 先写出本进程中尚未写入的进度事件，之后的合并阶段进度同步写入
+        _progress_publisher.flush(task_id)
+        
         # 更新进度 - 开始合并阶段 - 95%
         update_task_progress(task_id, 95, "开始合并识别结果...")
         
@@ -663,8 +1981,12 @@ def combine_segment_results(results, task_id):
         # 更新进度 - 错误检查完成 - 97%
         update_task_progress(task_id, 97, "正在检查分段结果...")
         
-        # 合并文本（只使用成功处理的片段）
-        combined_text = " ".join(r['text'] for r in successful_results if r.get('text'))
+        # 合并文本和时间轴（只使用成功处理的片段）；重叠分段按词级时间戳去掉重复部分
+        combined_timings, combined_phrases = _merge_segment_timings(successful_results, _task_word_separator(task_id))
+        if any(r.get('overlap') for r in successful_results):
+            combined_text = " ".join(combined_phrases)
+        else:
+            combined_text = " ".join(r['text'] for r in successful_results if r.get('text'))
         
         # 更新进度 - 文本合并完成 - 98%
         update_task_progress(task_id, 98, "已合并文本，准备输出结果...")
@@ -678,14 +2000,15 @@ def combine_segment_results(results, task_id):
         
         # 更新进度 - 即将完成 - 99%
         update_task_progress(task_id, 99, "识别完成，正在保存结果...")
-        time.sleep(0.5)  # 短暂延迟，使进度更新能够显示
         
         # 更新最终结果
         update_task_progress(task_id, 100, combined_text, 'completed')
         print(f"成功合并 {len(successful_results)}/{len(sorted_results)} 个片段的文本，总长度: {len(combined_text)}")
         
-        # 自动保存TXT文件
+        # 自动保存TXT文件和时间轴
         _save_transcription_to_txt(task_id, combined_text)
+        _save_transcript_timings(task_id, combined_timings)
+        _store_transcript_cache(task_id, combined_text)
         
         return {'status': 'success', 'text': combined_text}
     except Exception as e:
@@ -693,9 +2016,211 @@ def combine_segment_results(results, task_id):
         print(f"合并结果时发生错误: {error_msg}")
         update_task_progress(task_id, 100, status='failed')
         return {'status': 'error', 'error': error_msg}
+    finally:
+        # 所有分段都已处理完毕，清理临时分段目录和汇合计数
+        _cleanup_segment_temp_dir(task_id)
+        redis_client.delete(f'segments:{task_id}', f'segment_backlog:{task_id}', f'partial_segments:{task_id}')
+        redis_client.hdel(f'task:{task_id}', 'partial_text')
+
+def _transcribe_streaming(task_id, file_path, language, api_key, api_region, parallel_threads, segment_length, persistent_audio_path=None, engine=None, duration=None):
+    """
+    流式识别：ffmpeg把PCM写到stdout，读取线程按分段长度把数据推送给多个Azure推送流，
+    同时把同一份数据写成持久化WAV副本。识别在转码开始后几秒内即可启动。
+    
+    会话与分段模式一样受本地引擎名额或自适应并发上限、以及集群会话配额的约束；
+    SEGMENT_OVERLAP 大于0时，每个会话（第一个除外）先重放上一会话末尾的重叠音频。
+    
+    Args:
+        task_id: 任务ID
+        file_path: 原始音频/视频文件路径
+        language: 语言代码
+        api_key: Azure API密钥
+        api_region: Azure API区域
+        parallel_threads: 同时进行识别的会话数上限
+        segment_length: 每个识别会话的音频长度（秒）
+        persistent_audio_path: 持久化WAV副本路径，为None时不保存
+        engine: 识别后端，为None时使用 RECOGNITION_BACKEND
+        duration: 已知的音频时长（秒），为None时探测（结果来自探测缓存）
+        
+    Returns:
+        list: 各分段识别结果（结构与 process_audio_segment 的返回值一致）；转码失败时返回None
+    """
+    cmd = [
+        'ffmpeg', '-i', file_path,
+        '-vn',
+        '-acodec', 'pcm_s16le',    # PCM 16bit编码
+        '-ar', '16000',            # 16kHz采样率
+        '-ac', '1',                # 单声道
+        '-f', 's16le',             # 输出裸PCM
+        'pipe:1'
+    ]
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    
+    # 持续读取stderr，避免管道写满阻塞ffmpeg
+    stderr_lines = []
+    stderr_thread = threading.Thread(target=lambda: stderr_lines.extend(process.stderr), daemon=True)
+    stderr_thread.start()
+    
+    bytes_per_second = TARGET_SAMPLE_RATE * TARGET_CHANNELS * TARGET_BITS_PER_SAMPLE // 8
+    segment_bytes = segment_length * bytes_per_second
+    overlap_bytes = int(SEGMENT_OVERLAP * bytes_per_second) if SEGMENT_OVERLAP > 0 else 0
+    overlap_bytes -= overlap_bytes % (TARGET_CHANNELS * TARGET_BITS_PER_SAMPLE // 8)
+    expected_duration = duration if duration else get_audio_duration(file_path)
+    estimated_segments = int(expected_duration / segment_length) + 1 if expected_duration > 0 else 1
+    
+    backend = _create_recognition_backend(api_key, api_region, language, engine)
+    use_local = backend.name == 'local'
+    
+    # 同时打开的识别会话数受parallel_threads限制；达到上限时读取线程阻塞，ffmpeg随之被反压
+    session_slots = threading.BoundedSemaphore(max(1, parallel_threads))
+    results = []
+    results_lock = threading.Lock()
+    waiter_threads = []
+    
+    def release_slots(session, category=None, started=True):
+        if _release_cluster_session(session['cluster_limiter'], session['lease_id'], started, category):
+            print(f"Azure限流，{api_region} 并发上限降至 {session['cluster_limiter'].limit()}")
+        if use_local:
+            _local_asr_slots.release()
+        session_slots.release()
+    
+    def start_session(index, overlap_seconds):
+        # 与分段模式相同：本地引擎占用本进程的CPU名额，Azure会话受集群配额和自适应并发上限约束
+        session = {'index': index, 'phrases': [], 'timings': TranscriptTimings(), 'error': None, 'error_code': None,
+                   'done': threading.Event(), 'overlap': overlap_seconds, 'cluster_limiter': None, 'lease_id': None}
+        session_slots.acquire()
+        if use_local:
+            _local_asr_slots.acquire()
+        try:
+            if not use_local:
+                session['cluster_limiter'], session['lease_id'] = _acquire_cluster_session(
+                    api_key, api_region, segment_length + overlap_seconds, 660, task_id)
+            recognition = backend.create_session()
+        except Exception:
+            release_slots(session, started=False)
+            raise
+        
+        def recognized_cb(text, offset, duration, words=None):
+            if text.strip():
+                session['phrases'].append(text)
+                session['timings'].add_phrase(text, offset, duration, words)
+                if len(session['phrases']) == 1:
+                    _record_first_text(task_id)
+                _publish_partial_text(task_id, index, " ".join(session['phrases']))
+                print(f"流式片段{index}识别到: {text}")
+        
+        def canceled_cb(error_code, error_details):
+            session['error'] = error_details
+            session['error_code'] = error_code
+            print(f"流式片段{index}识别取消: {error_details}")
+            session['done'].set()
+        
+        def session_stopped_cb():
+            session['done'].set()
+        
+        recognition.connect(recognized_cb, canceled_cb, session_stopped_cb)
+        recognition.start()
+        
+        session['recognition'] = recognition
+        print(f"流式片段{index}开始识别")
+        return session
+    
+    def finish_session(session):
+        category = CANCEL_TRANSIENT  # 超时或出错时不计为成功
+        try:
+            if not session['done'].wait(timeout=600):
+                print(f"流式片段{session['index']}识别超时")
+            else:
+                category = classify_cancellation(session['error_code'], session['error']) if session['error'] else None
+            session['recognition'].stop()
+            result = {'index': session['index'], 'text': " ".join(session['phrases']),
+                      'start': session['index'] * segment_length - session['overlap'],
+                      'overlap': session['overlap'], 'timings': session['timings'].encode()}
+            if session['error'] and not session['phrases']:
+                result['error'] = session['error']
+            if category == CANCEL_THROTTLED:
+                _incr_task_metric(task_id, 'throttle_events')
+            _publish_partial_text(task_id, session['index'], result['text'], done=True)
+            with results_lock:
+                results.append(result)
+                completed = len(results)
+            update_progress_counter(task_id, max(estimated_segments, completed + 1), completed)
+        finally:
+            release_slots(session, category)
+    
+    def close_session(session):
+        session['recognition'].close()
+        waiter = threading.Thread(target=finish_session, args=(session,), daemon=True)
+        waiter.start()
+        waiter_threads.append(waiter)
+    
+    def read_stream():
+        wav_out = None
+        current = None
+        current_bytes = 0
+        next_index = 0
+        # 上一会话末尾的音频，新会话开始时先重放这一段作为重叠窗口
+        tail = b''
+        try:
+            if persistent_audio_path:
+                wav_out = wave.open(persistent_audio_path, 'wb')
+                wav_out.setnchannels(TARGET_CHANNELS)
+                wav_out.setsampwidth(TARGET_BITS_PER_SAMPLE // 8)
+                wav_out.setframerate(TARGET_SAMPLE_RATE)
+            
+            while True:
+                chunk = process.stdout.read(PCM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                # 持久化副本与识别共用同一份数据
+                if wav_out:
+                    wav_out.writeframesraw(chunk)
+                
+                position = 0
+                while position < len(chunk):
+                    if current is None:
+                        current = start_session(next_index, len(tail) / bytes_per_second)
+                        next_index += 1
+                        current_bytes = 0
+                        if tail:
+                            current['recognition'].write(tail)
+                    take = min(len(chunk) - position, segment_bytes - current_bytes)
+                    data = chunk[position:position + take]
+                    current['recognition'].write(data)
+                    if overlap_bytes:
+                        tail = (tail + data)[-overlap_bytes:]
+                    position += take
+                    current_bytes += take
+                    if current_bytes >= segment_bytes:
+                        close_session(current)
+                        current = None
+        except Exception as e:
+            print(f"流式读取音频时发生错误: {str(e)}")
+            process.kill()
+        finally:
+            if current is not None:
+                close_session(current)
+            if wav_out:
+                # wave在关闭时回填RIFF/data长度
+                wav_out.close()
+    
+    reader_thread = threading.Thread(target=read_stream, daemon=True)
+    reader_thread.start()
+    reader_thread.join()
+    process.wait()
+    stderr_thread.join(timeout=5)
+    for waiter in waiter_threads:
+        waiter.join()
+    _progress_publisher.flush(task_id)
+    
+    if process.returncode != 0 and not results:
+        print(f"流式转码失败: {b''.join(stderr_lines).decode(errors='ignore')}")
+        return None
+    
+    return sorted(results, key=lambda r: r['index'])
 
-@celery.task
-def transcribe_audio(file_path, language='ja-JP', file_type=None, api_key=None, api_region=None, parallel_threads=None, segment_length=None, original_duration=0.0):
+@celery.task(time_limit=TRANSCRIBE_TIME_LIMIT)
+def transcribe_audio(file_path, language='ja-JP', file_type=None, api_key=None, api_region=None, parallel_threads=None, segment_length=None, original_duration=0.0, engine=None, content_hash=None):
     """
     异步处理音频/视频文件并转文字
     
@@ -708,8 +2233,11 @@ def transcribe_audio(file_path, language='ja-JP', file_type=None, api_key=None,
         parallel_threads: 并行处理线程数（默认为CPU核心数-1）
         segment_length: 音频分段长度（秒）（默认300秒）
         original_duration: 原始文件的时长（秒）
+        engine: 识别后端（azure / local / fake），为None时使用 RECOGNITION_BACKEND
+        content_hash: file_path 的SHA-256内容哈希（Web端上传时计算），用作探测缓存键
     """
     task_id = transcribe_audio.request.id
+    engine = engine or RECOGNITION_BACKEND
     
     # 确保参数是正确的类型
     try:
@@ -737,17 +2265,20 @@ def transcribe_audio(file_path, language='ja-JP', file_type=None, api_key=None,
     masked_key = "********"
     if api_key and len(api_key) > 8:
         masked_key = api_key[:4] + "****" + api_key[-4:]
-    print(f"开始处理任务：ID={task_id}, 文件={file_path}, 语言={language}, 文件类型={file_type}, API密钥={masked_key}, 区域={api_region}, 并行线程数={parallel_threads}, 分段长度={segment_length}秒, 原始时长={original_duration}秒")
+    print(f"开始处理任务：ID={task_id}, 文件={file_path}, 语言={language}, 文件类型={file_type}, API密钥={masked_key}, 区域={api_region}, 并行线程数={parallel_threads}, 分段长度={segment_length}秒, 原始时长={original_duration}秒, 识别后端={engine}")
     
     # 初始化任务进度
     update_task_progress(task_id, 0, "任务初始化...")
     
-    # 检查参数
-    if not api_key:
+    # 检查参数；本地识别引擎不需要Azure密钥，但需要本Worker已安装引擎和该语言的模型
+    if engine == 'local':
+        if not local_asr_available(language):
+            update_task_progress(task_id, 0, status='failed')
+            return {'status': 'error', 'error': f'本地识别引擎不可用：未安装vosk或缺少模型 {_local_model_path(language)}'}
+    elif not api_key:
         update_task_progress(task_id, 0, status='failed')
         return {'status': 'error', 'error': '未提供Azure Speech API密钥'}
-    
-    if not api_region:
+    elif not api_region:
         update_task_progress(task_id, 0, status='failed')
         return {'status': 'error', 'error': '未提供Azure Speech API区域'}
     
@@ -756,6 +2287,18 @@ def transcribe_audio(file_path, language='ja-JP', file_type=None, api_key=None,
         update_task_progress(task_id, 0, status='failed')
         return {'status': 'error', 'error': f'文件不存在: {file_path}'}
     
+    # Web端不再在请求线程中探测时长，由Worker探测（结果进入共享缓存）并回写任务信息
+    if not original_duration:
+        original_duration = get_audio_duration(file_path, content_hash)
+        try:
+            task_info_json = redis_client.hget(f'task:{task_id}', 'info')
+            if task_info_json:
+                task_info = json.loads(task_info_json)
+                task_info['original_duration'] = original_duration
+                redis_client.hset(f'task:{task_id}', 'info', json.dumps(task_info))
+        except Exception as e:
+            print(f"回写原始时长失败: {str(e)}")
+    
     audio_path = file_path
     extracted_audio = None
     converted_wav = None
@@ -764,6 +2307,35 @@ def transcribe_audio(file_path, language='ja-JP', file_type=None, api_key=None,
     try:
         update_task_progress(task_id, 5, "准备音频文件...")
         
+        # 流式模式：转码与识别同时进行，不生成中间WAV
+        if STREAMING_ENABLED:
+            update_task_progress(task_id, 10, "流式转码并识别音频...")
+            task_info_json = redis_client.hget(f'task:{task_id}', 'info')
+            task_info = json.loads(task_info_json) if task_info_json else None
+            persistent_audio_file = None
+            final_persistent_audio_path = None
+            if task_info:
+                persistent_audio_file = _task_download_path(task_id, 'audio', _build_persistent_audio_filename(task_info, '.wav'))
+                final_persistent_audio_path = os.path.join('downloads', persistent_audio_file)
+            
+            segment_results = _transcribe_streaming(
+                task_id, file_path, language, api_key, api_region,
+                parallel_threads, segment_length, final_persistent_audio_path, engine,
+                duration=original_duration
+            )
+            
+            if final_persistent_audio_path and os.path.exists(final_persistent_audio_path):
+                task_info['processed_audio_file'] = persistent_audio_file
+                redis_client.hset(f'task:{task_id}', 'info', json.dumps(task_info))
+                print(f"已保存处理后的音频到: {final_persistent_audio_path}")
+            
+            if segment_results is None:
+                update_task_progress(task_id, 15, status='failed')
+                return {'status': 'error', 'error': '音频转码失败'}
+            
+            # 所有会话都已结束，直接在当前任务内合并结果
+            return combine_segment_results(segment_results, task_id)
+        
         # 如果是视频文件，先提取音频为WAV格式
         if file_type == 'video':
             file_name = os.path.basename(file_path)
@@ -788,10 +2360,16 @@ def transcribe_audio(file_path, language='ja-JP', file_type=None, api_key=None,
         # 如果是音频文件但不是WAV格式或需要转换采样率，转换为16kHz WAV格式
         else:
             file_name = os.path.basename(file_path)
-            file_ext = os.path.splitext(file_name)[1].lower()
             
-            # 检查是否需要转换格式
-            if file_ext != '.wav' or True:  # 始终进行转换以确保正确格式
+            # 通过RIFF头判断是否已经是识别所需格式（不依赖扩展名）
+            wav_header = read_wav_header(file_path)
+            
+            if is_speech_compatible_wav(wav_header):
+                # 已是16kHz单声道16bit PCM（例如 /api/complete-conversion 转换后的文件），直接使用
+                print(f"音频已是16kHz单声道PCM WAV，跳过转码: {file_path}")
+                update_task_progress(task_id, 10, "音频格式已符合要求，跳过转换...")
+                audio_path = file_path
+            else:
                 file_base = os.path.splitext(file_name)[0]
                 converted_wav_filename = f"temp_converted_audio_{file_base}_{task_id}.wav"
                 converted_wav = os.path.join(os.getcwd(), converted_wav_filename)
@@ -799,7 +2377,14 @@ def transcribe_audio(file_path, language='ja-JP', file_type=None, api_key=None,
                 
                 update_task_progress(task_id, 10, "转换音频格式...")
                 
-                if not convert_audio_to_wav(file_path, converted_wav):
+                # 16bit PCM WAV只需降混/重采样，在进程内完成；其他格式使用ffmpeg转码
+                if can_resample_in_process(wav_header):
+                    print(f"进程内重采样: {wav_header['sample_rate']}Hz/{wav_header['channels']}声道 -> 16000Hz/单声道")
+                    converted = resample_pcm_wav(file_path, converted_wav, wav_header)
+                else:
+                    converted = convert_audio_to_wav(file_path, converted_wav)
+                
+                if not converted:
                     update_task_progress(task_id, 15, status='failed')
                     return {'status': 'error', 'error': '音频格式转换失败'}
                     
@@ -818,36 +2403,15 @@ def transcribe_audio(file_path, language='ja-JP', file_type=None, api_key=None,
                 task_info = json.loads(task_info_json)
                 # Log the task_info and specifically the override value when persisting audio
                 print(f"[Celery Task {task_id} - Persist WAV] Task info from Redis: {task_info}")
-                original_name_for_naming = task_info.get('original_name', 'unknown_file')
-                created_at_timestamp = task_info.get('created_at', time.time())
-                filename_ts_override = task_info.get('filename_timestamp_override') 
-                print(f"[Celery Task {task_id} - Persist WAV] filename_timestamp_override from Redis: {filename_ts_override}")
+                print(f"[Celery Task {task_id} - Persist WAV] filename_timestamp_override from Redis: {task_info.get('filename_timestamp_override')}")
 
                 # This will always be .wav because audio_path is the converted/extracted WAV
                 processed_audio_extension = os.path.splitext(audio_path)[1] 
-
-                persistent_audio_filename = ""
-                if original_name_for_naming == "microphone-recording.wav":
-                    if filename_ts_override:
-                        persistent_audio_filename = f"{filename_ts_override}-recording{processed_audio_extension}"
-                    else:
-                        # Fallback to created_at
-                        dt_object = datetime.fromtimestamp(float(created_at_timestamp))
-                        formatted_timestamp = dt_object.strftime("%Y-%m-%d-%H-%M-%S")
-                        persistent_audio_filename = f"{formatted_timestamp}-recording{processed_audio_extension}"
-                else:
-                    base_name = os.path.splitext(original_name_for_naming)[0]
-                    # For other uploaded files, use base name + extension. Override not typically used here for WAV.
-                    persistent_audio_filename = f"{base_name}{processed_audio_extension}"
+                persistent_audio_file = _task_download_path(
+                    task_id, 'audio', _build_persistent_audio_filename(task_info, processed_audio_extension))
+                final_persistent_audio_path = os.path.join('downloads', persistent_audio_file)
                 
-                persistent_audio_dir = os.path.join('downloads', 'audio')
-                if not os.path.exists(persistent_audio_dir):
-                    os.makedirs(persistent_audio_dir, exist_ok=True)
-                
-                final_persistent_audio_path = os.path.join(persistent_audio_dir, persistent_audio_filename)
-                
-                # Add a small delay and check file existence before copying
-                time.sleep(0.5) # छोटा विराम
+                # Check file existence before copying
                 if os.path.exists(audio_path) and os.path.getsize(audio_path) > 0:
                     shutil.copy(audio_path, final_persistent_audio_path)
                     print(f"已保存处理后的音频到: {final_persistent_audio_path}, 源文件: {audio_path}, 大小: {os.path.getsize(audio_path)} bytes")
@@ -858,7 +2422,7 @@ def transcribe_audio(file_path, language='ja-JP', file_type=None, api_key=None,
 
                 # Store the relative path for deletion logic later ONLY IF copy was successful
                 if os.path.exists(final_persistent_audio_path):
-                    task_info['processed_audio_file'] = os.path.join('audio', persistent_audio_filename)
+                    task_info['processed_audio_file'] = persistent_audio_file
                     redis_client.hset(f'task:{task_id}', 'info', json.dumps(task_info))
                 else:
                     print(f"[Warning] 处理后的音频文件未能保存到 {final_persistent_audio_path}，将不会在Redis中记录 processed_audio_file")
@@ -894,97 +2458,69 @@ def transcribe_audio(file_path, language='ja-JP', file_type=None, api_key=None,
             # 初始化进度计数器，单段处理（总共10段，初始为0段完成）
             update_progress_counter(task_id, 10, 0, "开始识别短音频...")
             
-            # 配置Azure语音识别
+            # 创建识别会话
             try:
-                speech_config = speechsdk.SpeechConfig(subscription=speech_key, region=speech_region)
-                speech_config.speech_recognition_language = language
-                
-                # 根据微软文档配置识别选项
-                speech_config.set_property_by_name("DiarizationEnabled", "true")
-                speech_config.set_property_by_name("ProfanityFilterMode", "None")
-                speech_config.request_word_level_timestamps()
-                
-                # 创建音频配置和识别器
-                audio_config = speechsdk.audio.AudioConfig(filename=audio_path)
-                speech_recognizer = speechsdk.SpeechRecognizer(speech_config=speech_config, audio_config=audio_config)
+                backend = _create_recognition_backend(speech_key, speech_region, language, engine)
+                session = backend.create_session(audio_path=audio_path)
             except Exception as config_error:
                 update_task_progress(task_id, 30, status='failed')
                 return {'status': 'error', 'error': f'配置Speech服务失败: {str(config_error)}'}
             
             # 使用连续识别方法处理音频
             all_results = []
-            done = False
+            short_timings = TranscriptTimings()
             result_counter = 0
             
-            # 创建事件处理程序
-            def recognized_cb(evt):
+            # 识别到文本时的处理
+            def on_recognized(text, offset, duration, words=None):
                 nonlocal result_counter
-                text = evt.result.text
-                if text.strip():
-                    all_results.append(text)
-                    # 实时更新当前识别结果
-                    current_text = " ".join(all_results)
-                    # 计算粗略进度
-                    result_counter += 1
-                    progress = min(20 + int(result_counter * 75 / 10), 95)
-                    update_task_progress(task_id, progress, current_text)
-                    # 短音频也使用计数器方式更新进度
-                    update_progress_counter(task_id, 10, min(result_counter, 9))
-                    print(f"识别到文本: {text}")
-            
-            def canceled_cb(evt):
-                nonlocal done
-                print(f"识别取消: {evt.reason}")
-                print(f"取消详情: {evt.cancellation_details}")
-                done = True
-            
-            def session_stopped_cb(evt):
-                nonlocal done
-                print("会话结束")
-                done = True
-            
-            # 添加回调
-            speech_recognizer.recognized.connect(recognized_cb)
-            speech_recognizer.canceled.connect(canceled_cb)
-            speech_recognizer.session_stopped.connect(session_stopped_cb)
-            
-            # 开始连续识别
-            speech_recognizer.start_continuous_recognition_async()
+                all_results.append(text)
+                short_timings.add_phrase(text, offset, duration, words)
+                if len(all_results) == 1:
+                    _record_first_text(task_id)
+                # 实时更新当前识别结果
+                current_text = " ".join(all_results)
+                # 计算粗略进度
+                result_counter += 1
+                progress = min(20 + int(result_counter * 75 / 10), 95)
+                _progress_publisher.progress(task_id, progress, current_text)
+                # 短音频也使用计数器方式更新进度
+                _progress_publisher.counter(task_id, 10, min(result_counter, 9))
+                print(f"识别到文本: {text}")
             
             # 等待识别完成
             timeout = 1200  # 20分钟超时（足够大多数短音频）
-            start_time = time.time()
-            last_update_time = start_time
             progress_value = 20  # 短音频处理从20%开始
             
-            while not done and (time.time() - start_time) < timeout:
-                time.sleep(0.5)  # 减少等待时间，更频繁检查状态
+            # 每2秒更新一次进度，即使没有新的识别结果
+            def on_tick(elapsed):
+                nonlocal progress_value
+                # 计算经过时间的百分比，最多到80%（留20%给最后处理）
+                elapsed_percent = min(0.8, elapsed / (timeout * 0.5))  # 乘以0.5加快进度增长
+                # 计算基于时间的进度值
+                time_based_progress = 20 + int(elapsed_percent * 75)
                 
-                # 每2秒更新一次进度，即使没有新的识别结果
-                current_time = time.time()
-                if current_time - last_update_time >= 2:
-                    last_update_time = current_time
+                # 如果基于时间的进度比当前进度大，则更新
+                if time_based_progress > progress_value:
+                    progress_value = time_based_progress
+                    time_based_segment = elapsed_percent * 10  # 假设短音频有10个虚拟片段
                     
-                    # 计算经过时间的百分比，最多到80%（留20%给最后处理）
-                    elapsed_percent = min(0.8, (current_time - start_time) / (timeout * 0.5))  # 乘以0.5加快进度增长
-                    # 计算基于时间的进度值
-                    time_based_progress = 20 + int(elapsed_percent * 75)
+                    # 更新进度
+                    _progress_publisher.progress(task_id, progress_value, f"音频处理中: {progress_value}%...")
+                    # 更新进度计数器
+                    _progress_publisher.counter(task_id, 10, time_based_segment)
                     
-                    # 如果基于时间的进度比当前进度大，则更新
-                    if time_based_progress > progress_value:
-                        progress_value = time_based_progress
-                        time_based_segment = elapsed_percent * 10  # 假设短音频有10个虚拟片段
-                        
-                        # 更新进度
-                        update_task_progress(task_id, progress_value, f"音频处理中: {progress_value}%...")
-                        # 更新进度计数器
-                        update_progress_counter(task_id, 10, time_based_segment)
-                        
-                        print(f"短音频处理中: {progress_value}% (基于时间)")
+                    print(f"短音频处理中: {progress_value}% (基于时间)")
             
-            # 停止识别
-            speech_recognizer.stop_continuous_recognition_async()
-            time.sleep(2)  # 等待停止完成
+            # 开始连续识别，会话结束或取消时立即返回；会话前先获取集群级会话许可
+            cluster_limiter, lease_id = None, None
+            if backend.name != 'local':
+                cluster_limiter, lease_id = _acquire_cluster_session(speech_key, speech_region, audio_duration, timeout + 60)
+            try:
+                _run_continuous_recognition(session, on_recognized, timeout, "短音频", on_tick=on_tick)
+            finally:
+                _release_cluster_session(cluster_limiter, lease_id)
+                _progress_publisher.flush(task_id)
             
             # 检查结果
             if all_results:
@@ -992,8 +2528,10 @@ def transcribe_audio(file_path, language='ja-JP', file_type=None, api_key=None,
                 result_text = " ".join(all_results)
                 update_task_progress(task_id, 100, result_text, 'completed')
                 
-                # 自动保存TXT文件 (短音频)
+                # 自动保存TXT文件和时间轴 (短音频)
                 _save_transcription_to_txt(task_id, result_text)
+                _save_transcript_timings(task_id, short_timings)
+                _store_transcript_cache(task_id, result_text)
                 
                 return {'status': 'success', 'text': result_text}
             else:
@@ -1037,46 +2575,110 @@ def transcribe_audio(file_path, language='ja-JP', file_type=None, api_key=None,
                 update_task_progress(task_id, 18, status='failed')
                 return {'status': 'error', 'error': error_msg}
             
-            # 分割音频文件
+            # 分割音频文件：每得到一个分段就立即分发识别，分割与识别重叠进行
             update_task_progress(task_id, 18, "正在分割音频文件...")
-            segment_files = split_audio_file(audio_path, temp_dir, segment_length=segment_length, max_segments=parallel_threads*3)
-            
-            if not segment_files:
-                error_msg = f"分割音频文件失败，未能生成任何有效的分段文件 from {audio_path} into {temp_dir}"
-                print(error_msg)
-                update_task_progress(task_id, 19, status='failed')
-                return {'status': 'error', 'error': error_msg}
+            max_segments = parallel_threads * 3
+            wav_header = read_wav_header(audio_path)
+            if is_speech_compatible_wav(wav_header):
+                # 已是16kHz单声道PCM：把源WAV移入临时目录，分段只记录字节范围，不再调用ffmpeg写分段文件
+                os.makedirs(temp_dir, exist_ok=True)
+                source_wav = os.path.join(temp_dir, 'source.wav')
+                shutil.move(audio_path, source_wav)
+                audio_path = source_wav
+                if VAD_ENABLED:
+                    planned_segments = plan_vad_segments(source_wav, wav_header, segment_length, max_segments=max_segments,
+                                                         first_lengths=PROGRESSIVE_SEGMENT_LENGTHS)
+                    if not planned_segments:
+                        print(f"VAD未检测到任何语音: {source_wav}")
+                        update_task_progress(task_id, 19, status='failed')
+                        return {'status': 'error', 'error': '未检测到任何语音内容'}
+                else:
+                    planned_segments = plan_pcm_segments(source_wav, wav_header, segment_length, max_segments=max_segments,
+                                                         first_lengths=PROGRESSIVE_SEGMENT_LENGTHS)
+                apply_segment_overlap(planned_segments, wav_header, SEGMENT_OVERLAP)
+                estimated_total = max(1, len(planned_segments))
+                # 分段已全部规划好：渐进分段的短片段最先提交，其余按时长从长到短提交
+                leading = len(progressive_lengths(_effective_segment_length(audio_duration, segment_length, max_segments),
+                                                  PROGRESSIVE_SEGMENT_LENGTHS))
+                scheduled = order_longest_first(planned_segments, leading) if SEGMENT_LONGEST_FIRST else list(enumerate(planned_segments))
+                segment_durations = [segment['duration'] for _, segment in scheduled]
+                segment_source = iter(scheduled)
+            else:
+                # ffmpeg逐个写出分段，总数在分割结束前只能按时长估算（仅用于进度显示），只能按时间顺序提交
+                cut_points = segment_cut_points(audio_duration, _effective_segment_length(audio_duration, segment_length, max_segments),
+                                                PROGRESSIVE_SEGMENT_LENGTHS)
+                estimated_total = len(cut_points) + 1
+                boundaries = [0.0] + cut_points + [audio_duration]
+                segment_durations = [end - start for start, end in zip(boundaries, boundaries[1:])]
+                segment_source = enumerate(iter_audio_segments(audio_path, temp_dir, segment_length=segment_length, max_segments=max_segments,
+                                                               duration=audio_duration, first_lengths=PROGRESSIVE_SEGMENT_LENGTHS))
             
-            print(f"音频分割成功，共 {len(segment_files)} 个片段，并行处理线程: {parallel_threads}")
+            # 按提交顺序和并行数估计识别阶段的完成时间，记入任务指标
+            makespan = estimate_makespan(segment_durations, parallel_threads, _recognition_rtf(engine))
+            _set_task_metric(task_id, 'makespan_estimate_seconds', makespan)
+            print(f"预计识别阶段耗时约 {int(makespan)} 秒（{len(segment_durations)} 个片段，{parallel_threads} 个并行）")
             
             # 初始化进度计数器系统，设置总段数和初始完成数为0
-            update_progress_counter(task_id, len(segment_files), 0, f"音频已分割为 {len(segment_files)} 个片段，开始识别（{parallel_threads}个并行线程）...")
+            update_progress_counter(task_id, estimated_total, 0, f"正在分割音频并开始识别（{parallel_threads}个并行线程，预计约 {int(makespan)} 秒）...")
+            
+            # 线程池模式：在本任务内按 parallel_threads 并发识别，完成后直接合并
+            if RECOGNITION_EXECUTOR == 'threads':
+                try:
+                    segment_results = _recognize_segments_in_threads(
+                        segment_source, task_id, estimated_total, language,
+                        speech_key, speech_region, parallel_threads, engine
+                    )
+                except Exception as split_error:
+                    _cleanup_segment_temp_dir(task_id)
+                    error_msg = f"分割音频文件失败: {str(split_error)}"
+                    print(error_msg)
+                    update_task_progress(task_id, 19, status='failed')
+                    return {'status': 'error', 'error': error_msg}
+                
+                if not segment_results:
+                    _cleanup_segment_temp_dir(task_id)
+                    error_msg = f"分割音频文件失败，未能生成任何有效的分段文件 from {audio_path} into {temp_dir}"
+                    print(error_msg)
+                    update_task_progress(task_id, 19, status='failed')
+                    return {'status': 'error', 'error': error_msg}
+                
+                print(f"全部 {len(segment_results)} 个片段识别完成（{parallel_threads}个并行线程）")
+                return combine_segment_results(segment_results, task_id)
             
-            # 创建处理任务组
-            tasks_group = []
-            for i, segment_file_path in enumerate(segment_files):
-                tasks_group.append(process_audio_segment.s(
-                    segment_file_path, 
-                    task_id, 
-                    i, 
-                    len(segment_files), 
-                    language, 
-                    speech_key, 
-                    speech_region
-                ))
+            # Celery模式：每个任务同时最多 parallel_threads 个片段在队列中，其余片段完成一个分发一个
+            dispatched = 0
+            try:
+                for segment_index, segment in segment_source:
+                    _queue_segment(segment, task_id, segment_index, estimated_total, language, speech_key, speech_region, engine, parallel_threads)
+                    dispatched += 1
+                    if dispatched == 1:
+                        print(f"第一个片段已分发识别: {segment['source']} [字节 {segment['offset']} 起]")
+            except Exception as split_error:
+                # 已分发的片段仍会执行，但不再触发合并
+                _abort_segment_join(task_id)
+                error_msg = f"分割音频文件失败: {str(split_error)}"
+                print(error_msg)
+                update_task_progress(task_id, 19, status='failed')
+                return {'status': 'error', 'error': error_msg}
             
-            # 创建任务链，先并行处理所有片段，然后合并结果
-            # 使用用户指定的并行度
-            workflow = chord(group(tasks_group), combine_segment_results.s(task_id))
+            if dispatched == 0:
+                error_msg = f"分割音频文件失败，未能生成任何有效的分段文件 from {audio_path} into {temp_dir}"
+                print(error_msg)
+                update_task_progress(task_id, 19, status='failed')
+                return {'status': 'error', 'error': error_msg}
             
-            # 启动任务链
-            result = workflow.apply_async()
+            # 写入实际片段总数，最后一个完成的片段据此触发合并
+            _close_segment_join(task_id, dispatched)
+            print(f"音频分割完成，共 {dispatched} 个片段，并行处理线程: {parallel_threads}")
+            if SEGMENT_HEDGE_ENABLED:
+                hedge_segment_stragglers.apply_async(args=(task_id, language, speech_key, speech_region, engine),
+                                                     countdown=SEGMENT_HEDGE_CHECK_INTERVAL)
             
             # 返回一个标识，表明任务已分发
             # 注意：这里不等待结果，因为我们是通过Redis和进度更新来处理结果
             return {
                 'status': 'processing', 
-                'message': f'长音频处理中，共 {len(segment_files)} 个片段，并行线程: {parallel_threads}，任务ID: {task_id}',
+                'message': f'长音频处理中，共 {dispatched} 个片段，并行线程: {parallel_threads}，任务ID: {task_id}',
                 'task_id': task_id
             }
             
@@ -1096,11 +2698,10 @@ def transcribe_audio(file_path, language='ja-JP', file_type=None, api_key=None,
         # The `audio_path` variable itself (which points to one of these) will be among those deleted.
         # The copy made to `downloads/audio/` is the one that persists.
         # Segment files in `temp_dir` are deleted by `process_audio_segment` tasks.
-        # The `temp_dir` itself for segments needs to be cleaned up after chord finishes.
-        # This is complex if chord is async. Best to leave temp_dir cleanup to `delete_task` in app.py.
+        # The `temp_dir` itself for segments is removed by `combine_segment_results`
+        # once the last segment has reported back (see `collect_segment_result`).
 
         print(f"开始清理任务 {task_id} 的临时文件。")
-        time.sleep(2) # Allow for file operations to complete, though not strictly necessary for os.remove
         
         files_to_delete_in_finally = {
             "原始上传文件": file_path,
@@ -1129,5 +2730,5 @@ def transcribe_audio(file_path, language='ja-JP', file_type=None, api_key=None,
         
         # Note: `temp_dir` (for segments) is NOT cleaned here. 
         # `process_audio_segment` deletes individual segments.
-        # The `temp_dir` (e.g. temp_segments_...) should ideally be cleaned by `delete_task` in app.py
-        # or a separate cleanup Celery task, as the main task `transcribe_audio` returns before chord completion. 
\ No newline at end of file
+        # The `temp_dir` (e.g. temp_segments_...) is cleaned by `combine_segment_results`,
+        # as the main task `transcribe_audio` returns before the segments complete. 
\ No newline at end of file
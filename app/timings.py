@@ -0,0 +1,267 @@
+"""
+转写时间轴的紧凑存储与字幕导出
+
+每个任务的句子和词级时间轴按列保存：偏移和时长是并行的int32数组（毫秒），
+文本存放在去重后的字符串表中，数组里只记录字符串编号。几个小时的转写也只占几百KB，
+导出SRT/VTT/JSON时逐句生成输出，不在内存中拼出整个文档。
+
+二进制格式（小端）：
+    头部    magic(4字节) 句子数 词数 字符串数（uint32）
+    句子    offset[] duration[] text_id[] first_word[]（int32）
+    词      offset[] duration[] text_id[]（int32）
+    字符串  各字符串UTF-8字节长度[]（int32），随后是全部UTF-8字节
+"""
+import os
+import sys
+import json
+import base64
+import struct
+from array import array
+
+TIMINGS_MAGIC = b'TTM1'
+_HEADER = struct.Struct('<4sIII')
+
+# 各平台上 'i' 即为32位整数
+_INT32 = 'i' if array('i').itemsize == 4 else 'l'
+
+def _ms(seconds):
+    return int(round((seconds or 0.0) * 1000))
+
+def _to_le_bytes(values):
+    if sys.byteorder == 'big':
+        values = array(_INT32, values)
+        values.byteswap()
+    return values.tobytes()
+
+class TranscriptTimings:
+    """句子与词级时间轴（列式存储）"""
+
+    def __init__(self):
+        self.phrase_offsets = array(_INT32)
+        self.phrase_durations = array(_INT32)
+        self.phrase_texts = array(_INT32)
+        self.phrase_first_word = array(_INT32)
+        self.word_offsets = array(_INT32)
+        self.word_durations = array(_INT32)
+        self.word_texts = array(_INT32)
+        self.strings = []
+        self._string_ids = None
+
+    def __len__(self):
+        return len(self.phrase_offsets)
+
+    def _intern(self, text):
+        if self._string_ids is None:
+            self._string_ids = {text: index for index, text in enumerate(self.strings)}
+        string_id = self._string_ids.get(text)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.strings.append(text)
+            self._string_ids[text] = string_id
+        return string_id
+
+    def add_phrase(self, text, offset, duration, words=None):
+        """
+        追加一句识别结果
+
+        Args:
+            text: 句子文本
+            offset: 句子起点（秒）
+            duration: 句子时长（秒）
+            words: (词, 偏移秒, 时长秒) 序列，偏移与句子偏移使用同一起点
+        """
+        self._append_ms(text, _ms(offset), _ms(duration),
+                        [(word, _ms(word_offset), _ms(word_duration)) for word, word_offset, word_duration in words or ()])
+
+    def _append_ms(self, text, offset, duration, words):
+        self.phrase_offsets.append(offset)
+        self.phrase_durations.append(duration)
+        self.phrase_texts.append(self._intern(text))
+        self.phrase_first_word.append(len(self.word_offsets))
+        for word, word_offset, word_duration in words:
+            self.word_offsets.append(word_offset)
+            self.word_durations.append(word_duration)
+            self.word_texts.append(self._intern(word))
+
+    def extend(self, other, shift=0.0, keep_from=None, keep_until=None, word_separator=' '):
+        """
+        追加另一段时间轴（例如一个片段的结果），其所有偏移整体平移 shift 秒
+
+        指定 keep_from/keep_until（平移后的秒数）时只保留中点落在 [keep_from, keep_until) 内的词，
+        用于去掉相邻重叠片段中重复识别的词；被截断的句子用保留的词重新拼出文本，
+        没有词级时间戳的句子按句子中点整句取舍。
+
+        Returns:
+            list: 追加的各句文本
+        """
+        if keep_from is None and keep_until is None:
+            self._extend_all(other, shift)
+            return [other.strings[text_id] for text_id in other.phrase_texts]
+
+        shift_ms = _ms(shift)
+        lower = _ms(keep_from) if keep_from is not None else None
+        upper = _ms(keep_until) if keep_until is not None else None
+        def inside(offset, duration):
+            middle = offset + duration // 2
+            return (lower is None or middle >= lower) and (upper is None or middle < upper)
+
+        texts = []
+        for offset, duration, text, words in other.iter_phrases():
+            offset += shift_ms
+            words = [(word, word_offset + shift_ms, word_duration) for word, word_offset, word_duration in words]
+            if words:
+                kept = [word for word in words if inside(word[1], word[2])]
+                if not kept:
+                    continue
+                if len(kept) < len(words):
+                    text = word_separator.join(word for word, _, _ in kept)
+                    offset = kept[0][1]
+                    duration = kept[-1][1] + kept[-1][2] - offset
+                words = kept
+            elif not inside(offset, duration):
+                continue
+            self._append_ms(text, offset, duration, words)
+            texts.append(text)
+        return texts
+
+    def _extend_all(self, other, shift):
+        shift_ms = _ms(shift)
+        word_base = len(self.word_offsets)
+        string_map = [self._intern(text) for text in other.strings]
+        self.phrase_offsets.extend(offset + shift_ms for offset in other.phrase_offsets)
+        self.phrase_durations.extend(other.phrase_durations)
+        self.phrase_texts.extend(string_map[text_id] for text_id in other.phrase_texts)
+        self.phrase_first_word.extend(first + word_base for first in other.phrase_first_word)
+        self.word_offsets.extend(offset + shift_ms for offset in other.word_offsets)
+        self.word_durations.extend(other.word_durations)
+        self.word_texts.extend(string_map[text_id] for text_id in other.word_texts)
+
+    def iter_phrases(self):
+        """
+        逐句产出时间轴
+
+        Yields:
+            tuple: (偏移毫秒, 时长毫秒, 文本, [(词, 偏移毫秒, 时长毫秒), ...])
+        """
+        phrase_count = len(self.phrase_offsets)
+        for index in range(phrase_count):
+            first = self.phrase_first_word[index]
+            last = self.phrase_first_word[index + 1] if index + 1 < phrase_count else len(self.word_offsets)
+            words = [
+                (self.strings[self.word_texts[w]], self.word_offsets[w], self.word_durations[w])
+                for w in range(first, last)
+            ]
+            yield (self.phrase_offsets[index], self.phrase_durations[index],
+                   self.strings[self.phrase_texts[index]], words)
+
+    def to_bytes(self):
+        """序列化为上面描述的二进制格式"""
+        encoded = [text.encode('utf-8') for text in self.strings]
+        parts = [_HEADER.pack(TIMINGS_MAGIC, len(self.phrase_offsets), len(self.word_offsets), len(encoded))]
+        for values in (self.phrase_offsets, self.phrase_durations, self.phrase_texts, self.phrase_first_word,
+                       self.word_offsets, self.word_durations, self.word_texts,
+                       array(_INT32, (len(data) for data in encoded))):
+            parts.append(_to_le_bytes(values))
+        parts.extend(encoded)
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        从二进制数据恢复时间轴
+
+        Raises:
+            ValueError: 数据不是有效的时间轴格式
+        """
+        if len(data) < _HEADER.size:
+            raise ValueError('时间轴数据不完整')
+        magic, phrase_count, word_count, string_count = _HEADER.unpack_from(data, 0)
+        if magic != TIMINGS_MAGIC:
+            raise ValueError('不是有效的时间轴数据')
+
+        position = _HEADER.size
+        def take(count):
+            nonlocal position
+            values = array(_INT32)
+            values.frombytes(data[position:position + 4 * count])
+            if len(values) != count:
+                raise ValueError('时间轴数据不完整')
+            if sys.byteorder == 'big':
+                values.byteswap()
+            position += 4 * count
+            return values
+
+        timings = cls()
+        timings.phrase_offsets = take(phrase_count)
+        timings.phrase_durations = take(phrase_count)
+        timings.phrase_texts = take(phrase_count)
+        timings.phrase_first_word = take(phrase_count)
+        timings.word_offsets = take(word_count)
+        timings.word_durations = take(word_count)
+        timings.word_texts = take(word_count)
+        lengths = take(string_count)
+        for length in lengths:
+            timings.strings.append(bytes(data[position:position + length]).decode('utf-8'))
+            position += length
+        return timings
+
+    def encode(self):
+        """编码为ASCII字符串，便于放入Celery消息和Redis中的JSON"""
+        return base64.b64encode(self.to_bytes()).decode('ascii')
+
+    @classmethod
+    def decode(cls, text):
+        return cls.from_bytes(base64.b64decode(text))
+
+    def save(self, path):
+        """写入文件（先写临时文件再替换，读取方不会看到写了一半的文件）"""
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(self.to_bytes())
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            return cls.from_bytes(f.read())
+
+def _format_timestamp(ms, separator):
+    hours, ms = divmod(max(0, ms), 3600 * 1000)
+    minutes, ms = divmod(ms, 60 * 1000)
+    seconds, ms = divmod(ms, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}{separator}{ms:03d}"
+
+def iter_srt(timings):
+    """逐条生成SRT字幕"""
+    for number, (offset, duration, text, _) in enumerate(timings.iter_phrases(), 1):
+        yield (f"{number}\n{_format_timestamp(offset, ',')} --> {_format_timestamp(offset + duration, ',')}\n"
+               f"{text}\n\n")
+
+def iter_vtt(timings):
+    """逐条生成WebVTT字幕"""
+    yield "WEBVTT\n\n"
+    for offset, duration, text, _ in timings.iter_phrases():
+        yield f"{_format_timestamp(offset, '.')} --> {_format_timestamp(offset + duration, '.')}\n{text}\n\n"
+
+def iter_json(timings):
+    """逐句生成JSON文档 {"phrases": [{start, end, text, words: [{word, start, end}]}]}，时间单位为秒"""
+    yield '{"phrases": ['
+    for index, (offset, duration, text, words) in enumerate(timings.iter_phrases()):
+        phrase = {
+            'start': offset / 1000.0,
+            'end': (offset + duration) / 1000.0,
+            'text': text,
+            'words': [
+                {'word': word, 'start': word_offset / 1000.0, 'end': (word_offset + word_duration) / 1000.0}
+                for word, word_offset, word_duration in words
+            ]
+        }
+        yield (',\n' if index else '\n') + json.dumps(phrase, ensure_ascii=False)
+    yield '\n]}\n'
+
+# 导出格式 -> (生成器, MIME类型)
+EXPORT_FORMATS = {
+    'srt': (iter_srt, 'application/x-subrip'),
+    'vtt': (iter_vtt, 'text/vtt'),
+    'json': (iter_json, 'application/json'),
+}